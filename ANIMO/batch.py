@@ -0,0 +1,174 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import itertools
+import numpy as np
+import pandas as pd
+from community import EnergyCommunityModel
+from parameters import load_parameters
+from population import TYPOLOGIES
+from results import configuration_key
+
+
+# Runs with equal values of these columns are replicates of one configuration. The configuration column is a
+# hash of every identity field of the run specification (results.CONFIGURATION_FIELDS: also the input
+# parameters, overrides and stopping policies); the others are kept readable for labels and filtering.
+GROUP_COLUMNS = ["configuration", "scenario", "num_members", "num_prospects", "width", "height", "engine", "network"]
+
+# The last columns hold the number of members of every typology in the run (equal on all rows of a run)
+RESULT_COLUMNS = (["run_id", "replicate", "seed"] + GROUP_COLUMNS +
+                  ["stop_reason", "step", "new_members", "num_joined", "growth_percentage"] + list(TYPOLOGIES))
+
+
+# Supporting Functions
+#######################
+def make_run_specs(scenarios, num_members, num_prospects, grid_sizes, replicates, seed=None, engine="mesa",
+                   common_random_numbers=False, parameters=None, stopping=None, network="uniform",
+                   network_options=None, scenario_overrides=None):
+    # The input parameters are loaded once here and shipped to the workers with every run specification
+    if parameters is None:
+        parameters = load_parameters()
+    # One specification per (scenario x num_members x num_prospects x grid size x replicate) combination
+    combinations = list(itertools.product(scenarios, num_members, num_prospects, grid_sizes, range(replicates)))
+    if common_random_numbers:
+        # Runs with the same replicate number share their seed, so scenarios are compared on common random numbers
+        replicate_seeds = np.random.SeedSequence(seed).spawn(replicates)
+        seeds = [replicate_seeds[combination[-1]] for combination in combinations]
+    else:
+        # Independent, reproducible seeds for every run
+        seeds = np.random.SeedSequence(seed).spawn(len(combinations))
+    run_specs = []
+    for run_id, ((scenario, members, prospects, (width, height), replicate), seed_sequence) in enumerate(
+            zip(combinations, seeds)):
+        run_specs.append({
+            "run_id": run_id,
+            "replicate": replicate,
+            "seed": int(seed_sequence.generate_state(1)[0]),
+            "sweep_seed": seed,
+            "scenario": scenario,
+            "num_members": int(members),
+            "num_prospects": int(prospects),
+            "width": int(width),
+            "height": int(height),
+            "engine": engine,
+            "common_random_numbers": common_random_numbers,
+            "parameters": parameters,
+            "stopping": stopping,
+            "network": network,
+            "network_options": network_options,
+            "scenario_overrides": scenario_overrides,
+        })
+    return run_specs
+
+
+def build_model(run_spec):
+    return EnergyCommunityModel(num_members=run_spec["num_members"], num_prospects=run_spec["num_prospects"],
+                                width=run_spec["width"], height=run_spec["height"], scenario=run_spec["scenario"],
+                                engine=run_spec["engine"], seed=run_spec["seed"],
+                                common_random_numbers=run_spec["common_random_numbers"],
+                                parameters=run_spec["parameters"], network=run_spec.get("network", "uniform"),
+                                network_options=run_spec.get("network_options"),
+                                scenario_overrides=run_spec.get("scenario_overrides"))
+
+
+def run_single(run_spec):
+    # Executed in a worker process
+    model = build_model(run_spec)
+    cumulative_members = model.run_model(stopping=run_spec["stopping"])
+    model.close()
+    return run_spec, results_frame(run_spec, cumulative_members, model.num_joined_list, model.stop_reason,
+                                   typology_counts(model))
+
+
+def typology_counts(model):
+    # Number of members of every typology (in TYPOLOGIES order), as drawn for this run
+    return np.bincount(model.population.member_typology, minlength=len(TYPOLOGIES))
+
+
+def configuration_columns(run_spec):
+    # Values of the GROUP_COLUMNS of a run specification, as stored in its results
+    network = run_spec.get("network", "uniform")
+    return {
+        "configuration": configuration_key(run_spec),
+        "scenario": run_spec["scenario"],
+        "num_members": run_spec["num_members"],
+        "num_prospects": run_spec["num_prospects"],
+        "width": run_spec["width"],
+        "height": run_spec["height"],
+        "engine": run_spec["engine"],
+        "network": network if isinstance(network, str) else type(network).__name__,
+    }
+
+
+def results_frame(run_spec, cumulative_members, num_joined, stop_reason, member_typologies):
+    # Long-format results of one run: one row per step. num_joined holds the prospects joined so far after
+    # every step, new_members the model's running count (see EnergyCommunityModel.check_for_new_members)
+    new_members = np.asarray(cumulative_members, dtype=np.int64)
+    frame = pd.DataFrame({
+        "step": np.arange(1, len(new_members) + 1),
+        "new_members": new_members,
+        "num_joined": np.asarray(num_joined, dtype=np.int64),
+        "growth_percentage": new_members / run_spec["num_members"] * 100,
+    })
+    for typology, count in zip(TYPOLOGIES, member_typologies):
+        frame[typology] = int(count)
+    frame.insert(0, "stop_reason", stop_reason)
+    columns = dict({"run_id": run_spec["run_id"], "replicate": run_spec["replicate"], "seed": run_spec["seed"]},
+                   **configuration_columns(run_spec))
+    for column, value in reversed(list(columns.items())):
+        frame.insert(0, column, value)
+    return frame
+
+
+# Batch run API
+#######################
+def iter_batch_run(run_specs, processes=None):
+    # Fan the runs out over a process pool and yield each (run_spec, results) pair as soon as the run finishes
+    if processes == 1:
+        for run_spec in run_specs:
+            yield run_single(run_spec)
+        return
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(run_single, run_spec) for run_spec in run_specs]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def batch_run(scenarios=("Familiar",), num_members=(100,), num_prospects=(100,), grid_sizes=((500, 500),),
+              replicates=10, seed=None, engine="mesa", common_random_numbers=False, parameters=None,
+              stopping=None, network="uniform", network_options=None, scenario_overrides=None, processes=None,
+              store=None):
+    # Run every combination of the given parameter values and return a long-format results table
+    # stopping: list of stopping policies (see stopping.py), shipped to every worker
+    # store: a results.ResultsStore; runs already in it are skipped, new runs are written to it as they
+    #        finish and the store is returned instead of an in-memory table
+    run_specs = make_run_specs(scenarios, num_members, num_prospects, grid_sizes, replicates, seed=seed,
+                               engine=engine, common_random_numbers=common_random_numbers, parameters=parameters,
+                               stopping=stopping, network=network, network_options=network_options,
+                               scenario_overrides=scenario_overrides)
+    if store is not None:
+        completed = store.completed_runs()
+        run_specs = [run_spec for run_spec in run_specs if store.key(run_spec) not in completed]
+        for run_spec, frame in iter_batch_run(run_specs, processes=processes):
+            store.write_run(run_spec, frame)
+        return store
+    frames = [frame for _, frame in iter_batch_run(run_specs, processes=processes)]
+    if not frames:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    return pd.concat(frames, ignore_index=True).sort_values(["run_id", "step"], ignore_index=True)
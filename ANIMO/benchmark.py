@@ -0,0 +1,187 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import argparse
+import itertools
+import json
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+import pandas as pd
+from community import EnergyCommunityModel
+from parameters import load_parameters
+from profiling import StepProfiler
+from scenarios import SCENARIOS
+from stopping import MaxSteps
+
+"""Benchmark suite of the simulation hot paths.
+
+Every case builds a model with a fixed seed under a profiling.StepProfiler and runs a fixed number of
+steps, timing the construction phases (population, network, agents, prospects_find_peers), every step
+phase and the whole run. Cases sweep the engine, scenario, agent counts, grid size and reach. Results are
+appended to a JSON-lines history, and a run is compared against the previous one of the same case:
+
+    python benchmark.py --quick                 # small sweep, appended to benchmark_history.jsonl
+    python benchmark.py --threshold 0.1         # fail (exit 1) if a phase got more than 10% slower
+"""
+
+HISTORY_FILE = "benchmark_history.jsonl"
+
+# Default sweep: every combination is one case
+ENGINES = ("mesa", "array")
+SCENARIO_NAMES = tuple(SCENARIOS)
+AGENT_COUNTS = ((100, 1000), (1000, 10000))  # (members, prospects)
+GRID_SIZES = ((50, 50), (200, 200))
+REACHES = ("scenario", 1, 5)  # "scenario": the scenario's own contact ranges
+
+QUICK_AGENT_COUNTS = ((50, 500),)
+QUICK_GRID_SIZES = ((50, 50),)
+QUICK_REACHES = ("scenario",)
+
+# Fields that identify a case in the history
+CASE_FIELDS = ("engine", "scenario", "num_members", "num_prospects", "width", "height", "reach", "steps")
+
+# Phases faster than this (seconds) are too noisy to flag as regressions
+NOISE_FLOOR = 0.005
+
+
+# Supporting Functions
+#######################
+def code_version():
+    # Short git commit of the working tree, if available
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_cases(engines=ENGINES, scenarios=SCENARIO_NAMES, agent_counts=AGENT_COUNTS, grid_sizes=GRID_SIZES,
+               reaches=REACHES, steps=20):
+    return [{"engine": engine, "scenario": scenario, "num_members": members, "num_prospects": prospects,
+             "width": width, "height": height, "reach": reach, "steps": steps}
+            for engine, scenario, (members, prospects), (width, height), reach
+            in itertools.product(engines, scenarios, agent_counts, grid_sizes, reaches)]
+
+
+def run_case(case, parameters, seed=0):
+    # Seconds spent in every phase of one case (construction phases once, step phases summed over the steps)
+    # A fixed reach sets the member reach only; prospect vision and number of friends keep the scenario's ranges
+    reach = case["reach"]
+    overrides = None if reach == "scenario" else {"member_reach_range": ((1.0, reach, reach),)}
+    profiler = StepProfiler()
+    start = time.perf_counter()
+    model = EnergyCommunityModel(case["num_members"], case["num_prospects"], case["width"], case["height"],
+                                 scenario=case["scenario"], engine=case["engine"], seed=seed, parameters=parameters,
+                                 collect_data=False, profiler=profiler, scenario_overrides=overrides)
+    construction = time.perf_counter() - start
+    start = time.perf_counter()
+    model.run_model(stopping=[MaxSteps(case["steps"])])
+    run = time.perf_counter() - start
+    timings = profiler.to_dataframe().groupby("phase", sort=False)["wall_time"].sum().to_dict()
+    timings["construction"] = construction
+    timings["run_model"] = run
+    return timings
+
+
+def run_benchmarks(cases, repeats=3, seed=0, parameters=None, verbose=True):
+    # One row per case and phase with the fastest of `repeats` timings
+    if parameters is None:
+        parameters = load_parameters()
+    rows = []
+    for case in cases:
+        repeated = [run_case(case, parameters, seed=seed) for _ in range(repeats)]
+        for phase in repeated[0]:
+            rows.append(dict(case, phase=phase, seconds=min(timings[phase] for timings in repeated)))
+        if verbose:
+            print(f"{case}: run_model {min(timings['run_model'] for timings in repeated):.4f}s", flush=True)
+    return pd.DataFrame(rows)
+
+
+# History
+#######################
+def append_history(results, file_path=HISTORY_FILE):
+    # One JSON line per case and phase, tagged with the time, code version and platform
+    context = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": code_version(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+    }
+    with open(file_path, "a") as file:
+        for row in results.to_dict("records"):
+            file.write(json.dumps(dict(context, **row)) + "\n")
+
+
+def read_history(file_path=HISTORY_FILE):
+    try:
+        with open(file_path) as file:
+            return pd.DataFrame([json.loads(line) for line in file if line.strip()])
+    except FileNotFoundError:
+        return pd.DataFrame()
+
+
+def find_regressions(results, history, threshold=0.2):
+    # Phases that are more than `threshold` (a fraction) slower than in the latest earlier run of the same case
+    if history.empty:
+        return pd.DataFrame()
+    keys = list(CASE_FIELDS) + ["phase"]
+    baseline = history.groupby(keys, sort=False).tail(1)[keys + ["seconds", "commit"]]
+    compared = results.merge(baseline, on=keys, how="inner", suffixes=("", "_baseline"))
+    compared["ratio"] = compared["seconds"] / compared["seconds_baseline"]
+    slower = (compared["ratio"] > 1 + threshold) & (compared["seconds"] > NOISE_FLOOR)
+    return compared[slower].reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the EnergyCommunityModel hot paths")
+    parser.add_argument("--quick", action="store_true", help="small sweep for a fast check")
+    parser.add_argument("--engine", choices=ENGINES, action="append", help="engine(s) to benchmark")
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--history", default=HISTORY_FILE)
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown per phase (0.2 = 20%%)")
+    parser.add_argument("--no-save", action="store_true", help="compare only, do not append to the history")
+    args = parser.parse_args(argv)
+
+    engines = tuple(args.engine) if args.engine else ENGINES
+    if args.quick:
+        cases = make_cases(engines, agent_counts=QUICK_AGENT_COUNTS, grid_sizes=QUICK_GRID_SIZES,
+                           reaches=QUICK_REACHES, steps=args.steps)
+    else:
+        cases = make_cases(engines, steps=args.steps)
+    results = run_benchmarks(cases, repeats=args.repeats, seed=args.seed)
+    regressions = find_regressions(results, read_history(args.history), threshold=args.threshold)
+    if not args.no_save:
+        append_history(results, args.history)
+
+    print(results.pivot_table(index=["engine", "scenario", "num_prospects", "width", "reach"], columns="phase",
+                              values="seconds", dropna=False).round(4).to_string())
+    if not regressions.empty:
+        print(f"\n{len(regressions)} phase(s) slower than the previous run by more than {args.threshold:.0%}:")
+        print(regressions[list(CASE_FIELDS) + ["phase", "seconds_baseline", "seconds", "ratio"]].to_string())
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+from community import EnergyCommunityModel
+from checkpoint import capture_state, restore_state, saved_seed, saved_metrics
+
+"""Scenario branches: build the population and the network once, optionally run a common prefix of steps,
+then fork the model into scenario or parameter branches.
+
+Branches share the immutable data of the parent (the population arrays and the friendship network) and only
+copy the per-branch state (positions, statuses, joined-friend counters, counters, collected data and random
+streams). A branch with a different scenario keeps the parent's population, so it changes the narrative's
+dynamics (the join probability of check_friends_and_join) but not the adopter-group sizes or contact ranges.
+A branch with other parameters keeps every member's standardized trait draws (see
+Population.with_parameters)."""
+
+
+def fork(model, scenario=None, parameters=None, seed=None, metrics=None, profiler=None, scenario_overrides=None,
+         events=None):
+    """
+    A branch of the model at its current step.
+
+    Without a seed the branch continues from the parent's random streams, so a branch with the parent's
+    scenario and parameters repeats the parent's run exactly; with a seed it draws its own numbers from
+    then on. scenario_overrides (see scenarios.get_scenario) replace the parent's overrides, e.g. to try another
+    join probability. A MetricsRecorder of the parent is copied unless other metrics are given. events: an
+    events.EventLog for the branch, started with a copy of the parent's events so far.
+    """
+    state, arrays = capture_state(model)
+    if events is not None and state["events"] is not None:
+        events.extend_from(state["events"]["file_path"], state["events"]["count"])
+    population = model.population
+    if parameters is not None and parameters != model.parameters:
+        population = population.with_parameters(model.parameters, parameters)
+    branch = EnergyCommunityModel(model.num_members, model.num_prospects, model.width, model.height,
+                                  scenario=model.scenario if scenario is None else scenario, engine=model.engine,
+                                  seed=saved_seed(state) if seed is None else seed,
+                                  common_random_numbers=model.streams.common_random_numbers,
+                                  parameters=model.parameters if parameters is None else parameters,
+                                  collect_data=model.datacollector is not None,
+                                  metrics=saved_metrics(state, arrays) if metrics is None else metrics,
+                                  profiler=profiler, network=model.network, population=population,
+                                  scenario_overrides=model.scenario_overrides if scenario_overrides is None
+                                  else scenario_overrides, tiles=model.tiles, events=events)
+    restore_state(branch, state, arrays, reseed=seed is not None)
+    return branch
+
+
+def fork_branches(model, branches):
+    # branches: {name: keyword arguments of fork}, e.g. {"Unified": {"scenario": "Unified"}}
+    return {name: fork(model, **options) for name, options in branches.items()}
+
+
+def run_branches(model, branches, stopping=None):
+    """
+    Fork the model into the given branches and run every branch to the end.
+
+    Returns {name: new_members_count_list of the branch}, which includes the steps of the shared prefix.
+    Example, sharing 20 warm-up steps between the three narratives:
+
+        model = EnergyCommunityModel(100, 1000, 50, 50, scenario="Familiar", seed=1)
+        for _ in range(20):
+            model.step()
+        curves = run_branches(model, {scenario: {"scenario": scenario} for scenario in SCENARIOS})
+    """
+    curves = {}
+    for name, options in branches.items():
+        branch = fork(model, **options)
+        branch.run_model(stopping=stopping)
+        curves[name] = branch.new_members_count_list
+    return curves
@@ -0,0 +1,219 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import itertools
+from dataclasses import fields
+import numpy as np
+import pandas as pd
+from numpy.polynomial import legendre
+from batch import make_run_specs, iter_batch_run
+from parameters import ModelParameters, load_parameters
+from scenarios import ADOPTER_GROUPS, get_scenario
+from stopping import MaxSteps
+
+try:
+    from scipy.stats import qmc
+except ImportError:  # Sobol designs are optional, Latin hypercube designs need numpy only
+    qmc = None
+
+"""Calibration and uncertainty quantification of ANIMO against a cheap emulator of the adoption curve.
+
+A parameter space maps names to (low, high) bounds. Names are trait parameters of ModelParameters
+(e.g. "env_concern_mean"), "join_probability", or "fraction_<group>" / "threshold_<group>" for the
+adopter-group fractions and friends thresholds, with <group> one of GROUP_KEYS. Typical use:
+
+    space = {"join_probability": (0.2, 0.8), "env_concern_mean": (2, 4), "fraction_innovator": (0, 0.1)}
+    samples, curves = run_design(space, 64, scenario="Familiar", steps=40, replicates=4)
+    emulator = PolynomialChaosEmulator(space, degree=2).fit(samples, curves)
+    emulator.sensitivity()                   # Sobol indices of the final adoption
+    calibrate(emulator, observed_curve)      # parameter values that reproduce an observed curve
+"""
+
+GROUP_KEYS = tuple(group.lower().replace(" ", "_") for group in ADOPTER_GROUPS)
+
+# Parameters of ModelParameters that can be sampled (the trait distributions)
+TRAIT_PARAMETERS = tuple(field.name for field in fields(ModelParameters) if field.type is float)
+
+
+# Supporting Functions
+#######################
+def apply_sample(parameters, scenario, sample):
+    # (ModelParameters, scenario overrides) of one design point, given as {name: value}
+    settings = get_scenario(scenario)
+    updates, overrides = {}, {}
+    fractions = list(settings["adopter_group_fractions"])
+    thresholds = list(settings["friends_threshold_means"])
+    for name, value in sample.items():
+        prefix, _, group = name.partition("_")
+        if name in TRAIT_PARAMETERS:
+            updates[name] = float(value)
+        elif name == "join_probability":
+            overrides[name] = float(value)
+        elif prefix == "fraction" and group in GROUP_KEYS:
+            fractions[GROUP_KEYS.index(group)] = float(value)
+            overrides["adopter_group_fractions"] = fractions
+        elif prefix == "threshold" and group in GROUP_KEYS:
+            thresholds[GROUP_KEYS.index(group)] = float(value)
+            overrides["friends_threshold_means"] = tuple(thresholds)
+        else:
+            raise ValueError(f"Unknown calibration parameter '{name}'")
+    if "adopter_group_fractions" in overrides:
+        # The sampled fractions are renormalized to sum to one
+        total = sum(fractions)
+        overrides["adopter_group_fractions"] = tuple(fraction / total for fraction in fractions)
+    return parameters.replace(**updates), overrides or None
+
+
+def latin_hypercube(n, d, rng):
+    # One point in every of the n strata of each dimension, strata paired at random, in [0, 1)^d
+    strata = rng.permuted(np.tile(np.arange(n), (d, 1)), axis=1).T
+    return (strata + rng.random((n, d))) / n
+
+
+def sobol(n, d, rng):
+    # Scrambled Sobol points in [0, 1)^d (n should be a power of two)
+    if qmc is None:
+        raise ImportError("Sobol designs need scipy; install it or use design='lhs'")
+    return qmc.Sobol(d, scramble=True, seed=rng).random(n)
+
+
+DESIGNS = {"lhs": latin_hypercube, "sobol": sobol}
+
+
+def sample_space(space, n, design="lhs", seed=None):
+    # n design points of the parameter space as a DataFrame, one column per parameter
+    if design not in DESIGNS:
+        raise ValueError(f"Unknown design '{design}', expected one of {', '.join(DESIGNS)}")
+    low, high = np.array(list(space.values()), dtype=np.float64).T
+    unit = DESIGNS[design](n, len(space), np.random.default_rng(seed))
+    return pd.DataFrame(low + unit * (high - low), columns=list(space))
+
+
+def adoption_curve(frame, num_prospects, steps):
+    # Adopted share of the prospects (those joined so far) per step; runs that stopped early keep their last value
+    curve = np.ones(steps) if num_prospects == 0 else np.zeros(steps)
+    values = frame["num_joined"].to_numpy()[:steps] / max(num_prospects, 1)
+    curve[:len(values)] = values
+    if 0 < len(values) < steps:
+        curve[len(values):] = values[-1]
+    return curve
+
+
+# Design runs
+#######################
+def run_design(space, n_samples, scenario="Familiar", num_members=100, num_prospects=100, width=50, height=50,
+               steps=50, replicates=1, design="lhs", seed=None, engine="array", parameters=None, processes=None):
+    """
+    Sample the parameter space and run the model at every design point, in parallel.
+
+    Returns (samples, curves): the design points as a DataFrame and the adoption curves (share of the
+    prospects adopted after every step, averaged over the replicates) as an (n_samples x steps) array.
+    Every design point uses the same replicate seeds, so differences between points are not blurred by
+    different random numbers.
+    """
+    if parameters is None:
+        parameters = load_parameters()
+    samples = sample_space(space, n_samples, design=design, seed=seed)
+    replicate_specs = make_run_specs([scenario], [num_members], [num_prospects], [(width, height)], replicates,
+                                     seed=seed, engine=engine, parameters=parameters,
+                                     stopping=[MaxSteps(steps)])
+    run_specs = []
+    for point, sample in enumerate(samples.to_dict("records")):
+        point_parameters, overrides = apply_sample(parameters, scenario, sample)
+        for replicate_spec in replicate_specs:
+            run_specs.append(dict(replicate_spec, run_id=len(run_specs), design_point=point,
+                                  parameters=point_parameters, scenario_overrides=overrides))
+
+    curves = np.zeros((n_samples, steps))
+    for run_spec, frame in iter_batch_run(run_specs, processes=processes):
+        curves[run_spec["design_point"]] += adoption_curve(frame, num_prospects, steps) / replicates
+    return samples, curves
+
+
+# Emulator
+#######################
+class PolynomialChaosEmulator:
+    """
+    Polynomial chaos expansion of the adoption curve in the sampled parameters.
+
+    Parameters are mapped to [-1, 1] and the curve at every step is fitted by least squares on the
+    orthonormal Legendre polynomials of total degree up to `degree`. Predictions are a matrix product,
+    and the Sobol sensitivity indices follow directly from the coefficients.
+    """
+
+    def __init__(self, space, degree=2, ridge=1e-8):
+        self.names = list(space)
+        self.low, self.high = np.array(list(space.values()), dtype=np.float64).T
+        self.degree = degree
+        self.ridge = ridge
+        # Multi-indices (polynomial degree per parameter) of the expansion, constant term first
+        self.terms = np.array([powers for powers in itertools.product(range(degree + 1), repeat=len(self.names))
+                               if sum(powers) <= degree], dtype=np.int64).reshape(-1, len(self.names))
+        self.terms = self.terms[np.argsort(self.terms.sum(axis=1), kind="stable")]
+        self.coefficients = None
+
+    def basis(self, samples):
+        x = np.asarray(samples[self.names] if isinstance(samples, pd.DataFrame) else samples, dtype=np.float64)
+        x = 2 * (x - self.low) / (self.high - self.low) - 1
+        # Orthonormal Legendre polynomials of every degree at every parameter: (samples x parameters x degrees)
+        values = np.stack([legendre.legval(x, np.eye(self.degree + 1)[k]) * np.sqrt(2 * k + 1)
+                           for k in range(self.degree + 1)], axis=-1)
+        columns = np.arange(len(self.names))
+        return np.prod(values[:, columns, self.terms], axis=-1)
+
+    def fit(self, samples, curves):
+        basis = self.basis(samples)
+        gram = basis.T @ basis + self.ridge * np.eye(basis.shape[1])
+        self.coefficients = np.linalg.solve(gram, basis.T @ np.asarray(curves, dtype=np.float64))
+        # Leave-one-out residuals from the hat matrix, for validating the emulator
+        hat = np.einsum("ij,ji->i", basis, np.linalg.solve(gram, basis.T))
+        residuals = np.asarray(curves) - basis @ self.coefficients
+        self.loo_error = np.sqrt(np.mean((residuals / (1 - np.minimum(hat, 1 - 1e-12))[:, None]) ** 2, axis=0))
+        return self
+
+    def predict(self, samples):
+        return self.basis(samples) @ self.coefficients
+
+    def sensitivity(self, step=-1):
+        # First-order and total Sobol indices of every parameter for the adoption at the given step
+        coefficients = self.coefficients[1:, step] ** 2
+        terms = self.terms[1:]
+        variance = coefficients.sum()
+        first_order, total = [], []
+        for i in range(len(self.names)):
+            involved = terms[:, i] > 0
+            alone = involved & (terms.sum(axis=1) == terms[:, i])
+            first_order.append(coefficients[alone].sum() / variance if variance else 0.0)
+            total.append(coefficients[involved].sum() / variance if variance else 0.0)
+        return pd.DataFrame({"first_order": first_order, "total": total}, index=self.names)
+
+
+def calibrate(emulator, observed, n_candidates=100000, keep=100, seed=None):
+    """
+    Parameter values whose emulated adoption curve is closest to an observed one.
+
+    observed is the adopted share of the prospects per step (from step 1, at most as many steps as the
+    emulator). Candidates are drawn by Latin hypercube over the space; the `keep` best ones are returned
+    with their root mean squared error, best first, as an approximate posterior sample.
+    """
+    observed = np.asarray(observed, dtype=np.float64)
+    space = dict(zip(emulator.names, zip(emulator.low, emulator.high)))
+    candidates = sample_space(space, n_candidates, seed=seed)
+    predicted = emulator.predict(candidates)[:, :len(observed)]
+    candidates["error"] = np.sqrt(np.mean((predicted - observed) ** 2, axis=1))
+    return candidates.nsmallest(keep, "error").reset_index(drop=True)
@@ -0,0 +1,296 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import json
+import os
+import numpy as np
+from community import EnergyCommunityModel
+from events import EventLog
+from members import Member
+from prospects import Prospect
+from metrics import MetricsRecorder
+from network import FriendshipNetwork
+from parameters import ModelParameters
+from population import Population
+from randomness import SUBSYSTEMS
+from stopping import StoppingPolicy
+
+"""Checkpoints of an EnergyCommunityModel: one compressed NPZ file holding the population, the friendship
+network, the dynamic agent state (positions, statuses, joined-friend counters), every random stream, the
+counters and the collected data. Restoring a checkpoint and stepping on gives exactly the same run as if
+the model had never been stopped."""
+
+CHECKPOINT_VERSION = 2
+
+# Recorded metrics of a metrics.MetricsRecorder
+METRICS_ARRAYS = ("steps", "new_members", "num_joined", "growth_percentage", "joined_by_group",
+                  "conversions_by_typology")
+
+
+# Supporting Functions
+#######################
+def seed_state(seed_sequence):
+    entropy = seed_sequence.entropy
+    return {"entropy": entropy if isinstance(entropy, int) else np.asarray(entropy).tolist(),
+            "spawn_key": list(seed_sequence.spawn_key)}
+
+
+def python_random_state(state):
+    # random.Random.getstate() as JSON and back
+    version, internal, gauss_next = state
+    return [version, list(internal), gauss_next]
+
+
+def agent_state(model):
+    # Positions, statuses and joined-friend counters of all agents, as arrays in agent order
+    if model.array_engine is not None:
+        engine = model.array_engine
+        return {
+            "member_x": engine.member_x, "member_y": engine.member_y,
+            "prospect_x": engine.prospect_x, "prospect_y": engine.prospect_y,
+            "joined": engine.joined, "num_friends_joined": engine.num_friends_joined,
+        }
+    members = list(model.schedule.agents_by_type[Member].values())
+    prospects = list(model.schedule.agents_by_type[Prospect].values())
+    member_pos = np.array([member.pos for member in members], dtype=np.int64).reshape(-1, 2)
+    prospect_pos = np.array([prospect.pos for prospect in prospects], dtype=np.int64).reshape(-1, 2)
+    # The prospect index in its iteration order (cells, then prospects within a cell), which decides the
+    # order of the contact draws
+    cells = list(model.prospect_index.cells.items())
+    return {
+        "member_x": member_pos[:, 0], "member_y": member_pos[:, 1],
+        "prospect_x": prospect_pos[:, 0], "prospect_y": prospect_pos[:, 1],
+        "joined": np.array([prospect.status == "New Member" for prospect in prospects], dtype=bool),
+        "num_friends_joined": np.array([prospect.num_friends_joined for prospect in prospects], dtype=np.int64),
+        "index_cells": np.array([pos for pos, _ in cells], dtype=np.int64).reshape(-1, 2),
+        "index_counts": np.array([len(cell) for _, cell in cells], dtype=np.int64),
+        "index_ids": np.array([uid for _, cell in cells for uid in cell], dtype=np.int64),
+    }
+
+
+def restore_agents(model, arrays):
+    if model.array_engine is not None:
+        engine = model.array_engine
+        for name in ("member_x", "member_y", "prospect_x", "prospect_y", "joined", "num_friends_joined"):
+            # In place, as the sharded engine's arrays live in shared memory
+            getattr(engine, name)[...] = arrays[name]
+        model.reset_active_sets()
+        return
+    members = list(model.schedule.agents_by_type[Member].values())
+    prospects = list(model.schedule.agents_by_type[Prospect].values())
+    for member, x, y in zip(members, arrays["member_x"].tolist(), arrays["member_y"].tolist()):
+        model.grid.move_agent(member, (x, y))
+    joined = arrays["joined"].tolist()
+    num_friends_joined = arrays["num_friends_joined"].tolist()
+    prospect_positions = zip(arrays["prospect_x"].tolist(), arrays["prospect_y"].tolist())
+    for i, (prospect, pos) in enumerate(zip(prospects, prospect_positions)):
+        model.grid.move_agent(prospect, pos)
+        prospect.status = "New Member" if joined[i] else "Not Joined"
+        prospect.num_friends_joined = num_friends_joined[i]
+    # Rebuild the prospect index in the saved order
+    by_id = {prospect.unique_id: prospect for prospect in prospects}
+    ids = iter(arrays["index_ids"].tolist())
+    model.prospect_index.cells = {
+        (x, y): {uid: by_id[uid] for uid in (next(ids) for _ in range(count))}
+        for (x, y), count in zip(arrays["index_cells"].tolist(), arrays["index_counts"].tolist())
+    }
+    model.reset_active_sets()
+
+
+def capture_state(model):
+    # Dynamic state of a model (everything but the population and the network) as a JSON-compatible dict
+    # and a dict of arrays
+    streams = model.streams
+    state = {
+        "model": {
+            "num_members": model.num_members, "num_prospects": model.num_prospects,
+            "width": model.width, "height": model.height, "scenario": model.scenario, "engine": model.engine,
+            "scenario_overrides": model.scenario_overrides, "tiles": model.tiles,
+            "new_members_count": model.new_members_count, "num_attempts": model.num_attempts,
+            "num_neighbor_queries": model.num_neighbor_queries, "num_agents_scanned": model.num_agents_scanned,
+            "num_joined": model.num_joined, "stop_reason": model.stop_reason, "running": model.running,
+            "steps": model.schedule.steps, "time": model.schedule.time,
+        },
+        "parameters": model.parameters.to_dict(),
+        "streams": {
+            "seed": seed_state(streams.seed_sequence),
+            "common_random_numbers": streams.common_random_numbers,
+            "step": streams.step,
+            "states": {name: getattr(streams, name).bit_generator.state for name in SUBSYSTEMS},
+            "python_random": python_random_state(model.random.getstate()),
+        },
+        "datacollector": list(model.datacollector.model_vars) if model.datacollector is not None else None,
+        "metrics": None,
+        "events": None,
+    }
+    if model.events is not None:
+        # The joins so far are written out, so that a restored or forked run can carry them over
+        model.events.flush()
+        state["events"] = {"file_path": os.path.abspath(model.events.file_path), "count": model.events.count}
+
+    arrays = {"agents_" + name: values for name, values in agent_state(model).items()}
+    arrays["joined_by_group"] = model.joined_by_group
+    arrays["conversions_by_typology"] = model.conversions_by_typology
+    arrays["new_members_count_list"] = np.array(model.new_members_count_list, dtype=np.int64)
+    arrays["num_joined_list"] = np.array(model.num_joined_list, dtype=np.int64)
+    arrays["percentage_list"] = np.array(model.percentage_list, dtype=np.float64)
+    if model.datacollector is not None:
+        for i, values in enumerate(model.datacollector.model_vars.values()):
+            arrays[f"datacollector_{i}"] = np.array(values)
+    if isinstance(model.metrics, MetricsRecorder):
+        metrics = model.metrics
+        state["metrics"] = {"every": metrics.every, "on_change": metrics.on_change, "size": metrics.size}
+        for name in METRICS_ARRAYS:
+            arrays["metrics_" + name] = getattr(metrics, name)[:metrics.size]
+    return state, arrays
+
+
+def saved_seed(state):
+    seed = state["streams"]["seed"]
+    return np.random.SeedSequence(seed["entropy"], spawn_key=tuple(seed["spawn_key"]))
+
+
+def saved_metrics(state, arrays):
+    # The MetricsRecorder captured by capture_state, if any
+    if state["metrics"] is None:
+        return None
+    metrics = MetricsRecorder(every=state["metrics"]["every"], on_change=state["metrics"]["on_change"],
+                              capacity=max(2 * state["metrics"]["size"], 1))
+    metrics.size = state["metrics"]["size"]
+    for name in METRICS_ARRAYS:
+        getattr(metrics, name)[:metrics.size] = arrays["metrics_" + name]
+    return metrics
+
+
+def restore_state(model, state, arrays, reseed=None):
+    # Apply a state from capture_state to a model built from the same population and network
+    settings = state["model"]
+    restore_agents(model, {name[len("agents_"):]: values for name, values in arrays.items()
+                           if name.startswith("agents_")})
+
+    for name in ("new_members_count", "num_attempts", "num_neighbor_queries", "num_agents_scanned", "num_joined",
+                 "stop_reason", "running"):
+        setattr(model, name, settings[name])
+    model.schedule.steps = settings["steps"]
+    model.schedule.time = settings["time"]
+    model.joined_by_group = arrays["joined_by_group"].copy()
+    model.conversions_by_typology = arrays["conversions_by_typology"].copy()
+    model.new_members_count_list = arrays["new_members_count_list"].tolist()
+    model.num_joined_list = arrays["num_joined_list"].tolist()
+    model.percentage_list = arrays["percentage_list"].tolist()
+    if model.datacollector is not None and state["datacollector"] is not None:
+        for i, var in enumerate(state["datacollector"]):
+            model.datacollector.model_vars[var] = arrays[f"datacollector_{i}"].tolist()
+
+    # Random streams, including mesa's random.Random. With reseed the model keeps the fresh streams of its
+    # own seed, moved to the saved step
+    saved_streams = state["streams"]
+    if reseed:
+        model.streams.step = saved_streams["step"]
+        return
+    streams = model.streams
+    streams.step = saved_streams["step"]
+    for name in SUBSYSTEMS:
+        getattr(streams, name).bit_generator.state = saved_streams["states"][name]
+    version, internal, gauss_next = saved_streams["python_random"]
+    model.random.setstate((version, tuple(internal), gauss_next))
+
+
+# Save / Load
+#######################
+def save_checkpoint(model, file_path):
+    # Write the complete state of the model to file_path (NPZ). The file is replaced atomically.
+    state, arrays = capture_state(model)
+    state["version"] = CHECKPOINT_VERSION
+    state["topology"] = model.network.topology
+    arrays.update({"population_" + name: values for name, values in model.population.to_arrays().items()})
+    arrays["network_indptr"] = model.network.indptr
+    arrays["network_indices"] = model.network.indices
+    arrays["state"] = np.array(json.dumps(state))
+
+    # np.savez appends ".npz" to names without it
+    temporary = str(file_path) + ".tmp.npz"
+    np.savez_compressed(temporary, **arrays)
+    os.replace(temporary, file_path)
+
+
+def load_checkpoint(file_path, metrics=None, profiler=None, reseed=None, events=None):
+    """
+    Rebuild the model saved by save_checkpoint. Stepping the restored model continues the saved run exactly.
+
+    The population and the network are not drawn again. A saved MetricsRecorder is restored unless other
+    metrics are given; profilers are not saved. With reseed (a seed as accepted by RandomStreams) the
+    streams used by the steps are replaced, so that several what-if continuations can branch from one
+    warmed-up state.
+
+    The event log of the saved run (events.EventLog) is reopened after the events of the checkpoint, and
+    continued, unless another log is given: that one starts with a copy of the saved events. With reseed
+    the saved log is left alone, so continuations only log events into a log of their own.
+    """
+    with np.load(file_path) as data:
+        arrays = {name: data[name] for name in data.files}
+    state = json.loads(str(arrays.pop("state")))
+    if state["version"] != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version {state['version']}")
+    settings = state["model"]
+    saved_events = state.get("events")
+    if saved_events is not None:
+        if events is not None:
+            events.extend_from(saved_events["file_path"], saved_events["count"])
+        elif reseed is None:
+            events = EventLog.append(saved_events["file_path"], saved_events["count"])
+
+    population = Population.from_arrays(settings["scenario"], {
+        name[len("population_"):]: values for name, values in arrays.items() if name.startswith("population_")},
+        settings["scenario_overrides"])
+    network = FriendshipNetwork(arrays["network_indptr"], arrays["network_indices"], state["topology"])
+    model = EnergyCommunityModel(settings["num_members"], settings["num_prospects"], settings["width"],
+                                 settings["height"], scenario=settings["scenario"], engine=settings["engine"],
+                                 seed=saved_seed(state) if reseed is None else reseed,
+                                 common_random_numbers=state["streams"]["common_random_numbers"],
+                                 parameters=ModelParameters(**state["parameters"]),
+                                 collect_data=state["datacollector"] is not None,
+                                 metrics=saved_metrics(state, arrays) if metrics is None else metrics,
+                                 profiler=profiler, network=network, population=population,
+                                 scenario_overrides=settings["scenario_overrides"], tiles=settings.get("tiles"),
+                                 events=events)
+    restore_state(model, state, arrays, reseed=reseed is not None)
+    return model
+
+
+class PeriodicCheckpoint(StoppingPolicy):
+    # Never stops a run; saves a checkpoint every `every` steps, e.g.
+    # model.run_model(stopping=default_policies() + [PeriodicCheckpoint("run.npz", 100)]) and, after a
+    # pre-emption, load_checkpoint("run.npz").run_model()
+    def __init__(self, file_path, every=100):
+        self.file_path = file_path
+        self.every = every
+        self.last_step = None
+
+    def to_dict(self):
+        return None
+
+    def start(self, model):
+        self.last_step = model.schedule.steps
+
+    def check(self, model):
+        step = model.schedule.steps
+        if step != self.last_step and step % self.every == 0:
+            save_checkpoint(model, self.file_path)
+            self.last_step = step
+        return None
@@ -21,259 +21,259 @@ from mesa.space import MultiGrid
 from mesa.time import RandomActivationByType
 from members import Member
 from prospects import Prospect
+from engine import ArrayEngine
+from sharding import ShardedEngine
+from population import Population, TYPOLOGIES, TYPOLOGY_INDEX
+from network import FriendshipNetwork, build_network
+from scenarios import ADOPTER_GROUPS, ADOPTER_GROUP_INDEX, NORMAL_SCALE, get_scenario
+from spatial import ProspectIndex, has_prospects_nearby
+from randomness import RandomStreams
+from parameters import load_parameters
+from stopping import default_policies
 import numpy as np
-import random
 from mesa.datacollection import DataCollector
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 
+# Agents as mesa agents, in NumPy arrays, or in shared arrays split over tile worker processes
+ENGINES = ("mesa", "array", "sharded")
+
 
 class EnergyCommunityModel(Model):
-    def __init__(self, num_members, num_prospects, width, height, scenario="Familiar"):
+    def __new__(cls, *args, **kwargs):
+        # mesa would seed self.random from the "seed" keyword, which may be a Generator here; see __init__
+        return super().__new__(cls)
+
+    def __init__(self, num_members, num_prospects, width, height, scenario="Familiar", engine="mesa", seed=None,
+                 common_random_numbers=False, parameters=None, collect_data=True, metrics=None, profiler=None,
+                 network="uniform", network_options=None, population=None, scenario_overrides=None,
+                 kernels="auto", tiles=None, events=None):
         self.width = width
         self.height = height
         self.scenario = scenario
+        # Scenario settings (scenarios.py), with optional overrides, e.g. {"join_probability": 0.3}
+        self.scenario_overrides = scenario_overrides
+        self.settings = get_scenario(scenario, scenario_overrides)
         self.num_members = num_members
         self.num_prospects = num_prospects
         self.new_members_count = 0  # Track the number of new members
         self.new_members_count_list = []  # List to store counts
+        self.num_joined_list = []  # Prospects joined so far, after every step
         self.percentage_list = []  # List to store percentages
         self.num_attempts = 0
-        """A physical world to place agents in"""
-        self.grid = MultiGrid(self.width, self.height, torus=True)
+        self.num_neighbor_queries = 0  # Radius queries made in contact_and_influence
+        self.num_agents_scanned = 0  # Agents visited by the step phases
+        self.num_joined = 0  # Prospects whose status is "New Member"
+        self.joined_by_group = np.zeros(len(ADOPTER_GROUPS), dtype=np.int64)  # Joined prospects per adopter group
+        self.conversions_by_typology = np.zeros(len(TYPOLOGIES), dtype=np.int64)  # Contact conversions per typology
+        self.stop_reason = None  # Why the last run_model stopped
+        self.engine = engine
+        self.tiles = None  # Number of tiles of the sharded engine
+
+        """Input parameters (trait distributions); read once from input_data.xlsx if not given"""
+        self.parameters = parameters if parameters is not None else load_parameters()
+
+        """Independent random streams per subsystem, spawned from one seed (int, SeedSequence or Generator)"""
+        self.streams = RandomStreams(seed, common_random_numbers=common_random_numbers)
+        # mesa's own random (activation order and agent movement) is the movement stream
+        self.random = self.streams.python_random("movement")
 
         """Initiate activation schedule"""
         self.schedule = RandomActivationByType(self)
         self.running = True
 
+        # Collect data with mesa's DataCollector (optional) and/or a lightweight metrics.MetricsRecorder
+        self.datacollector = None
+        if collect_data:
+            self.datacollector = DataCollector(
+                model_reporters={
+                    "New Members": self.collect_new_members,
+                    "Growth Percentage": self.collect_growth_percentage
+                }
+            )
+        self.metrics = metrics
+        self.profiler = profiler  # Opt-in profiling.StepProfiler
+        self.events = events  # Opt-in events.EventLog of every join
+
+        """Attributes of all agents, drawn in bulk (or a prebuilt Population, e.g. restored from a checkpoint)"""
+        if population is None:
+            population = self.timed("population", lambda: Population(
+                self.parameters, self.scenario, self.num_members, self.num_prospects, self.width, self.height,
+                self.streams, scenario_overrides))
+        self.population = population
+
+        """Friendship network of the prospects: a topology name (see network.py) or a prebuilt FriendshipNetwork"""
+        if isinstance(network, FriendshipNetwork):
+            if network.num_prospects != self.num_prospects:
+                raise ValueError(f"The network has {network.num_prospects} prospects, the model {self.num_prospects}")
+            self.network = network
+        else:
+            self.network = self.timed("network", lambda: build_network(
+                network, self.population, self.streams.network, width=self.width, height=self.height,
+                **(network_options or {})))
+
+        """Agents either live in NumPy arrays ("array"), in shared arrays split over tile worker processes
+        ("sharded", see sharding.py) or as mesa agents on a grid ("mesa")"""
+        if self.engine in ("array", "sharded"):
+            self.grid = None
+            # kernels: "auto", "numba", "numpy" or "python" backend of the array engine (see kernels.py)
+            if self.engine == "array":
+                self.array_engine = self.timed("agents", lambda: ArrayEngine(self, kernels=kernels))
+            else:
+                # tiles: number of tile worker processes (default: the number of cores)
+                self.array_engine = self.timed("agents", lambda: ShardedEngine(self, kernels=kernels, tiles=tiles))
+                self.tiles = self.array_engine.num_tiles
+            self.timed("prospects_find_peers", self.array_engine.prospects_find_peers)
+            return
+        elif self.engine != "mesa":
+            raise ValueError(f"Unknown engine '{self.engine}', expected one of {', '.join(ENGINES)}")
+        self.array_engine = None
+
+        """A physical world to place agents in"""
+        self.grid = MultiGrid(self.width, self.height, torus=True)
+
+        """Prospects that have not joined yet, indexed by grid cell and in agent order (active sets of the phases)"""
+        self.prospect_index = ProspectIndex(self.grid)
+        self.unconverted = {}
+
+        self.timed("agents", self.create_agents)
+        self.timed("prospects_find_peers", self.prospects_find_peers)
+
+    def close(self):
+        # Release the engine's resources (the worker processes of the sharded engine) and close the event log
+        if self.array_engine is not None:
+            self.array_engine.close()
+        if self.events is not None:
+            self.events.close()
+
+    def timed(self, name, phase):
+        # Run a construction phase, under the profiler if there is one
+        if self.profiler is None:
+            return phase()
+        return self.profiler.run_phase(self, 0, name, phase)
+
+    def create_agents(self):
+        population = self.population
+
         # Create members
-        for i in range(self.num_members):
-            member = Member(i, self, scenario=self.scenario)
+        member_traits = population.member_raw_traits.tolist()
+        member_reach = population.member_reach.tolist()
+        member_typologies = [TYPOLOGIES[i] for i in population.member_typology]
+        member_positions = zip(population.member_x.tolist(), population.member_y.tolist())
+        for i, (x, y) in enumerate(member_positions):
+            member = Member(i, self, scenario=self.scenario, traits=member_traits[i], reach=member_reach[i],
+                            typology=member_typologies[i])
             self.schedule.add(member)
-            x = self.random.randrange(self.grid.width)
-            y = self.random.randrange(self.grid.height)
             self.grid.place_agent(member, (x, y))
 
         # Create prospects
-        for i in range(self.num_prospects):
-            prospect = Prospect(i + self.num_members, self, scenario=self.scenario)
+        vision = population.vision.tolist()
+        number_of_friends = population.number_of_friends.tolist()
+        prospect_positions = zip(population.prospect_x.tolist(), population.prospect_y.tolist())
+        for i, (x, y) in enumerate(prospect_positions):
+            prospect = Prospect(i + self.num_members, self, scenario=self.scenario, vision=vision[i],
+                                number_of_friends=number_of_friends[i])
             self.schedule.add(prospect)
-            x = self.random.randrange(self.grid.width)
-            y = self.random.randrange(self.grid.height)
             self.grid.place_agent(prospect, (x, y))
+            self.prospect_index.add(prospect, (x, y))
+            self.unconverted[prospect.unique_id] = prospect
 
         self.adopter_group_assignment()
-        self.prospects_find_peers()
-
-        # Collect data
-        self.datacollector = DataCollector(
-            model_reporters={
-                "New Members": self.collect_new_members,
-                "Growth Percentage": self.collect_growth_percentage
-            }
-        )
 
     def adopter_group_assignment(self):
         #  Applying the "Diffusion of Innovation theory" to agents (instances) of the Prospect class, also considering "world narratives"
+        # Group sizes come from the scenario table (scenarios.py), receptivity values are drawn in bulk by Population
         prospects = [agent for agent in self.schedule.agents if isinstance(agent, Prospect)]
-
-        scenario = self.scenario
-        if scenario == "Familiar":
-            innovators_number = int(0.025 * len(prospects))
-            early_adopters_number = int(0.135 * len(prospects))
-            early_majority_number = int(0.34 * len(prospects))
-            late_majority_number = int(0.34 * len(prospects))
-            laggards_number = int(0.16 * len(prospects))
-
-            innovators_list = prospects[:innovators_number]
-            early_adopters_list = prospects[innovators_number:(innovators_number + early_adopters_number)]
-            early_majority_list = prospects[(innovators_number + early_adopters_number):(
-                    innovators_number + early_adopters_number + early_majority_number)]
-            late_majority_list = prospects[
-                                 (innovators_number + early_adopters_number + early_majority_number):(
-                                         innovators_number + early_adopters_number + early_majority_number + late_majority_number)]
-            laggards_list = prospects[
-                            (innovators_number + early_adopters_number + early_majority_number + late_majority_number):]
-
-            for prospect in innovators_list:
-                prospect.adopter_group = "Innovator"
-                prospect.receptivity_towards_innovation = np.random.normal(loc=0.85, scale=np.sqrt(0.05))
-            for prospect in early_adopters_list:
-                prospect.adopter_group = "Early Adopter"
-                prospect.receptivity_towards_innovation = np.random.normal(loc=0.7, scale=np.sqrt(0.05))
-            for prospect in early_majority_list:
-                prospect.adopter_group = "Early Majority"
-                prospect.receptivity_towards_innovation = np.random.normal(loc=0.5, scale=np.sqrt(0.05))
-            for prospect in late_majority_list:
-                prospect.adopter_group = "Late Majority"
-                prospect.receptivity_towards_innovation = np.random.normal(loc=0.3, scale=np.sqrt(0.05))
-            for prospect in laggards_list:
-                prospect.adopter_group = "Laggard"
-                prospect.receptivity_towards_innovation = np.random.normal(loc=0.15, scale=np.sqrt(0.05))
-
-        elif scenario == "Fragmented":
-            innovators_number = int(0.005 * len(prospects))
-            early_adopters_number = int(0.075 * len(prospects))
-            early_majority_number = int(0.34 * len(prospects))
-            late_majority_number = int(0.34 * len(prospects))
-            laggards_number = int(0.24 * len(prospects))
-
-            innovators_list = prospects[:innovators_number]
-            early_adopters_list = prospects[innovators_number:(innovators_number + early_adopters_number)]
-            early_majority_list = prospects[(innovators_number + early_adopters_number):(
-                    innovators_number + early_adopters_number + early_majority_number)]
-            late_majority_list = prospects[
-                                 (innovators_number + early_adopters_number + early_majority_number):(
-                                         innovators_number + early_adopters_number + early_majority_number + late_majority_number)]
-            laggards_list = prospects[
-                            (innovators_number + early_adopters_number + early_majority_number + late_majority_number):]
-
-            for prospect in innovators_list:
-                prospect.adopter_group = "Innovator"
-                prospect.receptivity_towards_innovation = np.random.normal(loc=0.85, scale=np.sqrt(0.05))
-            for prospect in early_adopters_list:
-                prospect.adopter_group = "Early Adopter"
-                prospect.receptivity_towards_innovation = np.random.normal(loc=0.7, scale=np.sqrt(0.05))
-            for prospect in early_majority_list:
-                prospect.adopter_group = "Early Majority"
-                prospect.receptivity_towards_innovation = np.random.normal(loc=0.5, scale=np.sqrt(0.05))
-            for prospect in late_majority_list:
-                prospect.adopter_group = "Late Majority"
-                prospect.receptivity_towards_innovation = np.random.normal(loc=0.3, scale=np.sqrt(0.05))
-            for prospect in laggards_list:
-                prospect.adopter_group = "Laggard"
-                prospect.receptivity_towards_innovation = np.random.normal(loc=0.15, scale=np.sqrt(0.05))
-
-        elif scenario == "Unified":
-            innovators_number = int(0.065 * len(prospects))
-            early_adopters_number = int(0.175 * len(prospects))
-            early_majority_number = int(0.34 * len(prospects))
-            late_majority_number = int(0.34 * len(prospects))
-            laggards_number = int(0.08 * len(prospects))
-
-            innovators_list = prospects[:innovators_number]
-            early_adopters_list = prospects[innovators_number:(innovators_number + early_adopters_number)]
-            early_majority_list = prospects[(innovators_number + early_adopters_number):(
-                    innovators_number + early_adopters_number + early_majority_number)]
-            late_majority_list = prospects[
-                                 (innovators_number + early_adopters_number + early_majority_number):(
-                                         innovators_number + early_adopters_number + early_majority_number + late_majority_number)]
-            laggards_list = prospects[
-                            (innovators_number + early_adopters_number + early_majority_number + late_majority_number):]
-
-            for prospect in innovators_list:
-                prospect.adopter_group = "Innovator"
-                prospect.receptivity_towards_innovation = np.random.normal(loc=0.85, scale=np.sqrt(0.05))
-            for prospect in early_adopters_list:
-                prospect.adopter_group = "Early Adopter"
-                prospect.receptivity_towards_innovation = np.random.normal(loc=0.7, scale=np.sqrt(0.05))
-            for prospect in early_majority_list:
-                prospect.adopter_group = "Early Majority"
-                prospect.receptivity_towards_innovation = np.random.normal(loc=0.5, scale=np.sqrt(0.05))
-            for prospect in late_majority_list:
-                prospect.adopter_group = "Late Majority"
-                prospect.receptivity_towards_innovation = np.random.normal(loc=0.3, scale=np.sqrt(0.05))
-            for prospect in laggards_list:
-                prospect.adopter_group = "Laggard"
-                prospect.receptivity_towards_innovation = np.random.normal(loc=0.15, scale=np.sqrt(0.05))
+        groups = self.population.adopter_group.tolist()
+        receptivity = self.population.receptivity.tolist()
+        for prospect, group, receptivity_towards_innovation in zip(prospects, groups, receptivity):
+            prospect.adopter_group = ADOPTER_GROUPS[group]
+            prospect.receptivity_towards_innovation = receptivity_towards_innovation
 
     def check_friends_and_join(self):
-        prospects = [agent for agent in self.schedule.agents if isinstance(agent, Prospect)]
+        if self.array_engine is not None:
+            return self.array_engine.check_friends_and_join()
+        # Only prospects that have not joined yet are visited. Prospects without joined friends cannot be skipped:
+        # the drawn threshold may be negative, in which case they join too
+        prospects = list(self.unconverted.values())
+        self.num_agents_scanned += len(prospects)
+        # Percentage (threshold) of friends needed per adopter group and chance of joining, based on world narrative
+        threshold_means = self.settings["friends_threshold_means"]
+        join_probability = self.settings["join_probability"]
         for prospect in prospects:
             if prospect.status == "New Member":
                 pass
             else:
                 if len(prospect.friends) != 0:
-                    # Count the number of friends who have joined the community
-                    num_neighbors_joined = sum(1 for friend in prospect.friends if friend.status == "New Member")
-
-                    # Define the percentage (threshold) of friends needed based on world narrative
-                    if self.scenario == "Familiar":
-                        # Define the percentage (threshold) of friends needed based on adopter group
-                        if prospect.adopter_group == "Innovator":
-                            percent_neighbors_needed = np.random.normal(loc=0.2, scale=np.sqrt(0.05))
-                        elif prospect.adopter_group == "Early Adopter":
-                            percent_neighbors_needed = np.random.normal(loc=0.4, scale=np.sqrt(0.05))
-                        elif prospect.adopter_group == "Early Majority":
-                            percent_neighbors_needed = np.random.normal(loc=0.6, scale=np.sqrt(0.05))
-                        elif prospect.adopter_group == "Late Majority":
-                            percent_neighbors_needed = np.random.normal(loc=0.75, scale=np.sqrt(0.05))
-                        elif prospect.adopter_group == "Laggard":
-                            percent_neighbors_needed = np.random.normal(loc=0.9, scale=np.sqrt(0.05))
-
-                        # Calculate the required number of friends needed for the prospect to consider joining
-                        num_required_neighbors = len(prospect.friends) * percent_neighbors_needed
-
-                        # If more than the required number of friends have joined, the prospect has a 50% chance of joining
-                        if num_neighbors_joined > num_required_neighbors:
-                            if np.random.rand() < 0.5:  # 50% chance of joining
-                                prospect.status = "New Member"
-
-                    elif self.scenario == "Unified":
-                        # Define the percentage (threshold) of friends needed based on adopter group
-                        if prospect.adopter_group == "Innovator":
-                            percent_neighbors_needed = np.random.normal(loc=0.2, scale=np.sqrt(0.05))
-                        elif prospect.adopter_group == "Early Adopter":
-                            percent_neighbors_needed = np.random.normal(loc=0.4, scale=np.sqrt(0.05))
-                        elif prospect.adopter_group == "Early Majority":
-                            percent_neighbors_needed = np.random.normal(loc=0.6, scale=np.sqrt(0.05))
-                        elif prospect.adopter_group == "Late Majority":
-                            percent_neighbors_needed = np.random.normal(loc=0.75, scale=np.sqrt(0.05))
-                        elif prospect.adopter_group == "Laggard":
-                            percent_neighbors_needed = np.random.normal(loc=0.9, scale=np.sqrt(0.05))
-
-                        # Calculate the required number of friends needed for the prospect to consider joining
-                        num_required_neighbors = len(prospect.friends) * percent_neighbors_needed
-
-                        # If more than the required number of friends have joined, the prospect has a 50% chance of joining
-                        if num_neighbors_joined > num_required_neighbors:
-                            if np.random.rand() < 0.6:  # 60% chance of joining
-                                prospect.status = "New Member"
-
-                    elif self.scenario == "Fragmented":
-                        # Define the percentage (threshold) of friends needed based on adopter group
-                        if prospect.adopter_group == "Innovator":
-                            percent_neighbors_needed = np.random.normal(loc=0.2, scale=np.sqrt(0.05))
-                        elif prospect.adopter_group == "Early Adopter":
-                            percent_neighbors_needed = np.random.normal(loc=0.4, scale=np.sqrt(0.05))
-                        elif prospect.adopter_group == "Early Majority":
-                            percent_neighbors_needed = np.random.normal(loc=0.6, scale=np.sqrt(0.05))
-                        elif prospect.adopter_group == "Late Majority":
-                            percent_neighbors_needed = np.random.normal(loc=0.75, scale=np.sqrt(0.05))
-                        elif prospect.adopter_group == "Laggard":
-                            percent_neighbors_needed = np.random.normal(loc=0.9, scale=np.sqrt(0.05))
-
-                        # Calculate the required number of friends needed for the prospect to consider joining
-                        num_required_neighbors = len(prospect.friends) * percent_neighbors_needed
-
-                        # If more than the required number of friends have joined, the prospect has a 50% chance of joining
-                        if num_neighbors_joined > num_required_neighbors:
-                            if np.random.rand() < 0.4:  # 40% chance of joining
-                                prospect.status = "New Member"
+                    # Number of friends who have joined the community, kept up to date by join_community
+                    num_neighbors_joined = prospect.num_friends_joined
+
+                    # Define the percentage (threshold) of friends needed based on adopter group
+                    percent_neighbors_needed = self.streams.peer.normal(
+                        loc=threshold_means[ADOPTER_GROUP_INDEX[prospect.adopter_group]], scale=NORMAL_SCALE)
+
+                    # Calculate the required number of friends needed for the prospect to consider joining
+                    num_required_neighbors = len(prospect.friends) * percent_neighbors_needed
+
+                    # If more than the required number of friends have joined, the prospect has a chance of joining
+                    if num_neighbors_joined > num_required_neighbors:
+                        if self.streams.peer.random() < join_probability:
+                            self.join_community(prospect)
+                            if self.events is not None:
+                                self.events.record_peer(self, [prospect.unique_id - self.num_members])
                 else:
                     pass
 
+    def join_community(self, prospect):
+        # Flip the status of a prospect, stop indexing it for contact queries and let its followers know
+        if prospect.status != "New Member":
+            prospect.status = "New Member"
+            self.num_joined += 1
+            if prospect.adopter_group in ADOPTER_GROUP_INDEX:
+                self.joined_by_group[ADOPTER_GROUP_INDEX[prospect.adopter_group]] += 1
+            self.prospect_index.remove(prospect)
+            self.unconverted.pop(prospect.unique_id, None)
+            for follower in prospect.friend_of:
+                follower.num_friends_joined += 1
+            return True
+        return False
+
     def prospects_find_peers(self):
         prospects = [agent for agent in self.schedule.agents if isinstance(agent, Prospect)]
 
+        # Friendships come from the model's FriendshipNetwork, built in O(friendships) (see network.py)
+        indptr = self.network.indptr.tolist()
+        indices = self.network.indices.tolist()
+        for i, prospect in enumerate(prospects):
+            prospect.friends = [prospects[j] for j in indices[indptr[i]:indptr[i + 1]]]
+            prospect.number_of_friends = len(prospect.friends)
+
+        # Reverse friendship index: the prospects that count each prospect as a friend
         for prospect in prospects:
-            potential_friends = [a for a in prospects]
-            prospect.friends = random.sample(potential_friends, prospect.number_of_friends)
+            for friend in prospect.friends:
+                friend.friend_of.append(prospect)
+
+    def member_typologies(self):
+        # Typologies of all members
+        if self.array_engine is not None:
+            return self.array_engine.member_typologies()
+        return [agent.typology for agent in self.schedule.agents if isinstance(agent, Member)]
 
     def extract_typology_dataframe(self):
         # A list of dictionaries containing agent index and typology
-        typology_data = [{'Index': agent.unique_id, 'Typology': agent.typology} for agent in self.schedule.agents if
-                         isinstance(agent, Member)]
+        typology_data = [{'Index': index, 'Typology': typology} for index, typology in
+                         enumerate(self.member_typologies())]
 
         # Convert the list of dictionaries to a DataFrame
         typology_df = pd.DataFrame(typology_data)
 
         return typology_df
 
-    def plot_agent_type_histogram(self):
+    def plot_agent_type_histogram(self, file_path=None):
+        # Shown on screen, or saved to file_path (for aggregate figures of batch runs see reporting.py)
         # Get the typologies of all members
-        member_typologies = [agent.typology for agent in self.schedule.agents if isinstance(agent, Member)]
+        member_typologies = self.member_typologies()
 
         # Count the occurrences of each agent type
         type_counts = {typology: member_typologies.count(typology) for typology in set(member_typologies)}
@@ -286,7 +286,7 @@ class EnergyCommunityModel(Model):
         plt.xlabel('Agent Type')
         plt.ylabel('Frequency')
         plt.title('Histogram of Member Agent Types')
-        plt.show()
+        self.show_or_save(file_path)
 
     def collect_new_members(self):
         return self.new_members_count
@@ -297,38 +297,56 @@ class EnergyCommunityModel(Model):
         return growth_percentage
 
     def check_for_new_members(self):
-        for prospect in self.schedule.agents:
-            if isinstance(prospect, Prospect) and prospect.status == "New Member":
-                # Increment new_members_count if prospect is a Prospect with status "New Member"
-                self.new_members_count += 1
-                # Cap new_members_count at num_prospects
-                if self.new_members_count > self.num_prospects:
-                    self.new_members_count = self.num_prospects
+        # Increment new_members_count by the number of prospects with status "New Member" (kept by join_community)
+        self.new_members_count += self.num_joined
+        # Cap new_members_count at num_prospects
+        if self.new_members_count > self.num_prospects:
+            self.new_members_count = self.num_prospects
         self.new_members_count_list.append(self.new_members_count)
+        self.num_joined_list.append(self.num_joined)
         return self.new_members_count, self.new_members_count_list
 
     def contact_and_influence(self):
         # Current members search for prospective members and have a chance at convincing them
-        members = [member for member in self.schedule.agents if isinstance(member, Member)]
+        if self.array_engine is not None:
+            return self.array_engine.contact_and_influence()
+        members = self.active_members()
+        self.num_neighbor_queries += len(members)
+        self.num_agents_scanned += len(members)
         for member in members:
-            prospective_agents = [neighbor for neighbor in
-                                  self.grid.get_neighbors(member.pos, moore=True, include_center=False,
-                                                          radius=member.reach) if isinstance(neighbor, Prospect)]
+            # Only prospects that have not joined yet are returned by the index
+            prospective_agents = self.prospect_index.get_prospects(member.pos, member.reach)
+            self.num_agents_scanned += len(prospective_agents)
             for prospective_agent in prospective_agents:
                 if prospective_agent.receptivity_towards_innovation is not None:
-                    if random.random() < abs(prospective_agent.receptivity_towards_innovation * member.convincing_prowess):
-                        prospective_agent.status = "New Member"
+                    if self.streams.contact.random() < abs(prospective_agent.receptivity_towards_innovation * member.convincing_prowess):
+                        if self.join_community(prospective_agent):
+                            self.conversions_by_typology[TYPOLOGY_INDEX[member.typology]] += 1
+                            if self.events is not None:
+                                self.events.record_contact(self, [prospective_agent.unique_id - self.num_members],
+                                                           [member.unique_id])
                         self.num_attempts += 1
                     else:
                         self.num_attempts += 1
 
-    def plot_new_additions(self):
-        data = self.datacollector.get_model_vars_dataframe()
-        plt.plot(data.index, data['New Members'])
+    def plot_new_additions(self, file_path=None):
+        # Shown on screen, or saved to file_path (for aggregate figures of batch runs see reporting.py)
+        if self.datacollector is not None:
+            data = self.datacollector.get_model_vars_dataframe()
+            plt.plot(data.index, data['New Members'])
+        else:
+            plt.plot(range(1, len(self.new_members_count_list) + 1), self.new_members_count_list)
         plt.xlabel('Steps')
         plt.ylabel('Number of New Members')
         plt.title('Number of New Members Joined Over Time')
-        plt.show()
+        self.show_or_save(file_path)
+
+    def show_or_save(self, file_path):
+        if file_path is None:
+            plt.show()
+        else:
+            plt.savefig(file_path)
+            plt.close()
 
     def members_step(self):
         members = [member for member in self.schedule.agents if isinstance(member, Member)]
@@ -340,18 +358,91 @@ class EnergyCommunityModel(Model):
         for prospect in prospects:
             prospect.step()
 
-    def step(self):
-        self.schedule.step()
-        self.datacollector.collect(self)
-        self.contact_and_influence()
-        self.check_friends_and_join()
-        self.check_for_new_members()
+    def active_members(self):
+        # Members with at least one prospect that has not joined yet within reach (the others draw nothing)
+        members = list(self.schedule.agents_by_type[Member].values())
+        if not members:
+            return members
+        x, y = np.array([member.pos for member in members]).T
+        reach = np.array([member.reach for member in members])
+        active = has_prospects_nearby(self.prospect_index.cell_ids(), x, y, reach, self.width, self.height)
+        return [member for member, is_active in zip(members, active.tolist()) if is_active]
+
+    def reset_active_sets(self):
+        # Rebuild the active sets from the agents' statuses (e.g. after restoring a checkpoint)
+        if self.array_engine is not None:
+            return self.array_engine.reset_active_sets()
+        self.unconverted = {prospect.unique_id: prospect for prospect in self.schedule.agents_by_type[Prospect].values()
+                            if prospect.status != "New Member"}
+
+    def activate_agents(self):
+        # RandomActivationByType.step over the active agents: all members and the prospects that have not joined.
+        # Converted prospects stay put, as their position affects neither contacts nor friendships
+        active = {Member: list(self.schedule.agents_by_type[Member].values()), Prospect: list(self.unconverted.values())}
+        agent_classes = list(self.schedule.agents_by_type)
+        self.random.shuffle(agent_classes)
+        for agent_class in agent_classes:
+            agents = active[agent_class]
+            self.random.shuffle(agents)
+            for agent in agents:
+                agent.step()
+            self.num_agents_scanned += len(agents)
+        self.schedule.steps += 1
+        self.schedule.time += 1
+
+    def move_agents(self):
+        # Activate the schedule; agents take a random step on the grid
+        if self.array_engine is not None:
+            self.schedule.step()
+            self.array_engine.move_agents()
+        else:
+            self.activate_agents()
+
+    def collect_data(self):
+        if self.datacollector is not None:
+            self.datacollector.collect(self)
+
+    def record_metrics(self):
+        if self.metrics is not None:
+            self.metrics.record(self)
 
-    def run_model(self):
+    def step(self):
+        self.streams.start_step(self.schedule.steps)
+        if self.streams.common_random_numbers and self.array_engine is None:
+            self.random = self.streams.python_random("movement", 0, self.schedule.steps)
+        phases = (
+            ("movement", self.move_agents),
+            ("data_collection", self.collect_data),
+            ("contact_and_influence", self.contact_and_influence),
+            ("check_friends_and_join", self.check_friends_and_join),
+            ("check_for_new_members", self.check_for_new_members),
+            ("metrics", self.record_metrics),
+        )
+        if self.profiler is not None:
+            self.profiler.run_step(self, phases)
+        else:
+            for _, phase in phases:
+                phase()
+
+    def run_model(self, stopping=None):
+        # Step until one of the stopping policies fires (by default: saturation or a step budget)
+        policies = default_policies() if stopping is None else list(stopping)
+        for policy in policies:
+            policy.start(self)
         cumulative_members = []
-        step_number = 0
-        while self.new_members_count < self.num_prospects:
+        self.stop_reason = None
+        while True:
+            for policy in policies:
+                self.stop_reason = policy.check(self)
+                if self.stop_reason is not None:
+                    break
+            if self.stop_reason is not None:
+                break
             self.step()
             cumulative_members.append(self.new_members_count)
-            step_number += 1
+        self.running = False
+        for policy in policies:
+            policy.finish(self)
+        if self.events is not None:
+            self.events.flush()
         return cumulative_members
@@ -0,0 +1,429 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import argparse
+import copy
+import hashlib
+import json
+import os
+import socket
+import time
+import uuid
+import zlib
+import numpy as np
+from prospects import Prospect
+from scenarios import ADOPTER_GROUPS
+from stopping import StoppingPolicy
+
+try:
+    import tornado.ioloop
+    import tornado.web
+    import tornado.websocket
+except ImportError:  # Only the dashboard server needs tornado (part of mesa's visualization stack)
+    tornado = None
+
+"""Live dashboard of running replicates.
+
+Start the dashboard, then stream any run to it with a ProgressStream stopping policy (it never stops a run):
+
+    python dashboard.py                            # open http://127.0.0.1:8521
+    model.run_model(stopping=default_policies() + [ProgressStream(heatmap=(32, 32))])
+
+A ProgressStream sends at most one sample every `interval` seconds: step, adoption count, growth percentage,
+joined prospects per adopter group and optionally a downsampled heatmap of the grid. Samples go out as
+UDP datagrams to the dashboard, delta-encoded against the previous sample with a full keyframe every
+KEYFRAME_EVERY samples and as the last sample, compressed when they would not fit in one datagram (with a
+coarser heatmap for the rest of the run if they still do not), so a run never waits for the dashboard (or fails without
+one) and monitoring costs one clock read per step between samples. The dashboard merges the streams of
+all replicates, e.g. of a batch run in worker processes, and pushes batched deltas to the browser over a
+websocket. Finished runs are dropped FINISHED_LINGER seconds after they finished, or earlier when more
+than MAX_FINISHED runs have finished."""
+
+DEFAULT_ADDRESS = ("127.0.0.1", 8522)  # Where the dashboard receives the streams
+HTTP_PORT = 8521  # mesa's visualization port
+KEYFRAME_EVERY = 20
+MAX_HEATMAP = 64  # Largest heatmap side
+MAX_DATAGRAM = 65507  # Largest UDP payload over IPv4
+FINISHED_LINGER = 600  # Seconds a finished run stays on the dashboard
+MAX_FINISHED = 200  # Most finished runs kept
+
+
+# Supporting Functions
+#######################
+def prospect_positions(model):
+    # (x, y, joined) of all prospects
+    if model.array_engine is not None:
+        engine = model.array_engine
+        return engine.prospect_x, engine.prospect_y, engine.joined
+    prospects = list(model.schedule.agents_by_type[Prospect].values())
+    if not prospects:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+    x, y = np.array([prospect.pos for prospect in prospects], dtype=np.int64).T
+    return x, y, np.array([prospect.status == "New Member" for prospect in prospects], dtype=bool)
+
+
+def snapshot(model, heatmap=None):
+    # Aggregates of the model at its current step, as a JSON-compatible dict
+    sample = {
+        "step": int(model.schedule.steps),
+        "new_members": int(model.new_members_count),
+        "num_joined": int(model.num_joined),
+        "growth_percentage": model.new_members_count / model.num_members * 100 if model.num_members else 0.0,
+        "joined_by_group": model.joined_by_group.tolist(),
+    }
+    if heatmap is not None:
+        # Non-joined and joined prospects per block of grid cells
+        x, y, joined = prospect_positions(model)
+        block = (x * heatmap[0] // model.width) * heatmap[1] + y * heatmap[1] // model.height
+        size = heatmap[0] * heatmap[1]
+        sample["prospects"] = np.bincount(block[~joined], minlength=size).tolist()
+        sample["joined"] = np.bincount(block[joined], minlength=size).tolist()
+    return sample
+
+
+def seed_label(seed_sequence):
+    # Short number telling replicates apart: a hash of the seed's entropy (an int or an array) and spawn key
+    encoded = json.dumps([np.asarray(seed_sequence.entropy).tolist(), list(seed_sequence.spawn_key)]).encode()
+    return int(hashlib.sha1(encoded).hexdigest(), 16) % 100000
+
+
+def encode(message):
+    # One datagram: compact JSON, or zlib-compressed JSON if that is too large (the dashboard tells them apart
+    # by the leading "{")
+    data = json.dumps(message, separators=(",", ":")).encode()
+    return data if len(data) <= MAX_DATAGRAM else zlib.compress(data)
+
+
+def decode(data):
+    return json.loads(data if data[:1] == b"{" else zlib.decompress(data))
+
+
+def delta(previous, current):
+    # Fields of current that differ from previous; lists as {"i": changed indices, "v": their new values}
+    patch = {}
+    for name, value in current.items():
+        old = previous.get(name)
+        if isinstance(value, list) and isinstance(old, list) and len(old) == len(value):
+            changed = [i for i, (a, b) in enumerate(zip(old, value)) if a != b]
+            if changed:
+                patch[name] = {"i": changed, "v": [value[i] for i in changed]}
+        elif value != old:
+            patch[name] = value
+    return patch
+
+
+def apply_patch(state, patch):
+    for name, value in patch.items():
+        if isinstance(value, dict):
+            for i, v in zip(value["i"], value["v"]):
+                state[name][i] = v
+        else:
+            state[name] = value
+    return state
+
+
+class ProgressStream(StoppingPolicy):
+    """
+    Streams throttled samples of a run to the dashboard (see the module docstring); never stops a run.
+
+    interval: least number of seconds between samples (the first and the last sample are always sent).
+    heatmap: (columns, rows) of the downsampled prospect heatmap, or None.
+    label: name of the run on the dashboard (by default scenario and seed).
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, interval=0.5, heatmap=None, label=None):
+        self.address = tuple(address)
+        self.interval = interval
+        self.heatmap = None if heatmap is None else tuple(min(int(side), MAX_HEATMAP) for side in heatmap)
+        self.label = label
+        self.socket = None
+
+    def __getstate__(self):
+        # Shipped to batch workers without the socket; every run opens its own
+        state = dict(self.__dict__)
+        state["socket"] = None
+        return state
+
+    def to_dict(self):
+        return None
+
+    def start(self, model):
+        if self.socket is None:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.setblocking(False)
+        self.run = uuid.uuid4().hex[:12]
+        self.sequence = 0
+        self.previous = None
+        self.last_sent = None
+        heatmap = None if self.heatmap is None else (min(self.heatmap[0], model.width),
+                                                     min(self.heatmap[1], model.height))
+        self.run_heatmap = heatmap
+        self.meta = {
+            "label": self.label or f"{model.scenario} (seed {seed_label(model.streams.seed_sequence)})",
+            "scenario": model.scenario, "engine": model.engine, "num_members": int(model.num_members),
+            "num_prospects": int(model.num_prospects), "width": int(model.width), "height": int(model.height),
+            "heatmap": heatmap, "adopter_groups": list(ADOPTER_GROUPS), "pid": os.getpid(),
+        }
+
+    def check(self, model):
+        now = time.monotonic()
+        if self.last_sent is None or now - self.last_sent >= self.interval:
+            self.publish(model)
+            self.last_sent = now
+        return None
+
+    def finish(self, model):
+        self.publish(model, done=model.stop_reason or "stopped")
+        self.socket.close()
+        self.socket = None
+
+    def publish(self, model, done=None):
+        current = snapshot(model, self.run_heatmap)
+        message = {"run": self.run, "seq": self.sequence}
+        # The last sample is a keyframe too: a lost delta before it must not leave the run unfinished
+        if self.previous is None or self.sequence % KEYFRAME_EVERY == 0 or done is not None:
+            message["meta"] = self.meta
+            message["state"] = current
+        else:
+            message["patch"] = delta(self.previous, current)
+        if done is not None:
+            message["done"] = done
+        data = encode(message)
+        if len(data) > MAX_DATAGRAM and self.run_heatmap is not None:
+            # Too large even compressed: halve the heatmap resolution for the rest of the run, from a keyframe
+            heatmap = (max(self.run_heatmap[0] // 2, 1), max(self.run_heatmap[1] // 2, 1))
+            self.run_heatmap = None if heatmap == self.run_heatmap else heatmap
+            self.meta = dict(self.meta, heatmap=self.run_heatmap)
+            self.previous = None
+            return self.publish(model, done)
+        try:
+            self.socket.sendto(data, self.address)
+        except OSError:
+            pass  # No dashboard listening, or its buffer is full: the sample is dropped
+        self.previous = current
+        self.sequence += 1
+
+
+# Dashboard server
+#######################
+class DashboardState:
+    # Latest state of every streamed run, rebuilt from keyframes and deltas; finished runs are dropped after
+    # `linger` seconds, or earlier when more than `max_finished` runs have finished
+
+    def __init__(self, linger=FINISHED_LINGER, max_finished=MAX_FINISHED):
+        self.linger = linger
+        self.max_finished = max_finished
+        self.runs = {}  # run: {"meta", "state", "seq", "done", "points"}
+        self.finished = {}  # run: time it finished, oldest first
+        self.pushed = {}  # run: state as last pushed to the browsers
+        self.pushed_points = {}
+
+    def receive(self, message):
+        run = message["run"]
+        entry = self.runs.get(run)
+        if "state" in message:
+            if entry is None:
+                entry = self.runs[run] = {"meta": None, "points": [], "done": None}
+            if entry["meta"] != message["meta"]:
+                # A new run, or a coarser heatmap: the browsers get the whole run again
+                entry["meta"] = message["meta"]
+                self.pushed.pop(run, None)
+            entry["state"] = message["state"]
+        elif entry is None or message["seq"] != entry["seq"] + 1:
+            return  # A sample was lost: wait for the next keyframe
+        else:
+            apply_patch(entry["state"], message["patch"])
+        entry["seq"] = message["seq"]
+        entry["done"] = message.get("done", entry["done"])
+        if entry["done"] is not None and run not in self.finished:
+            self.finished[run] = time.monotonic()
+        state = entry["state"]
+        if not entry["points"] or entry["points"][-1][0] != state["step"]:
+            entry["points"].append([state["step"], state["num_joined"]])
+
+    def full(self):
+        return {"runs": {run: {"full": entry} for run, entry in self.runs.items()}}
+
+    def prune(self, now=None):
+        # Drop the finished runs that lingered long enough or exceed max_finished; returns their ids
+        now = time.monotonic() if now is None else now
+        removed = []
+        for run, finished in list(self.finished.items()):
+            if now - finished < self.linger and len(self.finished) <= self.max_finished:
+                break
+            del self.finished[run]
+            del self.runs[run]
+            self.pushed.pop(run, None)
+            self.pushed_points.pop(run, None)
+            removed.append(run)
+        return removed
+
+    def changes(self):
+        # Delta of every run since the last push, or None if nothing changed
+        runs = {run: {"removed": True} for run in self.prune()}
+        for run, entry in self.runs.items():
+            if run not in self.pushed:
+                runs[run] = {"full": entry}
+            else:
+                patch = delta(self.pushed[run], entry["state"])
+                points = entry["points"][self.pushed_points[run]:]
+                if patch or points or entry["done"] != self.pushed[run].get("_done"):
+                    runs[run] = {"patch": patch, "points": points, "done": entry["done"]}
+            self.pushed[run] = dict(copy.deepcopy(entry["state"]), _done=entry["done"])
+            self.pushed_points[run] = len(entry["points"])
+        return {"runs": runs} if runs else None
+
+
+def make_app(address=DEFAULT_ADDRESS, push_interval=0.5, linger=FINISHED_LINGER, max_finished=MAX_FINISHED):
+    # Tornado application of the dashboard; samples are read from a UDP socket on `address`
+    if tornado is None:
+        raise ImportError("The dashboard needs tornado (pip install tornado)")
+    state = DashboardState(linger, max_finished)
+    clients = set()
+
+    class IndexHandler(tornado.web.RequestHandler):
+        def get(self):
+            self.write(PAGE)
+
+    class StreamHandler(tornado.websocket.WebSocketHandler):
+        def open(self):
+            clients.add(self)
+            self.write_message(json.dumps(state.full()))
+
+        def on_close(self):
+            clients.discard(self)
+
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(tuple(address))
+    receiver.setblocking(False)
+
+    def on_datagrams(fd, events):
+        while True:
+            try:
+                data = receiver.recv(65536)
+            except BlockingIOError:
+                return
+            try:
+                state.receive(decode(data))
+            except (ValueError, KeyError, TypeError, zlib.error):
+                pass  # Malformed sample
+
+    def push():
+        changes = state.changes()
+        if changes is not None:
+            message = json.dumps(changes)
+            for client in list(clients):
+                client.write_message(message)
+
+    tornado.ioloop.IOLoop.current().add_handler(receiver.fileno(), on_datagrams, tornado.ioloop.IOLoop.READ)
+    app = tornado.web.Application([(r"/", IndexHandler), (r"/ws", StreamHandler)])
+    app.state = state
+    app.pusher = tornado.ioloop.PeriodicCallback(push, push_interval * 1000)
+    app.pusher.start()
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Live dashboard of running ANIMO replicates")
+    parser.add_argument("--port", type=int, default=HTTP_PORT, help="HTTP port of the dashboard page")
+    parser.add_argument("--stream-host", default=DEFAULT_ADDRESS[0])
+    parser.add_argument("--stream-port", type=int, default=DEFAULT_ADDRESS[1], help="UDP port of the progress streams")
+    parser.add_argument("--push-interval", type=float, default=0.5, help="seconds between browser updates")
+    parser.add_argument("--linger", type=float, default=FINISHED_LINGER, help="seconds finished runs stay shown")
+    parser.add_argument("--max-finished", type=int, default=MAX_FINISHED, help="most finished runs shown")
+    args = parser.parse_args(argv)
+    app = make_app((args.stream_host, args.stream_port), args.push_interval, args.linger, args.max_finished)
+    app.listen(args.port, address="127.0.0.1")
+    print(f"Dashboard on http://127.0.0.1:{args.port}, receiving progress on {args.stream_host}:{args.stream_port}")
+    tornado.ioloop.IOLoop.current().start()
+
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>ANIMO dashboard</title>
+<style>
+body { font-family: sans-serif; margin: 20px; } table { border-collapse: collapse; margin-top: 10px; }
+td, th { padding: 3px 8px; border-bottom: 1px solid #ddd; text-align: right; } tr:hover { background: #f4f4f4; }
+canvas { border: 1px solid #ccc; margin-right: 10px; }
+</style></head>
+<body>
+<h2>ANIMO replicates</h2>
+<canvas id="curves" width="640" height="320"></canvas><canvas id="heatmap" width="320" height="320"></canvas>
+<table id="runs"></table>
+<script>
+const runs = {};
+let selected = null;
+function patch(state, p) {
+  for (const [name, value] of Object.entries(p)) {
+    if (value !== null && typeof value === "object" && "i" in value) value.i.forEach((i, k) => state[name][i] = value.v[k]);
+    else state[name] = value;
+  }
+}
+function color(k) { return `hsl(${(k * 137) % 360}, 60%, 45%)`; }
+function draw() {
+  const ids = Object.keys(runs), c = document.getElementById("curves").getContext("2d");
+  c.clearRect(0, 0, 640, 320);
+  const maxStep = Math.max(1, ...ids.map(id => runs[id].state.step));
+  ids.forEach((id, k) => {
+    const run = runs[id];
+    c.strokeStyle = color(k); c.beginPath();
+    run.points.forEach(([step, joined], j) => {
+      const x = 5 + 630 * step / maxStep, y = 315 - 310 * joined / Math.max(1, run.meta.num_prospects);
+      j ? c.lineTo(x, y) : c.moveTo(x, y);
+    });
+    c.stroke();
+  });
+  let rows = "<tr><th>Run</th><th>Engine</th><th>Step</th><th>Joined</th><th>New members</th><th>Growth %</th>" +
+    (ids.length ? runs[ids[0]].meta.adopter_groups.map(g => `<th>${g}</th>`).join("") : "") + "<th></th></tr>";
+  ids.forEach((id, k) => {
+    const run = runs[id], s = run.state;
+    rows += `<tr onclick="selected='${id}';draw()" style="color:${color(k)}"><td>${run.meta.label}</td>` +
+      `<td>${run.meta.engine}</td><td>${s.step}</td><td>${s.num_joined}</td><td>${s.new_members}</td>` +
+      `<td>${s.growth_percentage.toFixed(1)}</td>` + s.joined_by_group.map(n => `<td>${n}</td>`).join("") +
+      `<td>${run.done || ""}</td></tr>`;
+  });
+  document.getElementById("runs").innerHTML = rows;
+  const run = runs[selected] || Object.values(runs).find(r => r.meta.heatmap);
+  const h = document.getElementById("heatmap").getContext("2d");
+  h.clearRect(0, 0, 320, 320);
+  if (run && run.meta.heatmap && run.state.prospects) {
+    const [w, ht] = run.meta.heatmap, total = run.state.prospects.map((n, i) => n + run.state.joined[i]);
+    const most = Math.max(1, ...total);
+    for (let i = 0; i < total.length; i++) {
+      const share = total[i] ? run.state.joined[i] / total[i] : 0;
+      h.fillStyle = `rgba(${Math.round(255 * (1 - share))}, ${Math.round(160 * share + 60)}, 90, ${total[i] / most})`;
+      h.fillRect(Math.floor(i / ht) * 320 / w, (i % ht) * 320 / ht, 320 / w + 1, 320 / ht + 1);
+    }
+  }
+}
+const socket = new WebSocket(`ws://${location.host}/ws`);
+socket.onmessage = event => {
+  for (const [id, change] of Object.entries(JSON.parse(event.data).runs)) {
+    if (change.removed) { delete runs[id]; continue; }
+    if (change.full) { runs[id] = change.full; continue; }
+    const run = runs[id];
+    if (!run) continue;
+    patch(run.state, change.patch); run.points.push(...change.points); run.done = change.done;
+  }
+  draw();
+};
+</script></body></html>
+"""
+
+
+if __name__ == "__main__":
+    main()
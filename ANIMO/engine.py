@@ -0,0 +1,287 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import numpy as np
+from population import TYPOLOGIES
+from scenarios import ADOPTER_GROUPS, NORMAL_SCALE
+from spatial import has_prospects_nearby
+from kernels import select_backend
+
+
+# Moore neighbourhood without the centre cell
+MOORE_STEPS = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if (dx, dy) != (0, 0)])
+
+
+# Supporting Functions
+#######################
+def expand_ranges(starts, counts):
+    # Concatenate the index ranges [start, start + count) into one flat array
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + (np.arange(total) - offsets)
+
+
+def group_by_cell(indices, cells):
+    # The indices sorted by cell, the occupied cells (sorted) and the start offset of every occupied cell's
+    # indices followed by the total; only the occupied cells are kept, never the whole grid
+    sort = np.argsort(cells, kind="stable")
+    cells = cells[sort]
+    first = np.flatnonzero(np.concatenate(([True], cells[1:] != cells[:-1]))) if cells.size else cells
+    return indices[sort], cells[first], np.append(first, cells.size)
+
+
+def cell_ranges(occupied, starts, cells):
+    # Start offset and number of indices of every queried cell in the order of group_by_cell (none if unoccupied)
+    index = np.minimum(np.searchsorted(occupied, cells), occupied.size - 1)
+    found = occupied[index] == cells
+    return starts[index], np.where(found, starts[index + 1] - starts[index], 0)
+
+
+class ArrayEngine:
+    """
+    Array-backed counterpart of the mesa agents of an EnergyCommunityModel.
+
+    Agent attributes are kept in NumPy arrays (members first, then prospects, as in the mesa
+    path) and every phase of a model step runs as a batched array operation that applies the same
+    rules as the agent-by-agent updates of the mesa path: a prospect convinced by several members
+    joins once, and a friend check counts the friends that joined earlier in the phase (see
+    join_in_order). Random numbers are drawn in a different order, so the engines agree in
+    distribution, not draw by draw.
+
+    Phases only visit their active agents: the prospects that have not joined (kept in `unconverted`,
+    in index order) and the members with such a prospect within reach. Movement and contacts run as
+    NumPy array operations or, with kernels="numba" (the default when Numba is installed), as compiled
+    loops (see kernels.py) that give the same results.
+    """
+
+    def __init__(self, model, kernels="auto"):
+        self.model = model
+        self.width = model.width
+        self.height = model.height
+        self.scenario = model.scenario
+        self.num_members = int(model.num_members)
+        self.num_prospects = int(model.num_prospects)
+        self.join_probability = model.settings["join_probability"]
+        self.friends_threshold_means = np.asarray(model.settings["friends_threshold_means"])
+        # Random streams per subsystem, shared with the model
+        self.streams = model.streams
+        self.kernels = select_backend(kernels)
+
+        # Positions are updated in place, so they are copied from the (shareable) population
+        population = model.population
+        self.member_x = population.member_x.copy()
+        self.member_y = population.member_y.copy()
+        self.member_reach = population.member_reach
+        self.convincing_prowess = population.convincing_prowess
+        self.member_typology = population.member_typology
+        self.prospect_x = population.prospect_x.copy()
+        self.prospect_y = population.prospect_y.copy()
+        self.adopter_group = population.adopter_group
+        self.receptivity = population.receptivity
+        self.joined = np.zeros(self.num_prospects, dtype=bool)
+        self.unconverted = np.arange(self.num_prospects)
+
+    def prospects_find_peers(self):
+        # Friendships as a CSR adjacency: friends of prospect i are friends[friends_indptr[i]:friends_indptr[i + 1]]
+        network = self.model.network
+        self.friends_indptr = network.indptr
+        self.friends = network.indices
+        self.degree = network.degree
+
+        # Reverse friendship index: prospects that count prospect j as a friend are
+        # followers[followers_indptr[j]:followers_indptr[j + 1]]
+        self.followers_indptr, self.followers = network.reverse()
+        self.num_friends_joined = np.zeros(self.num_prospects, dtype=np.int64)
+
+    def join_community(self, prospects):
+        # Flip the status of the given prospects and update the joined-friend counters of their followers
+        prospects = np.unique(prospects)
+        prospects = prospects[~self.joined[prospects]]
+        self.joined[prospects] = True
+        if prospects.size:
+            self.unconverted = self.unconverted[~self.joined[self.unconverted]]
+        self.model.num_joined += int(prospects.size)
+        self.model.joined_by_group += np.bincount(self.adopter_group[prospects], minlength=len(ADOPTER_GROUPS))
+        starts = self.followers_indptr[prospects]
+        counts = self.followers_indptr[prospects + 1] - starts
+        np.add.at(self.num_friends_joined, self.followers[expand_ranges(starts, counts)], 1)
+
+    def reset_active_sets(self):
+        # Rebuild the active sets from the statuses (e.g. after restoring a checkpoint)
+        self.unconverted = np.flatnonzero(~self.joined)
+
+    def move_agents(self):
+        # Every member and every prospect that has not joined takes a random step within its Moore neighbourhood
+        # on the torus; converted prospects stay put, as their position affects neither contacts nor friendships
+        moving = self.unconverted
+        member_choice = self.streams.movement.integers(len(MOORE_STEPS), size=self.num_members)
+        prospect_choice = self.streams.movement.integers(len(MOORE_STEPS), size=moving.size)
+        if self.kernels is not None:
+            self.kernels.random_walk(self.member_x, self.member_y, np.arange(self.num_members), member_choice,
+                                     MOORE_STEPS, self.width, self.height)
+            self.kernels.random_walk(self.prospect_x, self.prospect_y, moving, prospect_choice, MOORE_STEPS,
+                                     self.width, self.height)
+        else:
+            self.member_x[:] = (self.member_x + MOORE_STEPS[member_choice, 0]) % self.width
+            self.member_y[:] = (self.member_y + MOORE_STEPS[member_choice, 1]) % self.height
+            self.prospect_x[moving] = (self.prospect_x[moving] + MOORE_STEPS[prospect_choice, 0]) % self.width
+            self.prospect_y[moving] = (self.prospect_y[moving] + MOORE_STEPS[prospect_choice, 1]) % self.height
+        self.model.num_agents_scanned += self.num_members + int(moving.size)
+
+    def prospects_by_cell(self):
+        # Indices of the prospects that have not joined yet sorted by grid cell, with the occupied cells and their
+        # start offsets (see group_by_cell)
+        not_joined = self.unconverted
+        return group_by_cell(not_joined, self.prospect_x[not_joined] * self.height + self.prospect_y[not_joined])
+
+    def active_members(self, cells):
+        # Members with at least one non-joined prospect within reach, given the sorted occupied cells
+        return np.flatnonzero(has_prospects_nearby(cells, self.member_x, self.member_y, self.member_reach,
+                                                   self.width, self.height))
+
+    def contact_setup(self):
+        # (prospects sorted by cell, occupied cells, their start offsets, active members, largest reach), or None
+        # without contacts
+        if self.num_members == 0 or self.unconverted.size == 0:
+            return None
+        order, occupied, starts = self.prospects_by_cell()
+        members = self.active_members(occupied)
+        self.model.num_neighbor_queries += int(members.size)
+        self.model.num_agents_scanned += int(members.size)
+        max_reach = int(self.member_reach.max())
+        if max_reach == 0 or members.size == 0:
+            return None
+        return order, occupied, starts, members, max_reach
+
+    def contact_pairs(self, order, occupied, starts, members, max_reach):
+        # All (member, non-joined prospect) pairs where the prospect is within the member's reach
+        span = np.arange(-max_reach, max_reach + 1)
+        dx, dy = np.meshgrid(span, span, indexing="ij")
+        dx, dy = dx.ravel(), dy.ravel()
+        distance = np.maximum(np.abs(dx), np.abs(dy))
+        within = (distance[None, :] <= self.member_reach[members, None]) & (distance[None, :] > 0)
+        member_index, offset_index = np.nonzero(within)
+        member_index = members[member_index]
+        cell_x = (self.member_x[member_index] + dx[offset_index]) % self.width
+        cell_y = (self.member_y[member_index] + dy[offset_index]) % self.height
+        cells = cell_x * self.height + cell_y
+        if 2 * max_reach + 1 > min(self.width, self.height):
+            # On small grids the neighbourhood wraps around the torus onto itself
+            keep = np.unique(member_index * (self.width * self.height) + cells)
+            member_index, cells = np.divmod(keep, self.width * self.height)
+            # A member's own cell is excluded from its neighbourhood
+            own = self.member_x[member_index] * self.height + self.member_y[member_index]
+            member_index, cells = member_index[own != cells], cells[own != cells]
+
+        starts, counts = cell_ranges(occupied, starts, cells)
+        pair_member = np.repeat(member_index, counts)
+        pair_prospect = order[expand_ranges(starts, counts)]
+        return pair_member, pair_prospect
+
+    def contact_draws(self):
+        # One Bernoulli conversion draw per (member, prospect) pair; returns the convinced prospects and their
+        # members in pair order, and the number of pairs
+        empty = np.zeros(0, dtype=np.int64)
+        setup = self.contact_setup()
+        if setup is None:
+            return empty, empty, 0
+        order, occupied, starts, members, max_reach = setup
+        if self.kernels is None:
+            pair_member, pair_prospect = self.contact_pairs(order, occupied, starts, members, max_reach)
+            probability = np.abs(self.receptivity[pair_prospect] * self.convincing_prowess[pair_member])
+            convinced = self.streams.contact.random(pair_prospect.size) < probability
+            return pair_prospect[convinced], pair_member[convinced], int(pair_prospect.size)
+
+        wraps = 2 * max_reach + 1 > min(self.width, self.height)
+        num_pairs = int(self.kernels.count_contacts(members, self.member_x, self.member_y, self.member_reach,
+                                                    occupied, starts, self.width, self.height, wraps, max_reach))
+        uniform = self.streams.contact.random(num_pairs)
+        converted = np.empty(num_pairs, dtype=np.int64)
+        converters = np.empty(num_pairs, dtype=np.int64)
+        n = self.kernels.convert_contacts(members, self.member_x, self.member_y, self.member_reach, occupied, starts,
+                                          order, self.receptivity, self.convincing_prowess, uniform, self.width,
+                                          self.height, wraps, max_reach, converted, converters)
+        return converted[:n], converters[:n], num_pairs
+
+    def contact_and_influence(self):
+        # Current members search for prospective members and have a chance at convincing them
+        convinced, convincing_members, num_pairs = self.contact_draws()
+        self.model.num_agents_scanned += num_pairs
+        # Credit every converted prospect to the first member that convinced it
+        converted, first = np.unique(convinced, return_index=True)
+        converters = convincing_members[first]
+        self.join_community(converted)
+        if self.model.events is not None:
+            self.model.events.record_contact(self.model, converted, converters)
+        self.model.conversions_by_typology += np.bincount(self.member_typology[converters],
+                                                          minlength=len(TYPOLOGIES))
+        self.model.num_attempts += num_pairs
+
+    def peer_draws(self, candidates, degree, adopter_group):
+        # Required number of joined friends (from the threshold of the adopter group) and the chance of joining
+        # based on world narrative, of every candidate
+        threshold_means = self.friends_threshold_means[adopter_group[candidates]]
+        percent_neighbors_needed = self.streams.peer.normal(threshold_means, NORMAL_SCALE)
+        willing = self.streams.peer.random(candidates.size) < self.join_probability
+        return degree[candidates] * percent_neighbors_needed, willing
+
+    def join_in_order(self, candidates, num_required_neighbors, willing):
+        """
+        Candidates (sorted) that join through their friends when visited one by one in index order, as in
+        the mesa path: each counts its friends that joined before the phase or earlier in it. Joins are found
+        in rounds, every round re-checking only the candidates that gained a joined friend in the previous one.
+        """
+        # Friends that joined earlier in this phase, per candidate
+        gained = np.zeros(candidates.size, dtype=np.int64)
+        joined = np.zeros(candidates.size, dtype=bool)
+        pending = np.arange(candidates.size)
+        while pending.size:
+            passing = pending[willing[pending] & ~joined[pending] &
+                              (self.num_friends_joined[candidates[pending]] + gained[pending] >
+                               num_required_neighbors[pending])]
+            if passing.size == 0:
+                break
+            joined[passing] = True
+            # Followers of the new joiners among the candidates visited after them
+            starts = self.followers_indptr[candidates[passing]]
+            counts = self.followers_indptr[candidates[passing] + 1] - starts
+            followers = self.followers[expand_ranges(starts, counts)]
+            position = np.minimum(np.searchsorted(candidates, followers), candidates.size - 1)
+            later = (candidates[position] == followers) & (position > np.repeat(passing, counts))
+            np.add.at(gained, position[later], 1)
+            pending = np.unique(position[later])
+        return candidates[joined]
+
+    def check_friends_and_join(self):
+        # Number of friends who have joined the community is kept up to date by join_community
+        candidates = self.unconverted[self.degree[self.unconverted] > 0]
+        self.model.num_agents_scanned += int(self.unconverted.size)
+        num_required_neighbors, willing = self.peer_draws(candidates, self.degree, self.adopter_group)
+        joining = self.join_in_order(candidates, num_required_neighbors, willing)
+        self.join_community(joining)
+        if self.model.events is not None:
+            self.model.events.record_peer(self.model, joining)
+
+    def member_typologies(self):
+        return [TYPOLOGIES[i] for i in self.member_typology]
+
+    def close(self):
+        # Nothing to release; the sharded engine stops its workers here
+        pass
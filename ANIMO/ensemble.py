@@ -0,0 +1,346 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import os
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+from batch import run_single, configuration_columns, GROUP_COLUMNS
+
+"""Online ensemble statistics of the adoption curves of many replicates.
+
+Every replicate is folded into running per-step statistics as soon as it finishes: the mean and variance
+(Welford's update) and a fixed-bin histogram per step for the quantiles. Memory grows with the number of
+steps, not with the number of replicates. A replicate that stopped early (saturation) keeps its last value
+for all later steps, also when a longer replicate arrives afterwards. Typical use:
+
+    ensemble = run_ensemble(make_run_specs(["Familiar", "Unified"], [100], [1000], [(50, 50)], 500, seed=1),
+                            target_width=10, min_replicates=20)
+    ensemble.to_dataframe()          # mean, standard deviation, confidence interval and quantiles per step
+    ensemble.replicates_needed(10)   # replicates for a 95% confidence interval 10 new members wide
+"""
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# Most histogram bins per step; integer values within the range get one bin each up to this number
+MAX_BINS = 1000
+
+
+# Supporting Functions
+#######################
+def value_range(run, value):
+    # Range of the stored values of a run (from its run_spec or results row)
+    if value in ("new_members", "num_joined"):
+        return 0, run["num_prospects"]
+    if value == "growth_percentage":
+        return 0, run["num_prospects"] / run["num_members"] * 100
+    raise ValueError(f"Unknown ensemble value '{value}'")
+
+
+def normal_quantile(confidence):
+    # Two-sided normal critical value, e.g. 1.96 for 95%
+    return NormalDist().inv_cdf(0.5 + confidence / 2)
+
+
+def combine_moments(count_a, mean_a, m2_a, count_b, mean_b, m2_b):
+    # Count, mean and sum of squared deviations of two merged samples (Chan et al.)
+    count = count_a + count_b
+    if count == 0:
+        return 0, mean_a, m2_a
+    delta = mean_b - mean_a
+    mean = mean_a + delta * count_b / count
+    m2 = m2_a + m2_b + delta ** 2 * count_a * count_b / count
+    return count, mean, m2
+
+
+class EnsembleStatistics:
+    """
+    Running per-step statistics of replicate curves whose values lie within [low, high].
+
+    Quantiles come from an equal-width histogram of `bins` bins per step, so they are exact to within half
+    a bin width; by default every integer of the range gets its own bin (up to MAX_BINS bins). With
+    `steps` the curves are cut or carried forward to that many steps, otherwise the horizon grows with the
+    longest replicate seen.
+    """
+
+    def __init__(self, low, high, bins=None, steps=None):
+        if bins is None and high - low + 1 <= MAX_BINS:
+            # One bin per integer value, centred on it
+            low, high = low - 0.5, high + 0.5
+            bins = int(round(high - low))
+        elif bins is None:
+            bins = MAX_BINS
+        self.low = float(low)
+        self.high = float(high)
+        self.bins = int(bins)
+        self.fixed_steps = steps
+        self.count = 0
+        self.mean = np.zeros(0)
+        self.m2 = np.zeros(0)
+        self.histogram = np.zeros((0, self.bins), dtype=np.int64)
+        # Statistics of the final values, which fill the steps past the end of the shorter replicates
+        self.final_mean = 0.0
+        self.final_m2 = 0.0
+        self.final_histogram = np.zeros(self.bins, dtype=np.int64)
+        if steps is not None:
+            self.extend(steps)
+
+    @property
+    def steps(self):
+        return len(self.mean)
+
+    def bin_of(self, values):
+        # Histogram bin of every value; values outside the range go to the first or last bin
+        width = (self.high - self.low) / self.bins if self.high > self.low else 1.0
+        return np.clip(((np.asarray(values, dtype=np.float64) - self.low) / width).astype(np.int64), 0,
+                       self.bins - 1)
+
+    def extend(self, steps):
+        # Grow the horizon: every replicate seen so far carries its final value into the new steps
+        new = steps - self.steps
+        if new <= 0:
+            return
+        self.mean = np.concatenate((self.mean, np.full(new, self.final_mean)))
+        self.m2 = np.concatenate((self.m2, np.full(new, self.final_m2)))
+        self.histogram = np.concatenate((self.histogram, np.tile(self.final_histogram, (new, 1))))
+
+    def add(self, values):
+        # Fold one replicate curve (value after every step, from step 1) into the statistics
+        values = np.asarray(values, dtype=np.float64)
+        if self.fixed_steps is not None:
+            values = values[:self.fixed_steps]
+        if len(values) == 0:
+            return self
+        self.extend(len(values))
+        final = values[-1]
+        if len(values) < self.steps:
+            values = np.concatenate((values, np.full(self.steps - len(values), final)))
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (values - self.mean)
+        self.histogram[np.arange(self.steps), self.bin_of(values)] += 1
+        final_delta = final - self.final_mean
+        self.final_mean += final_delta / self.count
+        self.final_m2 += final_delta * (final - self.final_mean)
+        self.final_histogram[self.bin_of(final)] += 1
+        return self
+
+    def merge(self, other):
+        # Fold in the statistics of another ensemble over the same range and bins (e.g. from another process)
+        if (other.low, other.high, other.bins) != (self.low, self.high, self.bins):
+            raise ValueError("Only ensembles with the same range and bins can be merged")
+        steps = max(self.steps, other.steps)
+        if self.fixed_steps is not None:
+            steps = self.fixed_steps
+        self.extend(steps)
+        other_mean = np.concatenate((other.mean, np.full(max(steps - other.steps, 0), other.final_mean)))[:steps]
+        other_m2 = np.concatenate((other.m2, np.full(max(steps - other.steps, 0), other.final_m2)))[:steps]
+        other_histogram = np.concatenate((other.histogram, np.tile(other.final_histogram,
+                                                                   (max(steps - other.steps, 0), 1))))[:steps]
+        count = self.count
+        _, self.mean, self.m2 = combine_moments(count, self.mean, self.m2, other.count, other_mean, other_m2)
+        _, self.final_mean, self.final_m2 = combine_moments(count, self.final_mean, self.final_m2, other.count,
+                                                            other.final_mean, other.final_m2)
+        self.histogram += other_histogram
+        self.final_histogram += other.final_histogram
+        self.count += other.count
+        return self
+
+    def variance(self):
+        # Sample variance per step
+        return self.m2 / (self.count - 1) if self.count > 1 else np.full(self.steps, np.nan)
+
+    def std(self):
+        return np.sqrt(self.variance())
+
+    def quantile(self, q):
+        # Quantile(s) per step, interpolated within the histogram bins: (steps,) or (len(q), steps)
+        q = np.asarray(q, dtype=np.float64)
+        if self.count == 0:
+            return np.full(q.shape + (self.steps,), np.nan)
+        width = (self.high - self.low) / self.bins
+        cumulative = np.cumsum(self.histogram, axis=1)
+        result = np.empty(q.shape + (self.steps,))
+        for index, level in np.ndenumerate(q):
+            rank = level * self.count
+            # First bin whose cumulative count reaches the rank, and the position of the rank within it
+            bin_index = np.minimum((cumulative < rank).sum(axis=1), self.bins - 1)
+            steps = np.arange(self.steps)
+            before = np.where(bin_index > 0, cumulative[steps, bin_index - 1], 0)
+            inside = self.histogram[steps, bin_index]
+            fraction = np.where(inside > 0, (rank - before) / np.maximum(inside, 1), 0.5)
+            result[index] = self.low + (bin_index + np.clip(fraction, 0, 1)) * width
+        return result
+
+    def confidence_interval(self, confidence=0.95):
+        # Normal-approximation confidence interval of the mean per step: (low, high)
+        half_width = normal_quantile(confidence) * self.std() / np.sqrt(max(self.count, 1))
+        return self.mean - half_width, self.mean + half_width
+
+    def replicates_needed(self, target_width, confidence=0.95):
+        # Replicates for a confidence interval of the mean at most target_width wide at every step
+        if self.count < 2:
+            return None
+        required = (2 * normal_quantile(confidence) * self.std() / target_width) ** 2
+        return int(np.ceil(required.max())) if self.steps else 0
+
+    def converged(self, target_width, confidence=0.95, min_replicates=2):
+        needed = self.replicates_needed(target_width, confidence)
+        return needed is not None and self.count >= max(needed, min_replicates)
+
+    def to_dataframe(self, quantiles=QUANTILES, confidence=0.95):
+        ci_low, ci_high = self.confidence_interval(confidence)
+        frame = pd.DataFrame({"step": np.arange(1, self.steps + 1), "replicates": self.count, "mean": self.mean,
+                              "std": self.std(), "ci_low": ci_low, "ci_high": ci_high})
+        for q, values in zip(quantiles, self.quantile(quantiles)):
+            frame[f"q{q:g}"] = values
+        return frame
+
+
+class EnsembleAggregator:
+    """
+    EnsembleStatistics of every configuration (GROUP_COLUMNS) of a sweep, fed with long-format results
+    frames (batch.results_frame) one replicate at a time.
+    """
+
+    def __init__(self, value="new_members", steps=None, bins=None):
+        self.value = value
+        self.steps = steps
+        self.bins = bins
+        self.groups = {}
+
+    def key(self, run):
+        # run: a run specification or a results row
+        if isinstance(run, dict):
+            run = configuration_columns(run)
+        return tuple(run[column] for column in GROUP_COLUMNS)
+
+    def statistics(self, run):
+        key = self.key(run)
+        if key not in self.groups:
+            low, high = value_range(run, self.value)
+            self.groups[key] = EnsembleStatistics(low, high, bins=self.bins, steps=self.steps)
+        return self.groups[key]
+
+    def add_run(self, frame):
+        if len(frame):
+            self.statistics(frame.iloc[0]).add(frame.sort_values("step")[self.value].to_numpy())
+        return self
+
+    def converged(self, run, target_width, confidence=0.95, min_replicates=2):
+        key = self.key(run)
+        return key in self.groups and self.groups[key].converged(target_width, confidence, min_replicates)
+
+    def replicates_needed(self, target_width, confidence=0.95):
+        # {configuration: replicates needed} (None for configurations with fewer than two replicates)
+        return {key: statistics.replicates_needed(target_width, confidence) for key, statistics in self.groups.items()}
+
+    def to_dataframe(self, quantiles=QUANTILES, confidence=0.95):
+        frames = []
+        for key, statistics in self.groups.items():
+            frame = statistics.to_dataframe(quantiles, confidence)
+            for column, value in zip(GROUP_COLUMNS, key):
+                frame[column] = value
+            frames.append(frame[GROUP_COLUMNS + [column for column in frame.columns if column not in GROUP_COLUMNS]])
+        if not frames:
+            return pd.DataFrame(columns=GROUP_COLUMNS + ["step", "replicates", "mean"])
+        return pd.concat(frames, ignore_index=True)
+
+
+def summarize_store(store, value="new_members", steps=None, bins=None):
+    # EnsembleAggregator of all replicates of a results.ResultsStore, read one replicate at a time
+    aggregator = EnsembleAggregator(value, steps=steps, bins=bins)
+    for frame in store.iter_chunks(GROUP_COLUMNS + ["step", value]):
+        aggregator.add_run(frame)
+    return aggregator
+
+
+# Sweep with early stopping
+#######################
+def run_ensemble(run_specs, target_width=None, confidence=0.95, min_replicates=10, value="new_members",
+                 steps=None, bins=None, processes=None, store=None):
+    """
+    Run the replicates of a sweep (batch.make_run_specs) into an EnsembleAggregator, and stop running the
+    replicates of a configuration once its confidence interval is narrower than target_width at every step.
+
+    Replicates are submitted in replicate order and folded in that order too, whatever order they finish
+    in, so that early stopping is not biased towards the replicates that saturate (and finish) first.
+    store: a results.ResultsStore; stored replicates are folded in without running them again and new
+    replicates are written to it.
+    """
+    aggregator = EnsembleAggregator(value, steps=steps, bins=bins)
+    pending = sorted(run_specs, key=lambda run_spec: (run_spec["replicate"], run_spec["run_id"]))
+    results = {}
+    next_index = 0
+
+    def done(run_spec):
+        return target_width is not None and aggregator.converged(run_spec, target_width, confidence, min_replicates)
+
+    def fold():
+        # Fold the finished replicates in replicate order, skipping those of converged configurations
+        nonlocal next_index
+        while next_index < len(pending) and next_index in results:
+            run_spec, frame = results.pop(next_index)
+            if frame is not None and not done(run_spec):
+                aggregator.add_run(frame)
+            next_index += 1
+
+    def stored_frame(run_spec):
+        if store is not None and run_spec in store:
+            return store.read_run(run_spec)
+        return None
+
+    if processes == 1:
+        for index, run_spec in enumerate(pending):
+            if not done(run_spec):
+                frame = stored_frame(run_spec)
+                if frame is None:
+                    frame = run_single(run_spec)[1]
+                    if store is not None:
+                        store.write_run(run_spec, frame)
+                results[index] = (run_spec, frame)
+            else:
+                results[index] = (run_spec, None)
+            fold()
+        return aggregator
+
+    # At most two replicates per worker in flight, so that converged configurations waste little work
+    workers = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {}
+        submitted = 0
+        while next_index < len(pending):
+            while submitted < len(pending) and len(futures) < 2 * workers:
+                run_spec = pending[submitted]
+                frame = stored_frame(run_spec) if not done(run_spec) else None
+                if done(run_spec) or frame is not None:
+                    results[submitted] = (run_spec, frame)
+                else:
+                    futures[executor.submit(run_single, run_spec)] = submitted
+                submitted += 1
+            if futures:
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    run_spec, frame = future.result()
+                    if store is not None:
+                        store.write_run(run_spec, frame)
+                    results[futures.pop(future)] = (run_spec, frame)
+            fold()
+    return aggregator
@@ -0,0 +1,297 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import os
+import numpy as np
+import pandas as pd
+from engine import expand_ranges
+from population import TYPOLOGIES
+from scenarios import ADOPTER_GROUPS
+
+"""Binary log of the adoption events of a model run: who joined, when, and through which channel.
+
+Every join is one fixed-width record: the step, the prospect (index in agent order, members excluded), the
+converting member (-1 for peer joins), the channel (CONTACT: convinced by a member in contact_and_influence,
+PEER: enough friends joined in check_friends_and_join), the prospect's adopter group and the converting
+member's typology (-1 for peer joins). Records are gathered in a preallocated buffer and written to a
+memory-mapped file when it is full and at the end of a run:
+
+    model = EnergyCommunityModel(100, 10000, 100, 100, engine="array", events=EventLog("events.bin"))
+    model.run_model()
+    model.close()
+    influence_by_typology("events.bin")           # conversions per member typology and adopter group
+    cascades("events.bin", model.network)         # who converted whom, as cascade trees
+
+The readers map the file and go through it block by block, so the log is never loaded as a whole. A log
+saved with a checkpoint is reopened by load_checkpoint, and fork(model, events=EventLog(...)) starts the
+branch's log with the parent's events, so restored and forked runs keep the provenance of earlier joins."""
+
+CONTACT = 0
+PEER = 1
+CHANNELS = ("contact", "peer")
+
+EVENT_DTYPE = np.dtype([("step", "<i4"), ("prospect", "<i4"), ("member", "<i4"), ("channel", "u1"),
+                        ("adopter_group", "i1"), ("typology", "i1")])
+
+# File header: magic bytes and the number of records written
+MAGIC = b"ANIMOEV1"
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("count", "<i8")])
+
+
+class EventLog:
+    """
+    Append-only event log of one model run (see the module docstring), opted in with the model's
+    `events` argument.
+
+    buffer_size records are kept in memory between writes. The file grows in steps of at least as many
+    records and is cut to its exact length by close(); the record count in the header is updated on every
+    flush, so the log stays readable if a run is interrupted. An existing file is only replaced with
+    overwrite=True; EventLog.append continues an existing log instead.
+    """
+
+    def __init__(self, file_path, buffer_size=65536, overwrite=False):
+        if os.path.exists(file_path) and not overwrite:
+            raise FileExistsError(f"{file_path} exists; pass overwrite=True to replace it or use EventLog.append")
+        self.file_path = file_path
+        self.buffer = np.zeros(buffer_size, dtype=EVENT_DTYPE)
+        self.size = 0  # Records in the buffer
+        self.count = 0  # Records in the file
+        self.capacity = 0  # Records the file has room for
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header["magic"] = MAGIC
+        with open(file_path, "wb") as file:
+            file.write(header.tobytes())
+
+    @classmethod
+    def append(cls, file_path, count=None, buffer_size=65536):
+        # Continue an existing log after its first `count` records (all by default); later records are
+        # dropped, e.g. the joins of a pre-empted run after the checkpoint it is restored from
+        available = len(read_events(file_path))
+        if count is None:
+            count = available
+        if count > available:
+            raise ValueError(f"{file_path} holds {available} events, {count} expected")
+        log = cls.__new__(cls)
+        log.file_path = file_path
+        log.buffer = np.zeros(buffer_size, dtype=EVENT_DTYPE)
+        log.size = 0
+        log.count = count
+        log.capacity = count
+        log.write_header()
+        log.close()
+        return log
+
+    def extend_from(self, file_path, count=None, block_size=1 << 20):
+        # Copy the first `count` records of another log (all by default), e.g. the events of a forked parent
+        events = read_events(file_path)
+        count = len(events) if count is None else count
+        self.flush()
+        for start in range(0, count, block_size):
+            self.write_records(np.asarray(events[start:min(start + block_size, count)]))
+
+    def record(self, model, channel, prospects, members=None):
+        # Log the joins of the given prospect indices; members: converting member indices (contact channel)
+        prospects = np.asarray(prospects, dtype=np.int64)
+        n = prospects.size
+        if n == 0:
+            return
+        if self.size + n > len(self.buffer):
+            self.flush()
+            if n > len(self.buffer):
+                self.buffer = np.zeros(n, dtype=EVENT_DTYPE)
+        records = self.buffer[self.size:self.size + n]
+        records["step"] = model.schedule.steps
+        records["prospect"] = prospects
+        records["channel"] = channel
+        records["adopter_group"] = model.population.adopter_group[prospects]
+        if members is None:
+            records["member"] = -1
+            records["typology"] = -1
+        else:
+            members = np.asarray(members, dtype=np.int64)
+            records["member"] = members
+            records["typology"] = model.population.member_typology[members]
+        self.size += n
+
+    def record_contact(self, model, prospects, members):
+        self.record(model, CONTACT, prospects, members)
+
+    def record_peer(self, model, prospects):
+        self.record(model, PEER, prospects)
+
+    def flush(self):
+        # Write the buffered records to the file
+        if self.size == 0:
+            return
+        self.write_records(self.buffer[:self.size])
+        self.size = 0
+
+    def write_records(self, records):
+        # Append records to the file through a memory map
+        n = len(records)
+        if n == 0:
+            return
+        if self.count + n > self.capacity:
+            self.capacity = max(2 * self.capacity, self.count + n, len(self.buffer))
+            with open(self.file_path, "r+b") as file:
+                file.truncate(HEADER_DTYPE.itemsize + self.capacity * EVENT_DTYPE.itemsize)
+        mapped = np.memmap(self.file_path, dtype=EVENT_DTYPE, mode="r+", shape=(n,),
+                           offset=HEADER_DTYPE.itemsize + self.count * EVENT_DTYPE.itemsize)
+        mapped[:] = records
+        mapped.flush()
+        del mapped
+        self.count += n
+        self.write_header()
+
+    def write_header(self):
+        header = np.memmap(self.file_path, dtype=HEADER_DTYPE, mode="r+", shape=(1,))
+        header["count"] = self.count
+        header.flush()
+        del header
+
+    def close(self):
+        self.flush()
+        with open(self.file_path, "r+b") as file:
+            file.truncate(HEADER_DTYPE.itemsize + self.count * EVENT_DTYPE.itemsize)
+        self.capacity = self.count
+
+
+# Readers
+#######################
+def read_events(file_path):
+    # The records of an event log as a read-only memory map (nothing is loaded until it is indexed)
+    header = np.fromfile(file_path, dtype=HEADER_DTYPE, count=1)
+    if len(header) == 0 or header["magic"][0] != MAGIC:
+        raise ValueError(f"{file_path} is not an ANIMO event log")
+    count = int(header["count"][0])
+    if count == 0:
+        return np.zeros(0, dtype=EVENT_DTYPE)
+    return np.memmap(file_path, dtype=EVENT_DTYPE, mode="r", shape=(count,), offset=HEADER_DTYPE.itemsize)
+
+
+def iter_blocks(file_path, block_size=1 << 20):
+    # Consecutive blocks of at most block_size records, in log (chronological) order
+    events = read_events(file_path)
+    for start in range(0, len(events), block_size):
+        yield np.asarray(events[start:start + block_size])
+
+
+def events_dataframe(file_path, start=0, stop=None):
+    # A slice of the log as a DataFrame with readable channel, adopter group and typology names
+    events = np.asarray(read_events(file_path)[start:stop])
+    frame = pd.DataFrame({name: events[name] for name in EVENT_DTYPE.names})
+    frame["channel"] = np.array(CHANNELS)[frame["channel"]]
+    frame["adopter_group"] = np.array(ADOPTER_GROUPS)[frame["adopter_group"]]
+    frame["typology"] = np.where(frame["typology"] >= 0, np.array(TYPOLOGIES)[frame["typology"].clip(0)], None)
+    return frame
+
+
+def influence_by_typology(file_path, block_size=1 << 20):
+    """
+    Contact conversions per typology of the converting member (rows) and adopter group of the converted
+    prospect (columns), with the number of distinct converting members and the conversions per member;
+    peer joins are counted in a separate "Peer" row.
+    """
+    conversions = np.zeros((len(TYPOLOGIES) + 1, len(ADOPTER_GROUPS)), dtype=np.int64)
+    # Distinct converting members, encoded as member * len(TYPOLOGIES) + typology
+    converting_members = np.zeros(0, dtype=np.int64)
+    for block in iter_blocks(file_path, block_size):
+        row = np.where(block["channel"] == CONTACT, block["typology"], len(TYPOLOGIES)).astype(np.int64)
+        cells = row * len(ADOPTER_GROUPS) + block["adopter_group"]
+        conversions += np.bincount(cells, minlength=conversions.size).reshape(conversions.shape)
+        contact = block[block["channel"] == CONTACT]
+        converting_members = np.union1d(converting_members, contact["member"].astype(np.int64) * len(TYPOLOGIES) +
+                                        contact["typology"])
+    frame = pd.DataFrame(conversions, index=list(TYPOLOGIES) + ["Peer"], columns=list(ADOPTER_GROUPS))
+    frame["Total"] = frame.sum(axis=1)
+    members = np.bincount(converting_members % len(TYPOLOGIES), minlength=len(TYPOLOGIES))
+    frame["Members"] = np.append(members, 0)
+    frame["Per Member"] = (frame["Total"] / frame["Members"].where(frame["Members"] > 0)).where(frame.index != "Peer")
+    return frame
+
+
+def cascades(file_path, network, block_size=1 << 20):
+    """
+    Adoption cascades: one row per joined prospect with its step, channel, converting member, parent, root
+    member and depth in its cascade tree.
+
+    A prospect convinced by a member starts a cascade rooted at that member (depth 1, parent -1). A peer join
+    is attributed to the friend (in the model's FriendshipNetwork) that joined first, earlier in the log, and
+    continues that friend's cascade; a peer join without such a friend starts a cascade without a root member
+    (-1). Every engine logs the peer joins of a step in the order the friend check visits the prospects, so a
+    friend that joined earlier in the same phase, and counted towards the threshold, can be the parent.
+    Memory grows with the number of prospects, never with the number of blocks read.
+    """
+    never = np.iinfo(np.int64).max
+    num_prospects = network.num_prospects
+    # Log position of every join
+    position = np.full(num_prospects, never, dtype=np.int64)
+    prospect_at = np.zeros(num_prospects, dtype=np.int64)
+    root = np.full(num_prospects, -1, dtype=np.int64)
+    depth = np.zeros(num_prospects, dtype=np.int64)
+    # Peer joins of the current block whose cascade is not known yet
+    unresolved = np.zeros(num_prospects, dtype=bool)
+    frames = []
+    offset = 0
+    for block in iter_blocks(file_path, block_size):
+        prospects = block["prospect"].astype(np.int64)
+        block_position = offset + np.arange(len(block))
+        position[prospects] = block_position
+        prospect_at[offset:offset + len(block)] = prospects
+        parent = np.full(len(block), -1, dtype=np.int64)
+        contact = block["channel"] == CONTACT
+        root[prospects[contact]] = block["member"][contact]
+        depth[prospects] = 1
+
+        peer = np.flatnonzero(~contact)
+        if peer.size:
+            # First friend (lowest log position) that joined before the peer join
+            starts = network.indptr[prospects[peer]]
+            counts = network.indptr[prospects[peer] + 1] - starts
+            friends = network.indices[expand_ranges(starts, counts)].astype(np.int64)
+            owner = np.repeat(np.arange(peer.size), counts)
+            earlier = position[friends] < block_position[peer][owner]
+            first = np.full(peer.size, never, dtype=np.int64)
+            np.minimum.at(first, owner[earlier], position[friends[earlier]])
+            has_parent = first < never
+            parent[peer[has_parent]] = prospect_at[first[has_parent]]
+            # Parents joined earlier in the log, possibly in this block: cascades are extended once the
+            # parent's is known
+            pending = peer[has_parent]
+            unresolved[prospects[pending]] = True
+            while pending.size:
+                ready = pending[~unresolved[parent[pending]]]
+                root[prospects[ready]] = root[parent[ready]]
+                depth[prospects[ready]] = depth[parent[ready]] + 1
+                unresolved[prospects[ready]] = False
+                pending = pending[unresolved[prospects[pending]]]
+
+        frames.append(pd.DataFrame({"prospect": prospects, "step": block["step"],
+                                    "channel": np.array(CHANNELS)[block["channel"]], "member": block["member"],
+                                    "parent": parent, "root_member": root[prospects], "depth": depth[prospects]}))
+        offset += len(block)
+    if not frames:
+        return pd.DataFrame(columns=["prospect", "step", "channel", "member", "parent", "root_member", "depth"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def cascade_sizes(cascade_frame):
+    # Size and depth of the cascade of every root member, from cascades()
+    rooted = cascade_frame[cascade_frame["root_member"] >= 0]
+    return rooted.groupby("root_member").agg(size=("prospect", "size"), direct=("depth", lambda d: int((d == 1).sum())),
+                                             max_depth=("depth", "max")).sort_values("size", ascending=False)
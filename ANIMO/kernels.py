@@ -0,0 +1,140 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+from types import SimpleNamespace
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # Compiled kernels are optional, the array engine falls back to NumPy
+    numba = None
+
+"""Compiled kernels of the array engine (engine.ArrayEngine): the random-walk update, the torus radius
+contact test and the Bernoulli conversion draws.
+
+The kernels loop over agents instead of materialising every (member, prospect) pair. They take their
+random numbers ready-drawn from the model's streams and visit the pairs in the same order as the NumPy
+code, so both backends give the same results for the same seed. Without Numba the kernels are plain
+Python functions, only useful for checking them on small models (kernels="python")."""
+
+KERNEL_BACKENDS = ("auto", "numba", "numpy", "python")
+
+
+def jit(function):
+    if numba is None:
+        return function
+    return numba.njit(cache=True, nogil=True)(function)
+
+
+def select_backend(kernels):
+    # The kernel functions to use, or None for the NumPy code. "auto" uses Numba when it is installed,
+    # "python" runs the kernels uncompiled.
+    if kernels not in KERNEL_BACKENDS:
+        raise ValueError(f"Unknown kernels '{kernels}', expected one of {', '.join(KERNEL_BACKENDS)}")
+    if kernels == "numba" and numba is None:
+        raise ImportError("The numba kernels need numba; install it or use kernels='numpy'")
+    if kernels == "numpy" or (kernels == "auto" and numba is None):
+        return None
+    functions = {name: globals()[name] for name in ("random_walk", "count_contacts", "convert_contacts")}
+    if kernels == "python":
+        functions = {name: getattr(function, "py_func", function) for name, function in functions.items()}
+    return SimpleNamespace(**functions)
+
+
+# Kernels
+#######################
+@jit
+def random_walk(x, y, moving, choice, steps, width, height):
+    # In place: agent moving[k] takes the Moore step steps[choice[k]] on the torus
+    for k in range(moving.shape[0]):
+        i = moving[k]
+        x[i] = (x[i] + steps[choice[k], 0]) % width
+        y[i] = (y[i] + steps[choice[k], 1]) % height
+
+
+@jit
+def neighborhood_cells(x, y, reach, width, height, wraps, cells):
+    # Cells of the Moore neighbourhood of (x, y) (centre excluded) written to `cells`, in the order of
+    # ArrayEngine.contact_pairs; when the neighbourhood wraps around the torus, cells are sorted and
+    # deduplicated. Returns the number of cells.
+    n = 0
+    own = x * height + y
+    for dx in range(-reach, reach + 1):
+        for dy in range(-reach, reach + 1):
+            if dx == 0 and dy == 0:
+                continue
+            cell = ((x + dx) % width) * height + (y + dy) % height
+            if wraps and cell == own:
+                continue
+            cells[n] = cell
+            n += 1
+    if wraps:
+        cells[:n] = np.sort(cells[:n])
+        unique = 0
+        for j in range(n):
+            if unique == 0 or cells[j] != cells[unique - 1]:
+                cells[unique] = cells[j]
+                unique += 1
+        n = unique
+    return n
+
+
+@jit
+def cell_range(occupied, starts, cell):
+    # Offsets [start, end) of the prospects of a cell in the order of engine.group_by_cell (empty if unoccupied)
+    i = np.searchsorted(occupied, cell)
+    if i < occupied.shape[0] and occupied[i] == cell:
+        return starts[i], starts[i + 1]
+    return 0, 0
+
+
+@jit
+def count_contacts(members, member_x, member_y, member_reach, occupied, starts, width, height, wraps, max_reach):
+    # Number of (member, non-joined prospect) pairs within reach
+    cells = np.empty((2 * max_reach + 1) ** 2, dtype=np.int64)
+    total = 0
+    for k in range(members.shape[0]):
+        m = members[k]
+        n = neighborhood_cells(member_x[m], member_y[m], member_reach[m], width, height, wraps, cells)
+        for j in range(n):
+            start, end = cell_range(occupied, starts, cells[j])
+            total += end - start
+    return total
+
+
+@jit
+def convert_contacts(members, member_x, member_y, member_reach, occupied, starts, order, receptivity,
+                     convincing_prowess, uniform, width, height, wraps, max_reach, converted, converters):
+    # Bernoulli conversion draw of every pair counted by count_contacts, using uniform[pair]; the converted
+    # prospects and their converting members are written in pair order. Returns the number of conversions.
+    cells = np.empty((2 * max_reach + 1) ** 2, dtype=np.int64)
+    pair = 0
+    n_converted = 0
+    for k in range(members.shape[0]):
+        m = members[k]
+        n = neighborhood_cells(member_x[m], member_y[m], member_reach[m], width, height, wraps, cells)
+        for j in range(n):
+            start, end = cell_range(occupied, starts, cells[j])
+            for s in range(start, end):
+                p = order[s]
+                if uniform[pair] < abs(receptivity[p] * convincing_prowess[m]):
+                    converted[n_converted] = p
+                    converters[n_converted] = m
+                    n_converted += 1
+                pair += 1
+    return n_converted
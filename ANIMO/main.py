@@ -16,52 +16,69 @@
 """
 
 
-import pandas as pd
-from community import EnergyCommunityModel
-
-# Empty DataFrame to store the results
-df_simulation_results = pd.DataFrame()
-
-"""Import input data"""
+from batch import batch_run, GROUP_COLUMNS
+from parameters import load_parameters
+from results import ResultsStore
+from reporting import report
+from ensemble import summarize_store
+from dashboard import ProgressStream
+from stopping import default_policies
+
+# Results are appended to this directory as each replicate finishes; finished replicates are skipped on re-runs
+store = ResultsStore('simulation_results')
+
+"""Import input data (parsed once and cached next to the workbook)"""
 file_path = 'input_data.xlsx'
-data = pd.read_excel(file_path)
+parameters = load_parameters(file_path)
 
 """Specify height and width of the simulation space"""
-height = data.loc[data['Unnamed: 0'] == 'height', 'value'].iloc[0]
-width = data.loc[data['Unnamed: 0'] == 'width', 'value'].iloc[0]
+height = parameters.height
+width = parameters.width
 
 """Specify to configure a batch run"""
 batch_runs_number = 10  # You can increase this for multiple runs
 
 """Specify number of instances from each class"""
-num_members = data.loc[data['Unnamed: 0'] == 'num_members', 'value'].iloc[0]
-num_prospects = data.loc[data['Unnamed: 0'] == 'num_prospects', 'value'].iloc[0]
+num_members = parameters.num_members
+num_prospects = parameters.num_prospects
 
 """Specify scenario configuration"""
-scenario = data.loc[data['Unnamed: 0'] == 'scenario', 'value'].iloc[0]
+scenario = parameters.scenario
+
+"""Specify simulation engine: "mesa" agents, "array" for large populations, or "sharded" to split one run over all cores"""
+engine = "mesa"
+
+"""Specify the number of worker processes running replicates in parallel (None for one per core, 1 to run them
+one after the other in this process, e.g. with the "sharded" engine, which already uses every core)"""
+processes = None
 
-for i in range(batch_runs_number):
-    # Instantiate the model
-    model = EnergyCommunityModel(num_members=num_members, num_prospects=num_prospects, height=height,
-                                 width=width, scenario=scenario)
+"""Specify a seed for reproducible runs (None for a fresh random seed)"""
+seed = None
 
-    # Run the model and get the cumulative members list
-    cumulative_members = model.run_model()
+"""Specify to stream live progress to the dashboard (start it first with: python dashboard.py)"""
+dashboard = False
+stopping = default_policies() + [ProgressStream(heatmap=(32, 32))] if dashboard else None
 
-    # Execute the following to get histogram of members types
-    # model.plot_agent_type_histogram()
+# Worker processes import this module, so only the main process runs the batch
+if __name__ == "__main__":
+    # Run the replicates in parallel; each one is stored (run id, seed, scenario, step, new members, growth
+    # percentage and the number of members per typology) as soon as it finishes, and stored replicates are skipped
+    batch_run(scenarios=[scenario], num_members=[num_members], num_prospects=[num_prospects],
+              grid_sizes=[(width, height)], replicates=batch_runs_number, seed=seed, engine=engine,
+              parameters=parameters, stopping=stopping, processes=processes, store=store)
 
-    # Execute the following to plot the increasing cumulative number of members
-    model.plot_new_additions()
+    # Exporting the long-format results to a CSV file
+    store.to_csv('simulation_results.csv')
 
-    # Create a step column
-    step_numbers = list(range(1, len(cumulative_members) + 1))
+    print("Simulation results saved to 'simulation_results.csv'")
 
-    # Add step numbers and results to the DataFrame
-    df_simulation_results[f'Step Number Iteration #{i + 1}'] = pd.Series(step_numbers)
-    df_simulation_results[f'New Members Iteration #{i + 1}'] = pd.Series(cumulative_members)
+    # Aggregate figures of all replicates (adoption bands, replicate curves, member typologies), written to files;
+    # can also be run separately with: python reporting.py simulation_results --output simulation_report
+    report(store, 'simulation_report')
 
-# Exporting DataFrame to a CSV file
-df_simulation_results.to_csv('simulation_results.csv', index=False)
+    print("Simulation report saved to 'simulation_report'")
 
-print("Simulation results saved to 'simulation_results.csv'")
+    # Replicates needed for a 95% confidence interval of the mean adoption at most 1% of the prospects wide
+    for configuration, needed in summarize_store(store).replicates_needed(0.01 * num_prospects).items():
+        fields = ", ".join(f"{column}={value}" for column, value in zip(GROUP_COLUMNS, configuration))
+        print(f"{fields}: {needed} replicates needed, {batch_runs_number} run")
@@ -16,82 +16,73 @@
 """
 
 from mesa import Agent
-import numpy as np
 import random
-import pandas as pd
-
-"""Import input data"""
-file_path = 'input_data.xlsx'
-data = pd.read_excel(file_path)
 
 '''Configure agents of the Member class'''
 
-'''Values for agent-related parameters'''
-
-# environmental concern
-env_concern_mean = data.loc[data['Unnamed: 0'] == 'env_concern_mean', 'value'].iloc[0]
-env_concern_std = data.loc[data['Unnamed: 0'] == 'env_concern_std', 'value'].iloc[0]
-
-#  energy independence
-nrg_independence_mean = data.loc[data['Unnamed: 0'] == 'nrg_independence_mean', 'value'].iloc[0]
-nrg_independence_std = data.loc[data['Unnamed: 0'] == 'nrg_independence_std', 'value'].iloc[0]
-
-# community sensitivity
-community_sns_mean = data.loc[data['Unnamed: 0'] == 'community_sns_mean', 'value'].iloc[0]
-community_sns_std = data.loc[data['Unnamed: 0'] == 'community_sns_std', 'value'].iloc[0]
-
-# financial concern
-financial_concern_mean = data.loc[data['Unnamed: 0'] == 'financial_concern_mean', 'value'].iloc[0]
-financial_concern_std = data.loc[data['Unnamed: 0'] == 'financial_concern_std', 'value'].iloc[0]
+'''Values for agent-related parameters are read from the model's ModelParameters (see parameters.py)'''
 
 
 # Supporting Function
 #######################
-def custom_random(world_narrative):
+def custom_random(world_narrative, rng=None):
     # Adds functionality based on scenario / "world narrative"
+    # Draws from the given numpy Generator, or from the global random module if none is given
+    if rng is None:
+        randint, uniform = random.randint, random.random
+    else:
+        randint, uniform = (lambda low, high: int(rng.integers(low, high + 1))), rng.random
     if world_narrative == "Familiar":
-        return random.randint(1, 4)
+        return randint(1, 4)
     elif world_narrative == "Fragmented":
-        if random.random() > 0.2:
-            return random.randint(0, 2)
+        if uniform() > 0.2:
+            return randint(0, 2)
         else:
-            return random.randint(3, 5)
+            return randint(3, 5)
     elif world_narrative == "Unified":
-        if random.random() < 0.2:
-            return random.randint(0, 2)
+        if uniform() < 0.2:
+            return randint(0, 2)
         else:
-            return random.randint(3, 5)
+            return randint(3, 5)
 
 
 class Member(Agent):
-    def __init__(self, unique_id, model, agent_type="Community Member", scenario="Familiar"):
+    def __init__(self, unique_id, model, agent_type="Community Member", scenario="Familiar", traits=None, reach=None,
+                 typology=None):
+        # traits, reach and typology may be drawn in bulk beforehand (see population.py); otherwise they are drawn here
         super().__init__(unique_id, model)
         self.model = model
         self.agent_type = agent_type
         self.scenario = scenario
-        self.env_concern = np.random.normal(env_concern_mean, env_concern_std)
-        self.community_sns = np.random.normal(community_sns_mean, community_sns_std)
-        self.fin_concern = np.random.normal(financial_concern_mean, financial_concern_std)
-        self.nrg_independence = np.random.normal(nrg_independence_mean, nrg_independence_std)
+        parameters = model.parameters
+        if traits is None or reach is None:
+            rng = model.streams.for_agent("population", unique_id)
+        if traits is None:
+            traits = (rng.normal(parameters.env_concern_mean, parameters.env_concern_std),
+                      rng.normal(parameters.financial_concern_mean, parameters.financial_concern_std),
+                      rng.normal(parameters.community_sns_mean, parameters.community_sns_std),
+                      rng.normal(parameters.nrg_independence_mean, parameters.nrg_independence_std))
+        self.env_concern, self.fin_concern, self.community_sns, self.nrg_independence = traits
 
         # Normalized agent-related parameters
-        self.environmental_concern = abs(self.env_concern - env_concern_mean)
-        self.financial_concern = abs(self.fin_concern - financial_concern_mean)
-        self.sense_of_community = abs(self.community_sns - community_sns_mean)
-        self.energy_independence = abs(self.nrg_independence - nrg_independence_mean)
+        self.environmental_concern = abs(self.env_concern - parameters.env_concern_mean)
+        self.financial_concern = abs(self.fin_concern - parameters.financial_concern_mean)
+        self.sense_of_community = abs(self.community_sns - parameters.community_sns_mean)
+        self.energy_independence = abs(self.nrg_independence - parameters.nrg_independence_mean)
 
         # Placeholder for typology / persona
-        self.typology = None
+        self.typology = typology
 
         # Descriptive of ability to interact
-        self.reach = custom_random(world_narrative=self.scenario)
+        self.reach = custom_random(world_narrative=self.scenario, rng=rng) if reach is None else reach
 
         self.convincing_prowess = min(
             ((
                      self.environmental_concern - self.financial_concern + self.sense_of_community + self.energy_independence) / 4),
             1)
         self.connections_to_prospects = []
-        self.categorize_typology()
+        if self.typology is None:
+            self.categorize_typology()
 
 
     def categorize_typology(self):
@@ -0,0 +1,83 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import numpy as np
+import pandas as pd
+from population import TYPOLOGIES
+from scenarios import ADOPTER_GROUPS
+
+
+class MetricsRecorder:
+    """
+    Low-overhead per-step metrics of an EnergyCommunityModel, kept in preallocated NumPy arrays.
+
+    Every sample holds the step, new_members_count, the number of joined prospects, the growth
+    percentage, the joined prospects per adopter group and the contact conversions per typology of
+    the converting member. Samples are taken every `every` steps, or with on_change=True only on
+    steps where adoption changed. The arrays double in size when full.
+    """
+
+    def __init__(self, every=1, on_change=False, capacity=256):
+        self.every = every
+        self.on_change = on_change
+        self.size = 0
+        self.steps = np.zeros(capacity, dtype=np.int64)
+        self.new_members = np.zeros(capacity, dtype=np.int64)
+        self.num_joined = np.zeros(capacity, dtype=np.int64)
+        self.growth_percentage = np.zeros(capacity, dtype=np.float64)
+        self.joined_by_group = np.zeros((capacity, len(ADOPTER_GROUPS)), dtype=np.int64)
+        self.conversions_by_typology = np.zeros((capacity, len(TYPOLOGIES)), dtype=np.int64)
+
+    def grow(self):
+        for name in ("steps", "new_members", "num_joined", "growth_percentage", "joined_by_group",
+                     "conversions_by_typology"):
+            values = getattr(self, name)
+            grown = np.zeros((2 * max(len(values), 1),) + values.shape[1:], dtype=values.dtype)
+            grown[:self.size] = values[:self.size]
+            setattr(self, name, grown)
+
+    def record(self, model):
+        step = model.schedule.steps
+        if step % self.every != 0:
+            return
+        if self.on_change and self.size and self.num_joined[self.size - 1] == model.num_joined:
+            return
+        if self.size == len(self.steps):
+            self.grow()
+        i = self.size
+        self.steps[i] = step
+        self.new_members[i] = model.new_members_count
+        self.num_joined[i] = model.num_joined
+        self.growth_percentage[i] = model.new_members_count / model.num_members * 100 if model.num_members else 0
+        self.joined_by_group[i] = model.joined_by_group
+        self.conversions_by_typology[i] = model.conversions_by_typology
+        self.size += 1
+
+    def to_dataframe(self):
+        n = self.size
+        frame = pd.DataFrame({
+            "Step": self.steps[:n],
+            "New Members": self.new_members[:n],
+            "Joined": self.num_joined[:n],
+            "Growth Percentage": self.growth_percentage[:n],
+        })
+        for j, group in enumerate(ADOPTER_GROUPS):
+            frame[f"Joined {group}"] = self.joined_by_group[:n, j]
+        for j, typology in enumerate(TYPOLOGIES):
+            frame[f"Converted by {typology}"] = self.conversions_by_typology[:n, j]
+        return frame
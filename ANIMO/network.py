@@ -0,0 +1,196 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import hashlib
+import numpy as np
+
+
+TOPOLOGIES = ("uniform", "spatial", "small_world", "scale_free")
+
+# Rounds of redrawing rejected friends (self or duplicates) before falling back to uniform draws
+MAX_REDRAWS = 32
+
+
+# Supporting Functions
+#######################
+def index_dtype(n):
+    return np.int32 if n < 2 ** 31 else np.int64
+
+
+def fill_friend_slots(degree, draw, rng):
+    # Fill a (prospects x max degree) table one friend slot at a time. draw(rows, slot) proposes a friend for each
+    # row; self-friendship and duplicates are rejected and redrawn, with uniform draws as a last resort.
+    n = len(degree)
+    friends = np.full((n, int(degree.max()) if n else 0), -1, dtype=np.int64)
+    for slot in range(friends.shape[1]):
+        rows = np.flatnonzero(degree > slot)
+        attempt = 0
+        while rows.size:
+            proposal = draw(rows, slot) if attempt < MAX_REDRAWS else rng.integers(n, size=rows.size)
+            friends[rows, slot] = proposal
+            rejected = (proposal == rows) | (friends[rows, :slot] == proposal[:, None]).any(axis=1)
+            rows = rows[rejected]
+            attempt += 1
+    return friends[np.arange(friends.shape[1]) < degree[:, None]]
+
+
+class FriendshipNetwork:
+    """
+    Directed friendship network of the prospects as a compact CSR adjacency.
+
+    The friends of prospect i are indices[indptr[i]:indptr[i + 1]]. The reverse index (the prospects that count
+    prospect j as a friend) is built on first use. A network can be saved to / loaded from an NPZ file and passed
+    to several models, so that replicates share one network instead of rebuilding it.
+    """
+
+    def __init__(self, indptr, indices, topology="uniform"):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=index_dtype(len(self.indptr)))
+        self.topology = topology
+        self._reverse = None
+
+    @classmethod
+    def from_friend_lists(cls, friends, degree, topology="uniform"):
+        # friends: flat array of friend indices, grouped by prospect, degree: number of friends per prospect
+        indptr = np.concatenate(([0], np.cumsum(degree)))
+        return cls(indptr, friends, topology)
+
+    @property
+    def num_prospects(self):
+        return len(self.indptr) - 1
+
+    @property
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def friends_of(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def reverse(self):
+        # (indptr, indices) of the reverse adjacency: followers of prospect j are indices[indptr[j]:indptr[j + 1]]
+        if self._reverse is None:
+            n = self.num_prospects
+            owners = np.repeat(np.arange(n, dtype=self.indices.dtype), self.degree)
+            followers = owners[np.argsort(self.indices, kind="stable")]
+            indptr = np.concatenate(([0], np.cumsum(np.bincount(self.indices, minlength=n))))
+            self._reverse = (indptr, followers)
+        return self._reverse
+
+    def to_dict(self):
+        # JSON-ready identity of the network, e.g. for run keys (see results.py): its topology and a digest of
+        # the adjacency, so that the same network always gives the same key
+        digest = hashlib.sha1()
+        for array in (self.indptr, self.indices):
+            digest.update(np.ascontiguousarray(array, dtype=np.int64).tobytes())
+        return {"topology": self.topology, "num_prospects": self.num_prospects, "digest": digest.hexdigest()}
+
+    def save(self, file_path):
+        np.savez_compressed(file_path, indptr=self.indptr, indices=self.indices, topology=self.topology)
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(file_path) as data:
+            return cls(data["indptr"], data["indices"], str(data["topology"]))
+
+
+# Generators
+#######################
+def uniform_network(number_of_friends, rng):
+    # Every prospect befriends number_of_friends other prospects chosen uniformly at random (no self-friendship)
+    n = len(number_of_friends)
+    degree = np.minimum(number_of_friends, max(n - 1, 0))
+    friends = fill_friend_slots(degree, lambda rows, slot: rng.integers(n, size=rows.size), rng)
+    return FriendshipNetwork.from_friend_lists(friends, degree, "uniform")
+
+
+def spatial_network(number_of_friends, rng, x, y, width, height, radius=5):
+    # Friends are drawn among the prospects of the cells within `radius` (Moore distance on the torus);
+    # prospects without enough neighbours nearby get uniform friends
+    n = len(number_of_friends)
+    degree = np.minimum(number_of_friends, max(n - 1, 0))
+    cells = x * height + y
+    order = np.argsort(cells, kind="stable")
+    counts = np.bincount(cells, minlength=width * height)
+    starts = np.concatenate(([0], np.cumsum(counts)))[:-1]
+
+    def draw(rows, slot):
+        # A random cell within the radius, then a random prospect of that cell (empty cells are rejected as self)
+        cell_x = (x[rows] + rng.integers(-radius, radius + 1, size=rows.size)) % width
+        cell_y = (y[rows] + rng.integers(-radius, radius + 1, size=rows.size)) % height
+        cell = cell_x * height + cell_y
+        occupied = counts[cell] > 0
+        proposal = rows.copy()
+        offset = (rng.random(rows.size) * counts[cell]).astype(np.int64)
+        proposal[occupied] = order[starts[cell[occupied]] + offset[occupied]]
+        return proposal
+
+    friends = fill_friend_slots(degree, draw, rng)
+    return FriendshipNetwork.from_friend_lists(friends, degree, "spatial")
+
+
+def small_world_network(number_of_friends, rng, rewiring=0.1):
+    # Watts-Strogatz style: prospects sit on a ring in random order and befriend their nearest ring neighbours
+    # (alternately to the right and to the left); each friendship is rewired to a uniform prospect with probability
+    # `rewiring`
+    n = len(number_of_friends)
+    degree = np.minimum(number_of_friends, max(n - 1, 0))
+    ring = rng.permutation(n)
+    position = np.empty(n, dtype=np.int64)
+    position[ring] = np.arange(n)
+
+    def draw(rows, slot):
+        distance = slot // 2 + 1
+        side = 1 if slot % 2 == 0 else -1
+        proposal = ring[(position[rows] + side * distance) % n] if n else rows
+        rewire = rng.random(rows.size) < rewiring
+        proposal[rewire] = rng.integers(n, size=int(rewire.sum()))
+        return proposal
+
+    friends = fill_friend_slots(degree, draw, rng)
+    return FriendshipNetwork.from_friend_lists(friends, degree, "small_world")
+
+
+def scale_free_network(number_of_friends, rng, exponent=2.5):
+    # Static scale-free model: every prospect gets a Pareto-distributed popularity and friends are chosen with
+    # probability proportional to it, which gives a power-law distribution of how often a prospect is befriended
+    n = len(number_of_friends)
+    degree = np.minimum(number_of_friends, max(n - 1, 0))
+    popularity = (1.0 - rng.random(n)) ** (-1.0 / (exponent - 1.0))
+    cumulative = np.cumsum(popularity)
+
+    def draw(rows, slot):
+        targets = rng.random(rows.size) * cumulative[-1]
+        return np.minimum(np.searchsorted(cumulative, targets, side="right"), n - 1)
+
+    friends = fill_friend_slots(degree, draw, rng)
+    return FriendshipNetwork.from_friend_lists(friends, degree, "scale_free")
+
+
+def build_network(topology, population, rng, width=None, height=None, **options):
+    # Friendship network of the prospects of a population.Population
+    number_of_friends = np.asarray(population.number_of_friends)
+    if topology == "uniform":
+        return uniform_network(number_of_friends, rng)
+    elif topology == "spatial":
+        return spatial_network(number_of_friends, rng, population.prospect_x, population.prospect_y, width, height,
+                               **options)
+    elif topology == "small_world":
+        return small_world_network(number_of_friends, rng, **options)
+    elif topology == "scale_free":
+        return scale_free_network(number_of_friends, rng, **options)
+    raise ValueError(f"Unknown network topology '{topology}', expected one of {', '.join(TOPOLOGIES)}")
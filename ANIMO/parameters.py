@@ -0,0 +1,135 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+from dataclasses import dataclass, asdict, fields, replace
+import hashlib
+import json
+import os
+from scenarios import SCENARIOS
+
+CACHE_SUFFIX = ".cache.json"
+
+# Parameters already loaded in this process, keyed by workbook path and content hash
+_loaded = {}
+
+
+@dataclass(frozen=True)
+class ModelParameters:
+    """Input parameters of ANIMO, as read from input_data.xlsx"""
+
+    # Simulation space and population
+    num_members: int
+    num_prospects: int
+    height: int
+    width: int
+    scenario: str
+    batch_runs_number: int
+
+    # Agent-related parameters of the Member class
+    env_concern_mean: float
+    env_concern_std: float
+    nrg_independence_mean: float
+    nrg_independence_std: float
+    community_sns_mean: float
+    community_sns_std: float
+    financial_concern_mean: float
+    financial_concern_std: float
+
+    def __post_init__(self):
+        # Coerce the spreadsheet values to the declared types, then validate them
+        for field in fields(self):
+            try:
+                value = field.type(getattr(self, field.name))
+            except (TypeError, ValueError):
+                raise ValueError(f"Parameter '{field.name}' must be of type {field.type.__name__}, "
+                                 f"got {getattr(self, field.name)!r}") from None
+            object.__setattr__(self, field.name, value)
+        self.validate()
+
+    def validate(self):
+        for name in ("num_members", "num_prospects", "height", "width", "batch_runs_number"):
+            if getattr(self, name) < 0:
+                raise ValueError(f"Parameter '{name}' must not be negative")
+        if self.height == 0 or self.width == 0:
+            raise ValueError("The simulation space must have a positive height and width")
+        for name in ("env_concern_std", "nrg_independence_std", "community_sns_std", "financial_concern_std"):
+            if getattr(self, name) < 0:
+                raise ValueError(f"Parameter '{name}' must not be negative")
+        if self.scenario not in SCENARIOS:
+            raise ValueError(f"Unknown scenario '{self.scenario}', expected one of {', '.join(SCENARIOS)}")
+
+    def replace(self, **overrides):
+        # A copy with some parameters overridden, without editing the spreadsheet
+        return replace(self, **overrides)
+
+    def to_dict(self):
+        return asdict(self)
+
+
+# Supporting Functions
+#######################
+def file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_workbook(file_path):
+    # Parse the workbook in a single pass into a {parameter name: value} dictionary
+    import pandas as pd
+    data = pd.read_excel(file_path)
+    values = dict(zip(data['Unnamed: 0'], data['value']))
+    names = [field.name for field in fields(ModelParameters)]
+    missing = [name for name in names if name not in values]
+    if missing:
+        raise ValueError(f"{file_path} is missing parameters: {', '.join(missing)}")
+    # Convert numpy scalars to plain Python values so they can be cached as JSON
+    return {name: values[name].item() if hasattr(values[name], 'item') else values[name] for name in names}
+
+
+def load_parameters(file_path='input_data.xlsx', use_cache=True):
+    # Parameters of a workbook, parsed once and cached in memory and in a JSON file next to the workbook
+    digest = file_hash(file_path)
+    key = (os.path.abspath(file_path), digest)
+    if key in _loaded:
+        return _loaded[key]
+
+    cache_path = file_path + CACHE_SUFFIX
+    values = None
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with open(cache_path) as file:
+                cached = json.load(file)
+            if cached.get('hash') == digest:
+                values = cached['parameters']
+        except (OSError, ValueError, KeyError):
+            values = None
+    if values is None:
+        values = read_workbook(file_path)
+        if use_cache:
+            try:
+                with open(cache_path, 'w') as file:
+                    json.dump({'hash': digest, 'parameters': values}, file, indent=2)
+            except OSError:
+                pass
+
+    parameters = ModelParameters(**values)
+    _loaded[key] = parameters
+    return parameters
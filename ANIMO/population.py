@@ -0,0 +1,155 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import copy
+import numpy as np
+from scenarios import ADOPTER_GROUPS, RECEPTIVITY_MEANS, NORMAL_SCALE, get_scenario, draw_contact_range
+
+
+TYPOLOGY_LETTERS = "EFSI"
+
+# Per-agent arrays of a Population
+POPULATION_ARRAYS = ("member_x", "member_y", "prospect_x", "prospect_y", "member_raw_traits", "member_traits",
+                     "member_reach", "convincing_prowess", "member_typology", "vision", "number_of_friends",
+                     "adopter_group", "receptivity")
+
+
+# Supporting Functions
+#######################
+def typology_names():
+    # Names of all typologies, indexed by (first letter * 4 + second letter)
+    names = []
+    for first in TYPOLOGY_LETTERS:
+        for second in TYPOLOGY_LETTERS:
+            typology = first + second
+            # Ensure only one combination of letters is considered (as in Member.categorize_typology)
+            if typology in ['SE', 'IF', 'IS', 'SF', 'IE']:
+                typology = typology[::-1]
+            names.append('Type ' + typology)
+    return names
+
+
+# Distinct typologies a member can have (two different letters), and the index of every letter code in it
+TYPOLOGIES = tuple(dict.fromkeys(name for code, name in enumerate(typology_names()) if code // 4 != code % 4))
+TYPOLOGY_INDEX = {typology: i for i, typology in enumerate(TYPOLOGIES)}
+TYPOLOGY_CODE_INDEX = np.array([TYPOLOGY_INDEX.get(name, -1) for name in typology_names()])
+
+
+def categorize_typologies(traits):
+    # Vectorized Member.categorize_typology: index in TYPOLOGIES of the two largest traits of every row
+    ranking = np.argsort(-traits, axis=1, kind="stable")
+    return TYPOLOGY_CODE_INDEX[ranking[:, 0] * 4 + ranking[:, 1]]
+
+
+def adopter_group_sizes(world_narrative, num_prospects, overrides=None):
+    fractions = get_scenario(world_narrative, overrides)["adopter_group_fractions"]
+    sizes = [int(fraction * num_prospects) for fraction in fractions[:-1]]
+    sizes.append(num_prospects - sum(sizes))
+    return sizes
+
+
+def trait_moments(parameters):
+    # Means and standard deviations of the member traits, ordered as TYPOLOGY_LETTERS
+    means = np.array([parameters.env_concern_mean, parameters.financial_concern_mean,
+                      parameters.community_sns_mean, parameters.nrg_independence_mean])
+    stds = np.array([parameters.env_concern_std, parameters.financial_concern_std,
+                     parameters.community_sns_std, parameters.nrg_independence_std])
+    return means, stds
+
+
+class Population:
+    """
+    Attributes of all members and prospects of a model, drawn in bulk.
+
+    Every distribution is sampled once as an array (one pass per distribution, in agent order), and
+    the scenario table in scenarios.py replaces the per-scenario branches. The arrays are either
+    attached to mesa agents or used directly by the array engine.
+    """
+
+    def __init__(self, parameters, scenario, num_members, num_prospects, width, height, streams,
+                 scenario_overrides=None):
+        self.scenario = scenario
+        self.scenario_overrides = scenario_overrides
+        self.num_members = int(num_members)
+        self.num_prospects = int(num_prospects)
+        get_scenario(scenario, scenario_overrides)
+        self.draw_positions(width, height, streams.placement)
+        self.draw_members(parameters, streams.population)
+        self.draw_prospects(streams.population)
+        self.assign_adopter_groups(streams.receptivity)
+
+    def draw_positions(self, width, height, rng):
+        self.member_x = rng.integers(width, size=self.num_members)
+        self.member_y = rng.integers(height, size=self.num_members)
+        self.prospect_x = rng.integers(width, size=self.num_prospects)
+        self.prospect_y = rng.integers(height, size=self.num_prospects)
+
+    def draw_members(self, parameters, rng):
+        n = self.num_members
+        means, stds = trait_moments(parameters)
+        # Raw trait values, columns ordered as TYPOLOGY_LETTERS (environmental, financial, community, independence)
+        self.member_raw_traits = rng.normal(means, stds, size=(n, 4))
+        self.member_reach = draw_contact_range(self.scenario, n, rng, self.scenario_overrides, "member_reach_range")
+        self.normalize_members(means)
+
+    def normalize_members(self, means):
+        # Normalized agent-related parameters
+        self.member_traits = np.abs(self.member_raw_traits - means)
+        environmental, financial, community, independence = self.member_traits.T
+        self.convincing_prowess = np.minimum((environmental - financial + community + independence) / 4, 1)
+        self.member_typology = categorize_typologies(self.member_traits)
+
+    def draw_prospects(self, rng):
+        n = self.num_prospects
+        self.vision = draw_contact_range(self.scenario, n, rng, self.scenario_overrides)
+        self.number_of_friends = draw_contact_range(self.scenario, n, rng, self.scenario_overrides)
+
+    def assign_adopter_groups(self, rng):
+        # Prospects are split into consecutive adopter-group slices
+        sizes = adopter_group_sizes(self.scenario, self.num_prospects, self.scenario_overrides)
+        self.adopter_group = np.repeat(np.arange(len(ADOPTER_GROUPS), dtype=np.int8), sizes)
+        # Standard normal draws in prospect order, shifted by the group means
+        self.receptivity = np.asarray(RECEPTIVITY_MEANS)[self.adopter_group] + \
+            NORMAL_SCALE * rng.standard_normal(self.num_prospects)
+
+    def to_arrays(self):
+        return {name: getattr(self, name) for name in POPULATION_ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, scenario, arrays, scenario_overrides=None):
+        # Rebuild a Population from previously drawn arrays (see to_arrays), without drawing anything
+        population = cls.__new__(cls)
+        population.scenario = scenario
+        population.scenario_overrides = scenario_overrides
+        for name in POPULATION_ARRAYS:
+            setattr(population, name, np.asarray(arrays[name]))
+        population.num_members = len(population.member_x)
+        population.num_prospects = len(population.prospect_x)
+        return population
+
+    def with_parameters(self, old_parameters, parameters):
+        # Copy of the population under other trait parameters: every member keeps its standardized trait
+        # draws, so the member arrays are recomputed and all other arrays are shared with this population
+        old_means, old_stds = trait_moments(old_parameters)
+        means, stds = trait_moments(parameters)
+        population = copy.copy(self)
+        z = np.divide(self.member_raw_traits - old_means, old_stds, out=np.zeros_like(self.member_raw_traits),
+                      where=old_stds != 0)
+        population.member_raw_traits = means + stds * z
+        population.normalize_members(means)
+        return population
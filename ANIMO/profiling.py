@@ -0,0 +1,114 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import cProfile
+import json
+import time
+import pandas as pd
+
+
+# Model counters sampled around every phase
+COUNTERS = ("num_neighbor_queries", "num_attempts", "num_agents_scanned")
+
+
+class StepProfiler:
+    """
+    Opt-in instrumentation of EnergyCommunityModel.step.
+
+    For the construction of the model (step 0: population, network, agents and prospects_find_peers) and
+    for every step and phase it records the wall time and the number of neighbour queries, influence
+    attempts and agents scanned during the phase. With cprofile=True the steps also run under cProfile.
+    Attach it with EnergyCommunityModel(..., profiler=StepProfiler()).
+    """
+
+    def __init__(self, cprofile=False):
+        self.records = []
+        self.events = []  # (phase, start, end) in seconds since the profiler was created, for speedscope
+        self.origin = time.perf_counter()
+        self.cprofile = cProfile.Profile() if cprofile else None
+
+    def run_phase(self, model, step, name, phase):
+        # Time one phase and return its result; model construction phases are recorded as step 0
+        before = [getattr(model, counter) for counter in COUNTERS]
+        start = time.perf_counter()
+        result = phase()
+        end = time.perf_counter()
+        after = [getattr(model, counter) for counter in COUNTERS]
+        self.records.append((step, name, end - start) + tuple(b - a for a, b in zip(before, after)))
+        self.events.append((name, start - self.origin, end - self.origin))
+        return result
+
+    def run_step(self, model, phases):
+        step = model.schedule.steps + 1
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        try:
+            for name, phase in phases:
+                self.run_phase(model, step, name, phase)
+        finally:
+            if self.cprofile is not None:
+                self.cprofile.disable()
+
+    def to_dataframe(self):
+        # One row per step and phase
+        return pd.DataFrame(self.records, columns=["step", "phase", "wall_time", "neighbor_queries",
+                                                   "influence_attempts", "agents_scanned"])
+
+    def summary(self):
+        # Totals per phase, with the share of the total wall time
+        data = self.to_dataframe()
+        summary = data.groupby("phase", sort=False).agg(
+            calls=("step", "size"),
+            wall_time=("wall_time", "sum"),
+            mean_wall_time=("wall_time", "mean"),
+            neighbor_queries=("neighbor_queries", "sum"),
+            influence_attempts=("influence_attempts", "sum"),
+            agents_scanned=("agents_scanned", "sum"),
+        )
+        total = summary["wall_time"].sum()
+        summary["share"] = summary["wall_time"] / total if total else 0.0
+        return summary
+
+    def dump_cprofile(self, file_path):
+        # Binary pstats dump, readable with pstats, snakeviz or speedscope
+        if self.cprofile is None:
+            raise ValueError("cProfile was not enabled; create the profiler with cprofile=True")
+        self.cprofile.dump_stats(file_path)
+
+    def dump_speedscope(self, file_path):
+        # Phase timeline in the speedscope "evented" file format (https://www.speedscope.app)
+        names = list(dict.fromkeys(name for name, _, _ in self.events))
+        frame_index = {name: i for i, name in enumerate(names)}
+        events = []
+        for name, start, end in self.events:
+            events.append({"type": "O", "frame": frame_index[name], "at": start})
+            events.append({"type": "C", "frame": frame_index[name], "at": end})
+        document = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": [{"name": name} for name in names]},
+            "profiles": [{
+                "type": "evented",
+                "name": "EnergyCommunityModel.step",
+                "unit": "seconds",
+                "startValue": events[0]["at"] if events else 0,
+                "endValue": events[-1]["at"] if events else 0,
+                "events": events,
+            }],
+        }
+        with open(file_path, "w") as file:
+            json.dump(document, file)
@@ -16,40 +16,52 @@
 """
 
 
-from mesa import Agent, Model
-import numpy as np
+from mesa import Agent
 import random
 
 
 # Supporting Function
 #######################
-def custom_random(world_narrative):
+def custom_random(world_narrative, rng=None):
     # Adds functionality based on scenario / "world narrative"
+    # Draws from the given numpy Generator, or from the global random module if none is given
+    if rng is None:
+        randint, uniform = random.randint, random.random
+    else:
+        randint, uniform = (lambda low, high: int(rng.integers(low, high + 1))), rng.random
     if world_narrative == "Familiar":
-        return random.randint(1, 4)
+        return randint(1, 4)
     elif world_narrative == "Fragmented":
-        if random.random() > 0.2:
-            return random.randint(0, 2)
+        if uniform() > 0.2:
+            return randint(0, 2)
         else:
-            return random.randint(3, 5)
+            return randint(3, 5)
     elif world_narrative == "Unified":
-        if random.random() < 0.2:
-            return random.randint(0, 2)
+        if uniform() < 0.2:
+            return randint(0, 2)
         else:
-            return random.randint(3, 5)
+            return randint(3, 5)
 
 
 class Prospect(Agent):
-    def __init__(self, unique_id, model, agent_type="Prospective Member", scenario="Familiar"):
+    def __init__(self, unique_id, model, agent_type="Prospective Member", scenario="Familiar", vision=None,
+                 number_of_friends=None):
+        # vision and number_of_friends may be drawn in bulk beforehand (see population.py); otherwise they are drawn here
         super().__init__(unique_id, model)
         self.agent_type = agent_type
         self.scenario = scenario
-        self.vision = custom_random(world_narrative=self.scenario)
+        if vision is None or number_of_friends is None:
+            rng = model.streams.for_agent("population", unique_id)
+        self.vision = custom_random(world_narrative=self.scenario, rng=rng) if vision is None else vision
         self.status = "Not Joined"
         self.receptivity_towards_innovation = None
         self.friends = []
+        self.friend_of = []  # Prospects that count this prospect as a friend
+        self.num_friends_joined = 0  # Friends with status "New Member"
         self.adopter_group = None
-        self.number_of_friends = custom_random(world_narrative=self.scenario)
+        if number_of_friends is None:
+            number_of_friends = custom_random(world_narrative=self.scenario, rng=rng)
+        self.number_of_friends = number_of_friends
         self.attempts_to_be_convinced = 0
 
     def move(self):
@@ -58,7 +70,9 @@ class Prospect(Agent):
             moore=True,
             include_center=False)
         new_position = self.random.choice(possible_steps)
+        old_position = self.pos
         self.model.grid.move_agent(self, new_position)
+        self.model.prospect_index.move(self, old_position, new_position)
 
     def step(self):
         self.move()
@@ -0,0 +1,78 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import random
+import numpy as np
+
+
+# Every subsystem of the model draws from its own, independent stream
+SUBSYSTEMS = ("placement", "population", "receptivity", "network", "movement", "contact", "peer")
+
+# Streams that are re-derived on every step in common-random-numbers mode
+STEP_SUBSYSTEMS = ("movement", "contact", "peer")
+
+
+class RandomStreams:
+    """
+    Independent random streams for the subsystems of an EnergyCommunityModel, spawned from one seed.
+
+    The seed may be None, an int, a numpy SeedSequence or a numpy Generator. With
+    common_random_numbers=True the per-step streams are re-derived from (seed, subsystem, step) and the
+    agent-level streams from (seed, subsystem, agent id). Two models built from the same seed then use
+    the same random numbers for the same agent and step, even when a different scenario makes one of
+    them draw more or fewer numbers elsewhere, which keeps scenario comparisons paired.
+    """
+
+    def __init__(self, seed=None, common_random_numbers=False):
+        if isinstance(seed, np.random.Generator):
+            # Draw the entropy of the streams from the given generator
+            seed = np.random.SeedSequence(seed.integers(2 ** 63, size=4))
+        elif not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_sequence = seed
+        self.common_random_numbers = common_random_numbers
+        self.step = 0
+        for name in SUBSYSTEMS:
+            setattr(self, name, np.random.default_rng(self.derive(name)))
+
+    def derive(self, name, *key):
+        # Seed sequence of a subsystem, optionally specialised by a step or agent key
+        seed_sequence = self.seed_sequence
+        return np.random.SeedSequence(seed_sequence.entropy,
+                                      spawn_key=seed_sequence.spawn_key + (SUBSYSTEMS.index(name),) + key)
+
+    def python_random(self, name, *key):
+        # A random.Random instance (as used by mesa) seeded from a subsystem stream
+        return random.Random(int(self.derive(name, *key).generate_state(2, dtype=np.uint64)[0]))
+
+    def for_agent(self, name, unique_id):
+        # Generator for agent-level draws of a subsystem
+        if self.common_random_numbers:
+            return np.random.default_rng(self.derive(name, 1, unique_id))
+        return getattr(self, name)
+
+    def tile_seed(self, name, step, tile):
+        # Seed sequence of a subsystem for one tile of the sharded engine at one step
+        return self.derive(name, 2, step, tile)
+
+    def start_step(self, step):
+        # Re-derive the per-step streams so that every step starts from the same numbers across models
+        self.step = step
+        if self.common_random_numbers:
+            for name in STEP_SUBSYSTEMS:
+                setattr(self, name, np.random.default_rng(self.derive(name, 0, step)))
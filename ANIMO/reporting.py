@@ -0,0 +1,187 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+from matplotlib.collections import LineCollection
+import matplotlib.cm as cm
+from population import TYPOLOGIES
+from results import ResultsStore
+from ensemble import GROUP_COLUMNS, QUANTILES
+
+"""Aggregate reporting of stored batch results, run after the simulations (or in another process):
+
+    python reporting.py simulation_results --output simulation_report
+
+Figures are drawn on matplotlib Figure objects and written to files, so no interactive backend or window
+is involved and many replicates go into one figure. Replicates that stopped early (saturation) keep their
+last value up to the longest replicate of their group."""
+
+VALUE_LABELS = {"new_members": "Number of New Members", "num_joined": "Number of Joined Prospects",
+                "growth_percentage": "Growth Percentage"}
+
+
+# Supporting Functions
+#######################
+def group_labels(groups):
+    # Short label per group: only the readable columns that differ between groups (the scenario if nothing
+    # differs), and the configuration hash for groups that differ in their parameters or overrides only
+    groups = pd.DataFrame(list(groups), columns=GROUP_COLUMNS)
+    readable = [column for column in GROUP_COLUMNS if column != "configuration"]
+    varying = [column for column in readable if groups[column].nunique() > 1] or ["scenario"]
+    if len(groups[varying].drop_duplicates()) < len(groups):
+        varying.append("configuration")
+    return [", ".join(f"{value}" if column == "scenario" else f"{column}={value}" for column, value in
+                      zip(varying, row)) for row in groups[varying].itertuples(index=False)]
+
+
+def replicate_matrix(frame, value="new_members"):
+    # (steps x runs) matrix of one group, carrying every run's last value forward to the longest run
+    matrix = frame.pivot_table(index="step", columns="run_id", values=value, aggfunc="last")
+    return matrix.reindex(np.arange(1, int(frame["step"].max()) + 1)).ffill()
+
+
+def adoption_bands(frame, value="new_members", quantiles=QUANTILES):
+    # Mean and quantiles across replicates per configuration and step, in long format
+    bands = []
+    for group, group_frame in frame.groupby(GROUP_COLUMNS, sort=False):
+        matrix = replicate_matrix(group_frame, value).to_numpy()
+        band = pd.DataFrame({"step": np.arange(1, len(matrix) + 1), "replicates": matrix.shape[1],
+                             "mean": matrix.mean(axis=1)})
+        for q, values in zip(quantiles, np.quantile(matrix, quantiles, axis=1)):
+            band[f"q{q:g}"] = values
+        for column, group_value in zip(GROUP_COLUMNS, group):
+            band[column] = group_value
+        bands.append(band)
+    if not bands:
+        return pd.DataFrame(columns=GROUP_COLUMNS + ["step", "replicates", "mean"])
+    return pd.concat(bands, ignore_index=True)[GROUP_COLUMNS + ["step", "replicates", "mean"] +
+                                               [f"q{q:g}" for q in quantiles]]
+
+
+def typology_counts(frame):
+    # Member typology counts of every run, as recorded with its results (one row per run)
+    return frame.drop_duplicates("run_id")[GROUP_COLUMNS + ["run_id"] + list(TYPOLOGIES)].reset_index(drop=True)
+
+
+# Figures
+#######################
+def save_figure(figure, file_path):
+    figure.tight_layout()
+    figure.savefig(file_path, dpi=150)
+    return file_path
+
+
+def plot_adoption_bands(bands, file_path, value="new_members"):
+    # Mean adoption curve of every configuration with its 25-75% and 5-95% bands, overlaid in one figure
+    figure = Figure(figsize=(8, 5))
+    axes = figure.add_subplot()
+    groups = list(bands.groupby(GROUP_COLUMNS, sort=False))
+    colors = cm.viridis(np.linspace(0, 0.9, max(len(groups), 1)))
+    for (group, band), label, color in zip(groups, group_labels(group for group, _ in groups), colors):
+        if "q0.05" in band and "q0.95" in band:
+            axes.fill_between(band["step"], band["q0.05"], band["q0.95"], color=color, alpha=0.15, linewidth=0)
+        if "q0.25" in band and "q0.75" in band:
+            axes.fill_between(band["step"], band["q0.25"], band["q0.75"], color=color, alpha=0.3, linewidth=0)
+        axes.plot(band["step"], band["mean"], color=color, label=f"{label} (n={band['replicates'].iloc[0]})")
+    axes.set_xlabel('Steps')
+    axes.set_ylabel(VALUE_LABELS.get(value, value))
+    axes.set_title('New Members Joined Over Time (mean, 25-75% and 5-95% of replicates)')
+    if groups:
+        axes.legend()
+    return save_figure(figure, file_path)
+
+
+def plot_replicates(frame, file_path, value="new_members"):
+    # Every replicate as a thin line, coloured by configuration (one LineCollection per configuration)
+    figure = Figure(figsize=(8, 5))
+    axes = figure.add_subplot()
+    groups = list(frame.groupby(GROUP_COLUMNS, sort=False))
+    colors = cm.viridis(np.linspace(0, 0.9, max(len(groups), 1)))
+    for (group, group_frame), label, color in zip(groups, group_labels(group for group, _ in groups), colors):
+        matrix = replicate_matrix(group_frame, value)
+        steps = matrix.index.to_numpy()
+        lines = [np.column_stack((steps, matrix[run].to_numpy())) for run in matrix.columns]
+        axes.add_collection(LineCollection(lines, colors=[color], linewidths=0.6, alpha=0.4, label=label))
+    axes.autoscale()
+    axes.set_xlabel('Steps')
+    axes.set_ylabel(VALUE_LABELS.get(value, value))
+    axes.set_title('New Members Joined Over Time (all replicates)')
+    if groups:
+        axes.legend()
+    return save_figure(figure, file_path)
+
+
+def plot_typology_histograms(counts, file_path):
+    # Mean number of members per typology for every configuration, as grouped bars
+    figure = Figure(figsize=(9, 5))
+    axes = figure.add_subplot()
+    means = counts.groupby(GROUP_COLUMNS, sort=False)[list(TYPOLOGIES)].mean()
+    width = 0.8 / max(len(means), 1)
+    colors = cm.viridis(np.linspace(0, 0.9, max(len(means), 1)))
+    positions = np.arange(len(TYPOLOGIES))
+    for i, (label, color) in enumerate(zip(group_labels(means.index), colors)):
+        axes.bar(positions + i * width - 0.4 + width / 2, means.iloc[i].to_numpy(), width, color=color, label=label)
+    axes.set_xticks(positions)
+    axes.set_xticklabels(TYPOLOGIES)
+    axes.set_xlabel('Agent Type')
+    axes.set_ylabel('Mean Frequency per Run')
+    axes.set_title('Histogram of Member Agent Types')
+    if len(means):
+        axes.legend()
+    return save_figure(figure, file_path)
+
+
+def report(store, directory="simulation_report", value="new_members", typologies=True):
+    """
+    Write the aggregate figures and tables of a results.ResultsStore (or a long-format results DataFrame)
+    to `directory`; returns the written paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    columns = GROUP_COLUMNS + ["run_id", "seed", "step", value] + (list(TYPOLOGIES) if typologies else [])
+    frame = store.read(columns) if isinstance(store, ResultsStore) else store[columns]
+    bands = adoption_bands(frame, value)
+    paths = [os.path.join(directory, "adoption_bands.csv")]
+    bands.to_csv(paths[0], index=False)
+    paths.append(plot_adoption_bands(bands, os.path.join(directory, "adoption_bands.png"), value))
+    paths.append(plot_replicates(frame, os.path.join(directory, "replicates.png"), value))
+    if typologies:
+        counts = typology_counts(frame)
+        paths.append(os.path.join(directory, "typologies.csv"))
+        counts.to_csv(paths[-1], index=False)
+        paths.append(plot_typology_histograms(counts, os.path.join(directory, "typologies.png")))
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate figures of stored ANIMO batch results")
+    parser.add_argument("results", help="results directory written by results.ResultsStore")
+    parser.add_argument("--output", default="simulation_report")
+    parser.add_argument("--value", choices=list(VALUE_LABELS), default="new_members")
+    parser.add_argument("--no-typologies", action="store_true", help="skip the member typology histograms")
+    args = parser.parse_args(argv)
+    for path in report(ResultsStore(args.results), args.output, value=args.value,
+                       typologies=not args.no_typologies):
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
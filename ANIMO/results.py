@@ -0,0 +1,161 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from stopping import describe_policies
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet output is optional, compressed NPZ needs numpy only
+    pyarrow = None
+
+
+# Run specification fields that identify a replicate on disk (the per-run seed follows from them)
+KEY_FIELDS = ("scenario", "num_members", "num_prospects", "width", "height", "replicate", "engine",
+              "common_random_numbers", "sweep_seed", "parameters", "network", "network_options", "scenario_overrides",
+              "stopping")
+
+# Fields that identify a configuration: replicates of one configuration differ in their replicate number only
+CONFIGURATION_FIELDS = tuple(name for name in KEY_FIELDS if name != "replicate")
+
+FORMATS = {"parquet": ".parquet", "npz": ".npz"}
+
+
+# Supporting Functions
+#######################
+def key_fields(run_spec, names=KEY_FIELDS):
+    # JSON-ready values of the given run specification fields
+    fields = {}
+    for name in names:
+        value = run_spec.get(name)
+        if name == "stopping":
+            value = describe_policies(value)
+        fields[name] = value.to_dict() if hasattr(value, "to_dict") else value
+    return fields
+
+
+def run_key(run_spec):
+    # Stable identifier of a replicate, so that a resumed sweep recognises the runs it already stored
+    encoded = json.dumps(key_fields(run_spec), sort_keys=True, default=str).encode()
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+def configuration_key(run_spec):
+    # Stable identifier of the configuration of a replicate, shared by all its replicates
+    encoded = json.dumps(key_fields(run_spec, CONFIGURATION_FIELDS), sort_keys=True, default=str).encode()
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+class ResultsStore:
+    """
+    Append-only, long-format results dataset: one file per finished replicate in a directory.
+
+    Each replicate is written as soon as it finishes (atomically, so a crash never leaves a partial
+    chunk behind), and a resumed sweep skips the replicates whose chunk is already on disk. Reading
+    goes chunk by chunk, so memory use does not grow with the number of replicates.
+    """
+
+    def __init__(self, directory, format=None):
+        if format is None:
+            format = "parquet" if pyarrow is not None else "npz"
+        if format not in FORMATS:
+            raise ValueError(f"Unknown results format: {format}")
+        if format == "parquet" and pyarrow is None:
+            raise ImportError("Parquet results need pyarrow; use format='npz' instead")
+        self.directory = directory
+        self.format = format
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, run_spec):
+        # File name (without extension) of a replicate
+        return run_key(run_spec)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + FORMATS[self.format])
+
+    def completed_runs(self):
+        # Keys of the replicates already stored (in either format)
+        keys = set()
+        for file_name in os.listdir(self.directory):
+            key, extension = os.path.splitext(file_name)
+            if extension in FORMATS.values():
+                keys.add(key)
+        return keys
+
+    def __contains__(self, run_spec):
+        key = self.key(run_spec)
+        return any(os.path.exists(os.path.join(self.directory, key + extension)) for extension in FORMATS.values())
+
+    def write_run(self, run_spec, frame):
+        # Store the long-format results of one replicate
+        path = self.path(self.key(run_spec))
+        temporary_path = path + ".tmp"
+        if self.format == "parquet":
+            pyarrow.parquet.write_table(pyarrow.Table.from_pandas(frame, preserve_index=False), temporary_path)
+        else:
+            arrays = {}
+            for column in frame.columns:
+                values = frame[column].to_numpy()
+                # Text columns are stored as fixed-width unicode arrays, so that no pickling is needed
+                arrays[column] = values if values.dtype.kind in "biuf" else values.astype(str)
+            with open(temporary_path, "wb") as file:
+                np.savez_compressed(file, **arrays)
+        os.replace(temporary_path, path)
+
+    def read_chunk(self, path, columns=None):
+        if path.endswith(FORMATS["parquet"]):
+            return pyarrow.parquet.read_table(path, columns=columns).to_pandas()
+        with np.load(path) as chunk:
+            return pd.DataFrame({column: chunk[column] for column in (columns or chunk.files)})
+
+    def read_run(self, run_spec, columns=None):
+        # The stored results of one replicate, or None if it is not stored
+        key = self.key(run_spec)
+        for extension in FORMATS.values():
+            path = os.path.join(self.directory, key + extension)
+            if os.path.exists(path):
+                return self.read_chunk(path, columns)
+        return None
+
+    def iter_chunks(self, columns=None):
+        # Stored replicates one at a time, ordered by run id
+        paths = [os.path.join(self.directory, file_name) for file_name in os.listdir(self.directory)
+                 if os.path.splitext(file_name)[1] in FORMATS.values()]
+        run_ids = {path: self.read_chunk(path, ["run_id"])["run_id"] for path in paths}
+        for path in sorted(paths, key=lambda path: run_ids[path].iloc[0] if len(run_ids[path]) else -1):
+            yield self.read_chunk(path, columns)
+
+    def read(self, columns=None):
+        # The whole dataset as one DataFrame (for datasets that fit in memory)
+        chunks = list(self.iter_chunks(columns))
+        if not chunks:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(chunks, ignore_index=True)
+
+    def to_csv(self, file_path):
+        # Export the dataset to a single CSV file, one replicate at a time
+        header = True
+        with open(file_path, "w", newline="") as file:
+            for chunk in self.iter_chunks():
+                chunk.to_csv(file, index=False, header=header)
+                header = False
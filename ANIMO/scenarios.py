@@ -0,0 +1,92 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import numpy as np
+
+
+"""Applying the "Diffusion of Innovation theory": adopter groups of the Prospect class"""
+ADOPTER_GROUPS = ("Innovator", "Early Adopter", "Early Majority", "Late Majority", "Laggard")
+ADOPTER_GROUP_INDEX = {group: i for i, group in enumerate(ADOPTER_GROUPS)}
+
+# Mean receptivity towards innovation per adopter group
+RECEPTIVITY_MEANS = (0.85, 0.7, 0.5, 0.3, 0.15)
+
+# Mean percentage (threshold) of friends needed per adopter group
+FRIENDS_THRESHOLD_MEANS = (0.2, 0.4, 0.6, 0.75, 0.9)
+
+# Standard deviation of the receptivity and threshold draws
+NORMAL_SCALE = np.sqrt(0.05)
+
+
+"""Scenario / "world narrative" table"""
+# adopter_group_fractions: share of prospects per adopter group (the last group takes the remainder)
+# join_probability: chance of joining once the friends threshold is exceeded
+# friends_threshold_means: mean percentage of friends needed per adopter group
+# contact_range: mixture used for reach, vision and number of friends (see custom_random), as
+#                (probability, lowest value, highest value) components
+SCENARIOS = {
+    "Familiar": {
+        "adopter_group_fractions": (0.025, 0.135, 0.34, 0.34, 0.16),
+        "join_probability": 0.5,
+        "friends_threshold_means": FRIENDS_THRESHOLD_MEANS,
+        "contact_range": ((1.0, 1, 4),),
+    },
+    "Fragmented": {
+        "adopter_group_fractions": (0.005, 0.075, 0.34, 0.34, 0.24),
+        "join_probability": 0.4,
+        "friends_threshold_means": FRIENDS_THRESHOLD_MEANS,
+        "contact_range": ((0.8, 0, 2), (0.2, 3, 5)),
+    },
+    "Unified": {
+        "adopter_group_fractions": (0.065, 0.175, 0.34, 0.34, 0.08),
+        "join_probability": 0.6,
+        "friends_threshold_means": FRIENDS_THRESHOLD_MEANS,
+        "contact_range": ((0.2, 0, 2), (0.8, 3, 5)),
+    },
+}
+
+# Settings that can be given as overrides only
+# member_reach_range: contact_range components for the member reach alone (vision and number of friends
+#                     keep the scenario's contact_range)
+OPTIONAL_SETTINGS = ("member_reach_range",)
+
+
+def get_scenario(name, overrides=None):
+    # Settings of a scenario, optionally with some entries replaced (e.g. {"join_probability": 0.3})
+    if name not in SCENARIOS:
+        raise ValueError(f"Unknown scenario '{name}', expected one of {', '.join(SCENARIOS)}")
+    if not overrides:
+        return SCENARIOS[name]
+    unknown = set(overrides) - set(SCENARIOS[name]) - set(OPTIONAL_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown scenario settings: {', '.join(sorted(unknown))}")
+    return dict(SCENARIOS[name], **overrides)
+
+
+def draw_contact_range(world_narrative, size, rng, overrides=None, setting="contact_range"):
+    # Vectorized counterpart of custom_random(): two uniform draws per agent whatever the scenario,
+    # so that agents keep their random numbers across scenarios
+    settings = get_scenario(world_narrative, overrides)
+    components = settings.get(setting, settings["contact_range"])
+    choice = rng.random(size)
+    uniform = rng.random(size)
+    cumulative = np.cumsum([probability for probability, _, _ in components])
+    component = np.minimum(np.searchsorted(cumulative, choice, side="right"), len(components) - 1)
+    low = np.array([low for _, low, _ in components])[component]
+    high = np.array([high for _, _, high in components])[component]
+    return low + (uniform * (high - low + 1)).astype(np.int64)
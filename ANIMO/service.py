@@ -0,0 +1,548 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import glob
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import numpy as np
+import pandas as pd
+from batch import make_run_specs, run_single, RESULT_COLUMNS
+from community import ENGINES
+from network import TOPOLOGIES
+from parameters import load_parameters
+from results import KEY_FIELDS, FORMATS, ResultsStore, key_fields
+from scenarios import SCENARIOS
+from stopping import MaxSteps, Saturation
+
+"""Local job service: queued batch runs whose replicates are cached across studies.
+
+A job is a study given as a JSON specification, for example
+
+    {"scenario": ["Familiar", "Unified"], "num_members": 100, "num_prospects": [1000, 5000],
+     "grid_size": [[500, 500]], "replicates": 20, "seed": 7, "engine": "array",
+     "parameters": {"env_concern_mean": 0.6}, "max_steps": 500}
+
+Missing fields are taken from the workbook (input_data.xlsx, or "workbook"); "parameters" overrides single
+workbook values. Every replicate is cached under a hash of everything that determines its results (the
+run specification with the input parameters and its seed, the stopping policies and the code version),
+so a repeated study is answered from the cache at once and a study that overlaps an earlier one (more
+replicates, one more scenario) only computes the replicates that are new. Replicate r of a configuration
+always runs on the same seed, whatever study asks for it: jobs are run on common random numbers. The cache
+is a directory of result files that is kept under a size limit by evicting the least recently used ones.
+
+    python service.py serve --cache job_cache --max-cache-mb 2048      # HTTP API on 127.0.0.1:8600
+    python service.py submit study.json --wait --output results.csv   # queue a study and fetch its results
+    python service.py status                                          # all jobs of the running service
+    python service.py run study.json --output results.csv             # same, without a server
+
+HTTP API: POST /jobs (specification) returns the job, GET /jobs and GET /jobs/<id> its status, GET
+/jobs/<id>/results the long-format results (CSV, or JSON with ?format=json) and GET /cache the cache size."""
+
+DEFAULT_ADDRESS = ("127.0.0.1", 8600)
+DEFAULT_CACHE = "job_cache"
+DEFAULT_MAX_BYTES = 1 << 30
+
+# Fields of a job specification and their defaults (None: from the workbook)
+SPEC_FIELDS = {
+    "workbook": "input_data.xlsx",
+    "parameters": {},
+    "scenario": None,
+    "num_members": None,
+    "num_prospects": None,
+    "grid_size": None,
+    "replicates": None,
+    "seed": 0,
+    "engine": "mesa",
+    "network": "uniform",
+    "network_options": None,
+    "scenario_overrides": None,
+    "max_steps": None,
+}
+
+_code_version = None
+
+
+# Supporting Functions
+#######################
+def code_version():
+    # Hash of the model sources and the numpy version: any edit to the code starts a fresh cache
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha1(np.__version__.encode())
+        for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py"))):
+            with open(path, "rb") as file:
+                digest.update(os.path.basename(path).encode() + b"\0" + file.read())
+        _code_version = digest.hexdigest()[:16]
+    return _code_version
+
+
+def cache_key(run_spec):
+    # Everything the results of a replicate depend on, except its place in a study (run id)
+    fields = key_fields(run_spec, KEY_FIELDS + ("seed",))
+    fields["code"] = code_version()
+    encoded = json.dumps(fields, sort_keys=True, default=str).encode()
+    return hashlib.sha1(encoded).hexdigest()[:24]
+
+
+def as_list(value):
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def normalize_spec(spec):
+    # Complete a job specification with its defaults, so that equal studies are recognised
+    if not isinstance(spec, dict):
+        raise ValueError("A job specification must be a JSON object")
+    unknown = set(spec) - set(SPEC_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown job field(s): {', '.join(sorted(unknown))}")
+    spec = dict(SPEC_FIELDS, **spec)
+    parameters = load_parameters(spec["workbook"])
+    try:
+        parameters = parameters.replace(**spec["parameters"])
+    except TypeError as error:
+        raise ValueError(str(error)) from None
+    if spec["scenario"] is None:
+        spec["scenario"] = parameters.scenario
+    for name in ("num_members", "num_prospects"):
+        if spec[name] is None:
+            spec[name] = getattr(parameters, name)
+    if spec["grid_size"] is None:
+        spec["grid_size"] = [[parameters.width, parameters.height]]
+    if spec["replicates"] is None:
+        spec["replicates"] = parameters.batch_runs_number
+    spec["scenario"] = as_list(spec["scenario"])
+    for scenario in spec["scenario"]:
+        if scenario not in SCENARIOS:
+            raise ValueError(f"Unknown scenario '{scenario}', expected one of {', '.join(SCENARIOS)}")
+    spec["num_members"] = [int(value) for value in as_list(spec["num_members"])]
+    spec["num_prospects"] = [int(value) for value in as_list(spec["num_prospects"])]
+    if spec["grid_size"] and not isinstance(spec["grid_size"][0], (list, tuple)):
+        spec["grid_size"] = [spec["grid_size"]]
+    spec["grid_size"] = [[int(width), int(height)] for width, height in spec["grid_size"]]
+    if int(spec["replicates"]) < 1:
+        raise ValueError("A job needs at least one replicate")
+    spec["replicates"] = int(spec["replicates"])
+    spec["seed"] = int(spec["seed"])
+    if spec["engine"] not in ENGINES:
+        raise ValueError(f"Unknown engine '{spec['engine']}', expected one of {', '.join(ENGINES)}")
+    if spec["network"] not in TOPOLOGIES:
+        raise ValueError(f"Unknown network '{spec['network']}', expected one of {', '.join(TOPOLOGIES)}")
+    if not isinstance(spec["network_options"] or {}, dict):
+        raise ValueError("network_options must be a JSON object")
+    return spec, parameters
+
+
+def make_job_runs(spec, parameters):
+    # Run specifications of a normalized job; every configuration spawns its replicate seeds from the job seed
+    stopping = None if spec["max_steps"] is None else [Saturation(), MaxSteps(int(spec["max_steps"]))]
+    run_specs = []
+    for scenario in spec["scenario"]:
+        for members in spec["num_members"]:
+            for prospects in spec["num_prospects"]:
+                for width, height in spec["grid_size"]:
+                    run_specs += make_run_specs([scenario], [members], [prospects], [(width, height)],
+                                                spec["replicates"], seed=spec["seed"], engine=spec["engine"],
+                                                common_random_numbers=True, parameters=parameters,
+                                                stopping=stopping, network=spec["network"],
+                                                network_options=spec["network_options"],
+                                                scenario_overrides=spec["scenario_overrides"])
+    for run_id, run_spec in enumerate(run_specs):
+        run_spec["run_id"] = run_id
+    return run_specs
+
+
+def job_id(spec, parameters):
+    encoded = json.dumps([spec, parameters.to_dict(), code_version()], sort_keys=True, default=str).encode()
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+class ResultCache(ResultsStore):
+    """
+    Replicate results keyed by cache_key(), in the ResultsStore file format, kept under max_bytes.
+
+    Reading an entry marks it as used (its modification time), and after every write the least recently
+    used entries are removed until the cache fits again. Entries of unfinished jobs are pinned and never
+    evicted, so the cache may exceed its limit while (and after) a study larger than the limit runs.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE, max_bytes=DEFAULT_MAX_BYTES, format="npz"):
+        super().__init__(directory, format)
+        self.max_bytes = max_bytes
+        self.lock = threading.RLock()
+        self.pinned = {}
+        self.size = sum(os.path.getsize(path) for path in self.entries())
+
+    def key(self, run_spec):
+        return cache_key(run_spec)
+
+    def entries(self):
+        return [os.path.join(self.directory, file_name) for file_name in os.listdir(self.directory)
+                if os.path.splitext(file_name)[1] in FORMATS.values()]
+
+    def __contains__(self, run_spec):
+        # Looking an entry up counts as using it
+        key = self.key(run_spec)
+        with self.lock:
+            for extension in FORMATS.values():
+                path = os.path.join(self.directory, key + extension)
+                if os.path.exists(path):
+                    os.utime(path)
+                    return True
+        return False
+
+    def read_run(self, run_spec, columns=None):
+        key = self.key(run_spec)
+        with self.lock:
+            for extension in FORMATS.values():
+                path = os.path.join(self.directory, key + extension)
+                if os.path.exists(path):
+                    os.utime(path)
+                    return self.read_chunk(path, columns)
+        return None
+
+    def write_run(self, run_spec, frame):
+        with self.lock:
+            path = self.path(self.key(run_spec))
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            super().write_run(run_spec, frame)
+            self.size += os.path.getsize(path) - previous
+            self.evict()
+
+    def pin(self, keys, count=1):
+        with self.lock:
+            for key in keys:
+                self.pinned[key] = self.pinned.get(key, 0) + count
+                if self.pinned[key] <= 0:
+                    del self.pinned[key]
+
+    def evict(self):
+        # Remove least recently used entries until the cache fits
+        with self.lock:
+            if self.size <= self.max_bytes:
+                return
+            for path in sorted(self.entries(), key=os.path.getmtime):
+                if os.path.splitext(os.path.basename(path))[0] in self.pinned:
+                    continue
+                self.size -= os.path.getsize(path)
+                os.remove(path)
+                if self.size <= self.max_bytes:
+                    break
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries()), "bytes": self.size, "max_bytes": self.max_bytes,
+                    "pinned": len(self.pinned)}
+
+
+class Job:
+    # A submitted study and the progress of its replicates
+    def __init__(self, id, spec, run_specs, cache):
+        self.id = id
+        self.spec = spec
+        self.run_specs = run_specs
+        self.keys = [cache.key(run_spec) for run_spec in run_specs]
+        self.status = "queued"
+        self.cached = 0
+        self.computed = 0
+        self.remaining = 0
+        self.errors = []
+        self.submitted = time.time()
+        self.finished = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {"id": self.id, "status": self.status, "replicates": len(self.run_specs), "cached": self.cached,
+                "computed": self.computed, "remaining": self.remaining, "errors": self.errors[:10],
+                "seconds": (self.finished or time.time()) - self.submitted, "spec": self.spec}
+
+
+class JobService:
+    """
+    Queues the uncached replicates of submitted jobs onto a process pool and fills the cache with them.
+
+    A replicate that another job is already computing is not started twice: the later job waits for the
+    same run. Submitting a study that was submitted before returns the same job, at once if all of its
+    replicates are still cached.
+    """
+
+    def __init__(self, cache=None, processes=None):
+        self.cache = cache if cache is not None else ResultCache()
+        self.executor = ProcessPoolExecutor(max_workers=processes)
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.running = {}  # Cache key of every replicate being computed -> jobs waiting for it
+
+    def submit(self, spec):
+        spec, parameters = normalize_spec(spec)
+        id = job_id(spec, parameters)
+        with self.lock:
+            job = self.jobs.get(id)
+            if job is not None and job.status in ("queued", "running"):
+                return job
+            if job is None:
+                job = Job(id, spec, make_job_runs(spec, parameters), self.cache)
+                self.jobs[id] = job
+            job.status = "running"
+            job.computed = 0
+            job.submitted = time.time()
+            job.errors = []
+            job.finished = None
+            job.done.clear()
+            self.cache.pin(job.keys)
+            missing = {}
+            for key, run_spec in zip(job.keys, job.run_specs):
+                if key in missing or key in self.running:
+                    continue
+                if run_spec in self.cache:
+                    continue
+                missing[key] = run_spec
+            waiting = [key for key in set(job.keys) if key in self.running or key in missing]
+            job.remaining = len(waiting)
+            job.cached = len(set(job.keys)) - job.remaining
+            for key in waiting:
+                self.running.setdefault(key, []).append(job)
+            if job.remaining == 0:
+                self.finish(job)
+        # Outside the lock: the callback of a run that already finished is called right away
+        for key, run_spec in missing.items():
+            future = self.executor.submit(run_single, run_spec)
+            future.add_done_callback(lambda future, key=key: self.store(key, future))
+        return job
+
+    def get(self, id):
+        with self.lock:
+            return self.jobs.get(id)
+
+    def list_jobs(self):
+        # Snapshot of the jobs, as handler threads may submit new ones meanwhile
+        with self.lock:
+            return list(self.jobs.values())
+
+    def store(self, key, future):
+        # Called in the executor's thread when a replicate finished
+        try:
+            run_spec, frame = future.result()
+            self.cache.write_run(run_spec, frame)
+            error = None
+        except Exception as exception:
+            error = f"{type(exception).__name__}: {exception}"
+        with self.lock:
+            for job in self.running.pop(key, []):
+                job.remaining -= 1
+                if error is None:
+                    job.computed += 1
+                else:
+                    job.errors.append(error)
+                if job.remaining == 0:
+                    self.finish(job)
+
+    def finish(self, job):
+        job.status = "failed" if job.errors else "done"
+        job.finished = time.time()
+        # Unpinned entries stay until a later write needs their space, so the results can still be fetched
+        self.cache.pin(job.keys, count=-1)
+        job.done.set()
+
+    def results(self, id):
+        # Long-format results of a finished job, or None if some replicates were evicted (the job is resubmitted)
+        job = self.get(id)
+        frames = []
+        for run_spec in job.run_specs:
+            frame = self.cache.read_run(run_spec)
+            if frame is None:
+                self.submit(job.spec)
+                return None
+            frame["run_id"] = run_spec["run_id"]
+            frames.append(frame)
+        return pd.concat(frames, ignore_index=True)[RESULT_COLUMNS]
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+def run_job(spec, cache=None, processes=None):
+    # Run a job in this process and return its results (no server needed)
+    service = JobService(cache, processes)
+    try:
+        job = service.submit(spec)
+        while True:
+            job.done.wait()
+            if job.status == "failed":
+                raise RuntimeError(f"Job {job.id} failed: {job.errors[0]}")
+            results = service.results(job.id)
+            if results is not None:
+                return results
+    finally:
+        service.close()
+
+
+# HTTP API
+#######################
+class ServiceHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def send(self, status, body, content_type="application/json"):
+        if content_type == "application/json":
+            body = json.dumps(body, default=str)
+        body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            return self.send(404, {"error": "not found"})
+        try:
+            spec = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            job = self.service.submit(spec)
+        except (ValueError, TypeError, KeyError, FileNotFoundError) as error:
+            return self.send(400, {"error": f"Invalid job specification: {error}"})
+        self.send(200 if job.status == "done" else 202, job.to_dict())
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        parts = [part for part in path.split("/") if part]
+        if parts == ["jobs"]:
+            return self.send(200, [job.to_dict() for job in self.service.list_jobs()])
+        if parts == ["cache"]:
+            return self.send(200, self.service.cache.stats())
+        job = self.service.get(parts[1]) if len(parts) >= 2 and parts[0] == "jobs" else None
+        if job is None:
+            return self.send(404, {"error": "not found"})
+        if len(parts) == 2:
+            return self.send(200, job.to_dict())
+        if parts[2:] != ["results"]:
+            return self.send(404, {"error": "not found"})
+        results = self.service.results(job.id) if job.status == "done" else None
+        if results is None:
+            return self.send(409, job.to_dict())
+        if "format=json" in query:
+            return self.send(200, results.to_dict("records"))
+        self.send(200, results.to_csv(index=False), "text/csv")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ServiceServer(ThreadingHTTPServer):
+    # Room for bursts of concurrent clients (the default backlog of 5 resets the connections beyond it)
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def serve(address=DEFAULT_ADDRESS, cache=None, processes=None):
+    service = JobService(cache, processes)
+    handler = type("Handler", (ServiceHandler,), {"service": service})
+    server = ServiceServer(address, handler)
+    print(f"Job service on http://{address[0]}:{address[1]}, cache in {service.cache.directory}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+def request(url, data=None):
+    # JSON (or text) response of the service; HTTP errors carry the job status or error message
+    body = None if data is None else json.dumps(data).encode()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=body, method="POST" if body else "GET")) as response:
+            status, content_type, content = response.status, response.headers.get("Content-Type"), response.read()
+    except urllib.error.HTTPError as error:
+        status, content_type, content = error.code, error.headers.get("Content-Type"), error.read()
+    if content_type == "application/json":
+        return status, json.loads(content)
+    return status, content.decode()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local job service for cached ANIMO batch runs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="start the HTTP API on localhost")
+    run_parser = commands.add_parser("run", help="run a study without a server")
+    for command in (serve_parser, run_parser):
+        command.add_argument("--cache", default=DEFAULT_CACHE, help="cache directory")
+        command.add_argument("--max-cache-mb", type=float, default=DEFAULT_MAX_BYTES / 2 ** 20)
+        command.add_argument("--processes", type=int, default=None)
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_ADDRESS[1])
+    submit_parser = commands.add_parser("submit", help="queue a study on the running service")
+    status_parser = commands.add_parser("status", help="status of one or all jobs")
+    status_parser.add_argument("job", nargs="?")
+    for command in (run_parser, submit_parser):
+        command.add_argument("spec", help="JSON file with the job specification")
+        command.add_argument("--output", help="CSV file for the results")
+    submit_parser.add_argument("--wait", action="store_true", help="wait for the job and fetch its results")
+    for command in (submit_parser, status_parser):
+        command.add_argument("--url", default=f"http://{DEFAULT_ADDRESS[0]}:{DEFAULT_ADDRESS[1]}")
+    args = parser.parse_args(argv)
+
+    if args.command in ("serve", "run"):
+        cache = ResultCache(args.cache, int(args.max_cache_mb * 2 ** 20))
+        if args.command == "serve":
+            serve((DEFAULT_ADDRESS[0], args.port), cache, args.processes)
+            return 0
+    if args.command == "status":
+        status, body = request(f"{args.url}/jobs" + (f"/{args.job}" if args.job else ""))
+        print(json.dumps(body, indent=2, default=str))
+        return 0 if status == 200 else 1
+    with open(args.spec) as file:
+        spec = json.load(file)
+    if args.command == "run":
+        results = run_job(spec, cache, args.processes)
+    else:
+        status, job = request(f"{args.url}/jobs", spec)
+        if status >= 400:
+            print(job.get("error", job))
+            return 1
+        print(f"Job {job['id']}: {job['cached']} of {job['replicates']} replicates cached")
+        if not args.wait and not args.output:
+            return 0
+        while True:
+            status, results = request(f"{args.url}/jobs/{job['id']}/results")
+            if status == 200:
+                break
+            if status != 409 or results["status"] == "failed":
+                print(json.dumps(results, indent=2, default=str))
+                return 1
+            time.sleep(0.5)
+        results = pd.read_csv(io.StringIO(results))
+    if args.output:
+        results.to_csv(args.output, index=False)
+        print(f"{len(results)} rows saved to {args.output}")
+    else:
+        print(results.groupby(["scenario", "num_members", "num_prospects", "width", "height"])["run_id"].nunique()
+              .rename("replicates").to_string())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
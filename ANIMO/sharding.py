@@ -0,0 +1,375 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import multiprocessing
+import os
+import weakref
+from multiprocessing import shared_memory
+from types import SimpleNamespace
+import numpy as np
+from engine import ArrayEngine, MOORE_STEPS, expand_ranges, group_by_cell
+from kernels import select_backend
+
+"""Domain-decomposed array engine (engine="sharded"): one model replicate spread over the cores of a node.
+
+The torus is split into vertical strips (tiles) of columns, each owned by a worker process. Agent arrays
+live in shared memory; a worker moves, and runs the contacts and friend checks of, the agents standing on
+its tile. After moving, agents that crossed into another tile migrate to its owner, and every non-joined
+prospect within the largest member reach of another tile (its halo) is sent to that tile, which reads the
+positions from shared memory. Joins are applied by the model process between the phases, so the joined
+statuses and the joined-friend counters of followers on other tiles (the cross-tile friend updates) have a
+single writer and the workers never write the same memory.
+
+Every tile draws from its own per-step streams (see RandomStreams.tile_seed), so a run does not depend on
+the timing of the workers but does depend on the number of tiles, and matches the single-process engines
+statistically rather than draw by draw."""
+
+# Arrays of the engine that are placed in shared memory
+SHARED_ARRAYS = ("member_x", "member_y", "prospect_x", "prospect_y", "joined", "num_friends_joined", "member_reach",
+                 "convincing_prowess", "receptivity", "adopter_group", "degree")
+
+TILE_STREAMS = ("movement", "contact", "peer")
+
+
+# Supporting Functions
+#######################
+class SharedArrays:
+    # NumPy arrays backed by named shared memory blocks, created by the model process or attached by a worker
+
+    def __init__(self):
+        self.blocks = []
+        self.arrays = {}
+        self.layout = {}
+
+    def create(self, name, values):
+        values = np.ascontiguousarray(values)
+        block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        array = np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)
+        array[...] = values
+        self.blocks.append(block)
+        self.arrays[name] = array
+        self.layout[name] = (block.name, values.shape, values.dtype.str)
+        return array
+
+    @classmethod
+    def attach(cls, layout):
+        shared = cls()
+        for name, (block_name, shape, dtype) in layout.items():
+            block = shared_memory.SharedMemory(name=block_name)
+            shared.blocks.append(block)
+            shared.arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        shared.layout = dict(layout)
+        return shared
+
+    def close(self, unlink=False):
+        self.arrays = {}
+        for block in self.blocks:
+            if unlink:
+                block.unlink()
+            try:
+                block.close()
+            except BufferError:
+                pass  # Arrays still in use keep the mapping alive until they are collected
+        self.blocks = []
+
+
+def tile_bounds(width, tiles):
+    # First column of every tile and one past the last; tiles are at least one column wide
+    tiles = max(1, min(int(tiles), width))
+    return np.linspace(0, width, tiles + 1).astype(np.int64)
+
+
+def halo_tiles(bounds, width, halo):
+    # CSR over the columns: the tiles (other than the owner) whose halo contains column c are
+    # tiles[indptr[c]:indptr[c + 1]]
+    lists = [[] for _ in range(width)]
+    for tile in range(len(bounds) - 1):
+        x0, x1 = int(bounds[tile]), int(bounds[tile + 1])
+        if x1 - x0 + 2 * halo >= width:
+            columns = range(width)
+        else:
+            columns = (np.arange(x0 - halo, x1 + halo) % width).tolist()
+        for column in columns:
+            if not x0 <= column < x1:
+                lists[column].append(tile)
+    indptr = np.concatenate(([0], np.cumsum([len(tiles) for tiles in lists]))).astype(np.int64)
+    return indptr, np.array([tile for tiles in lists for tile in tiles], dtype=np.int64)
+
+
+def split_by_tile(tiles, ids, num_tiles):
+    # ids grouped by destination tile: a list with one sorted id array per tile
+    order = np.lexsort((ids, tiles))
+    tiles, ids = tiles[order], ids[order]
+    starts = np.searchsorted(tiles, np.arange(num_tiles + 1))
+    return [ids[starts[tile]:starts[tile + 1]] for tile in range(num_tiles)]
+
+
+def shutdown(connections, processes, shared):
+    # Stop the workers and release the shared memory (also run when the engine is garbage collected)
+    for connection in connections:
+        try:
+            connection.send(("close",))
+            connection.close()
+        except (OSError, EOFError):
+            pass
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+    shared.close(unlink=True)
+
+
+# Tiles
+#######################
+class TileEngine(ArrayEngine):
+    """
+    The agents of one tile, seen as an ArrayEngine over the tile's window: its columns plus the halo on
+    either side, in local coordinates (the whole grid when the window would wrap around the torus). Runs in
+    a worker process and returns its draws instead of applying joins.
+    """
+
+    def __init__(self, shared, tile, bounds, halo, width, height, settings, kernels):
+        self.arrays = shared.arrays
+        self.tile = tile
+        self.x0, self.x1 = int(bounds[tile]), int(bounds[tile + 1])
+        self.grid_width = width
+        self.height = height
+        if self.x1 - self.x0 + 2 * halo >= width:
+            self.offset, self.width = 0, width
+        else:
+            self.offset, self.width = self.x0 - halo, self.x1 - self.x0 + 2 * halo
+        self.join_probability = settings["join_probability"]
+        self.friends_threshold_means = np.asarray(settings["friends_threshold_means"])
+        self.kernels = select_backend(kernels)
+        self.receptivity = self.arrays["receptivity"]
+        self.model = SimpleNamespace(num_neighbor_queries=0, num_agents_scanned=0)
+        # The tile's agents are set by the first "reset" message, once every worker has started
+        self.members = self.prospects = self.halo_prospects = np.zeros(0, dtype=np.int64)
+        self.leaving_members = self.leaving_prospects = np.zeros(0, dtype=np.int64)
+
+    def reset_active_sets(self):
+        # The members and non-joined prospects standing on the tile, from the shared arrays
+        arrays = self.arrays
+        self.members = np.flatnonzero((arrays["member_x"] >= self.x0) & (arrays["member_x"] < self.x1))
+        self.prospects = np.flatnonzero((arrays["prospect_x"] >= self.x0) & (arrays["prospect_x"] < self.x1) &
+                                        ~arrays["joined"])
+        self.halo_prospects = np.zeros(0, dtype=np.int64)
+        self.leaving_members = self.leaving_prospects = np.zeros(0, dtype=np.int64)
+
+    def start_phase(self, seeds=None):
+        self.model.num_neighbor_queries = self.model.num_agents_scanned = 0
+        if seeds is not None:
+            self.streams = SimpleNamespace(**{name: np.random.default_rng(seed) for name, seed in seeds.items()})
+
+    def counters(self):
+        return self.model.num_neighbor_queries, self.model.num_agents_scanned
+
+    def move_tile(self, strip_of, halo_indptr, halo_tiles, num_tiles):
+        """
+        Random step of the tile's members and non-joined prospects (written to the shared positions).
+        Returns, per destination tile, the members and prospects that moved onto it and the prospects in its halo.
+        """
+        arrays = self.arrays
+        self.prospects = self.prospects[~arrays["joined"][self.prospects]]
+        member_choice = self.streams.movement.integers(len(MOORE_STEPS), size=self.members.size)
+        prospect_choice = self.streams.movement.integers(len(MOORE_STEPS), size=self.prospects.size)
+        for x, y, moving, choice in ((arrays["member_x"], arrays["member_y"], self.members, member_choice),
+                                     (arrays["prospect_x"], arrays["prospect_y"], self.prospects, prospect_choice)):
+            if self.kernels is not None:
+                self.kernels.random_walk(x, y, moving, choice, MOORE_STEPS, self.grid_width, self.height)
+            else:
+                x[moving] = (x[moving] + MOORE_STEPS[choice, 0]) % self.grid_width
+                y[moving] = (y[moving] + MOORE_STEPS[choice, 1]) % self.height
+        self.model.num_agents_scanned += int(self.members.size + self.prospects.size)
+
+        member_tile = strip_of[arrays["member_x"][self.members]]
+        prospect_x = arrays["prospect_x"][self.prospects]
+        prospect_tile = strip_of[prospect_x]
+        leaving = member_tile != self.tile
+        self.leaving_members = self.members[leaving]
+        members = split_by_tile(member_tile[leaving], self.leaving_members, num_tiles)
+        leaving = prospect_tile != self.tile
+        self.leaving_prospects = self.prospects[leaving]
+        prospects = split_by_tile(prospect_tile[leaving], self.leaving_prospects, num_tiles)
+        # Halo: every tile whose window contains the prospect's column, other than the one it stands on
+        counts = halo_indptr[prospect_x + 1] - halo_indptr[prospect_x]
+        destination = halo_tiles[expand_ranges(halo_indptr[prospect_x], counts)]
+        halo = split_by_tile(destination, np.repeat(self.prospects, counts), num_tiles)
+        return members, prospects, halo
+
+    def receive(self, members, prospects, halo):
+        # Members and prospects that moved onto the tile, and the prospects in its halo for this step
+        self.members = np.sort(np.concatenate((np.setdiff1d(self.members, self.leaving_members, assume_unique=True),
+                                               members)))
+        self.prospects = np.sort(np.concatenate((np.setdiff1d(self.prospects, self.leaving_prospects,
+                                                              assume_unique=True), prospects)))
+        self.halo_prospects = halo
+        self.leaving_members = self.leaving_prospects = np.zeros(0, dtype=np.int64)
+
+    def local_x(self, x):
+        return (x - self.offset) % self.grid_width
+
+    def prospects_by_cell(self):
+        # The tile's and the halo's non-joined prospects sorted by (local) cell
+        arrays = self.arrays
+        not_joined = np.concatenate((self.prospects, self.halo_prospects))
+        return group_by_cell(not_joined, self.local_x(arrays["prospect_x"][not_joined]) * self.height +
+                             arrays["prospect_y"][not_joined])
+
+    def contact_tile(self):
+        # Contacts of the tile's members: (convinced prospects, their members, number of pairs)
+        arrays = self.arrays
+        self.num_members = int(self.members.size)
+        self.unconverted = np.concatenate((self.prospects, self.halo_prospects))
+        self.member_x = self.local_x(arrays["member_x"][self.members])
+        self.member_y = arrays["member_y"][self.members]
+        self.member_reach = arrays["member_reach"][self.members]
+        self.convincing_prowess = arrays["convincing_prowess"][self.members]
+        convinced, convincing_members, num_pairs = self.contact_draws()
+        return convinced, self.members[convincing_members], num_pairs
+
+    def check_tile(self):
+        # The friend-check draws of the tile's prospects with friends: (candidates, required number of joined
+        # friends, willing); the model process applies them in index order over all tiles
+        arrays = self.arrays
+        self.prospects = self.prospects[~arrays["joined"][self.prospects]]
+        degree = arrays["degree"]
+        candidates = self.prospects[degree[self.prospects] > 0]
+        self.model.num_agents_scanned += int(self.prospects.size)
+        return (candidates,) + self.peer_draws(candidates, degree, arrays["adopter_group"])
+
+
+def tile_worker(connection, tile, layout, bounds, halo, width, height, settings, kernels):
+    # Worker process of one tile: runs the phases requested by the model process until told to close
+    shared = SharedArrays.attach(layout)
+    engine = TileEngine(shared, tile, bounds, halo, width, height, settings, kernels)
+    strip_of = np.repeat(np.arange(len(bounds) - 1), np.diff(bounds))
+    halo_indptr, halo_tile_list = halo_tiles(bounds, width, halo)
+    try:
+        while True:
+            message = connection.recv()
+            command = message[0]
+            if command == "close":
+                break
+            if command == "reset":
+                engine.reset_active_sets()
+                connection.send(None)
+                continue
+            engine.start_phase(message[1] if command == "move" else None)
+            if command == "move":
+                result = engine.move_tile(strip_of, halo_indptr, halo_tile_list, len(bounds) - 1)
+            elif command == "contact":
+                engine.receive(*message[1:])
+                result = engine.contact_tile()
+            else:
+                result = engine.check_tile()
+            connection.send((result, engine.counters()))
+    except EOFError:
+        pass
+    finally:
+        del engine
+        shared.close()
+
+
+# Model-side engine
+#######################
+class ShardedEngine(ArrayEngine):
+    """
+    ArrayEngine whose agents are split over tile worker processes (see the module docstring).
+
+    tiles: number of tiles and workers (default: the number of cores), at most one per grid column.
+    The model process keeps the shared arrays, so checkpoints, forks and metrics work as for the array
+    engine; call model.close() to stop the workers early (they also stop when the model is collected).
+    """
+
+    def __init__(self, model, kernels="auto", tiles=None):
+        super().__init__(model, kernels=kernels)
+        self.kernel_backend = kernels
+        self.bounds = tile_bounds(self.width, tiles or os.cpu_count() or 1)
+        self.num_tiles = len(self.bounds) - 1
+        self.shared = SharedArrays()
+        self.connections = []
+        self.processes = []
+        self.finalizer = None
+
+    def prospects_find_peers(self):
+        super().prospects_find_peers()
+        # Agent arrays move into shared memory, then the workers start
+        for name in SHARED_ARRAYS:
+            setattr(self, name, self.shared.create(name, getattr(self, name)))
+        self.halo = int(self.member_reach.max()) if self.num_members else 0
+        context = multiprocessing.get_context()
+        for tile in range(self.num_tiles):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=tile_worker, daemon=True,
+                                      args=(worker_connection, tile, self.shared.layout, self.bounds, self.halo,
+                                            self.width, self.height, self.model.settings, self.kernel_backend))
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+        self.finalizer = weakref.finalize(self, shutdown, self.connections, self.processes, self.shared)
+        # Workers take their tiles only when all have started, before any agent moves
+        self.reset_active_sets()
+
+    def close(self):
+        if self.finalizer is not None:
+            self.finalizer()
+
+    def request(self, messages):
+        # Send one message to every tile and gather the results in tile order, adding up the counters
+        for connection, message in zip(self.connections, messages):
+            connection.send(message)
+        results = []
+        for connection in self.connections:
+            result, (num_neighbor_queries, num_agents_scanned) = connection.recv()
+            self.model.num_neighbor_queries += num_neighbor_queries
+            self.model.num_agents_scanned += num_agents_scanned
+            results.append(result)
+        return results
+
+    def reset_active_sets(self):
+        super().reset_active_sets()
+        for connection in self.connections:
+            connection.send(("reset",))
+        for connection in self.connections:
+            connection.recv()
+
+    def move_agents(self):
+        streams = self.streams
+        moved = self.request([("move", {name: streams.tile_seed(name, streams.step, tile) for name in TILE_STREAMS})
+                              for tile in range(self.num_tiles)])
+        # Route the migrating agents and the halo prospects to their tiles, sent with the contact phase
+        self.routed = [tuple(np.concatenate([result[kind][tile] for result in moved]) for kind in range(3))
+                       for tile in range(self.num_tiles)]
+
+    def contact_draws(self):
+        results = self.request([("contact",) + routed for routed in self.routed])
+        convinced = np.concatenate([result[0] for result in results])
+        convincing_members = np.concatenate([result[1] for result in results])
+        return convinced, convincing_members, sum(result[2] for result in results)
+
+    def check_friends_and_join(self):
+        # Joins depend on the friends that joined earlier in the phase, on any tile, so they are found here
+        results = self.request([("check",)] * self.num_tiles)
+        candidates, num_required_neighbors, willing = (np.concatenate(arrays) for arrays in zip(*results))
+        order = np.argsort(candidates)
+        joining = self.join_in_order(candidates[order], num_required_neighbors[order], willing[order])
+        self.join_community(joining)
+        if self.model.events is not None:
+            self.model.events.record_peer(self.model, joining)
@@ -0,0 +1,107 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import numpy as np
+
+
+# Supporting Functions
+#######################
+def has_prospects_nearby(cells, x, y, radius, width, height):
+    # Whether the Moore neighbourhood (centre excluded) of every agent at (x, y) holds a prospect, given the sorted
+    # ids (x * height + y) of the occupied cells. The occupied cells of every column of a neighbourhood are counted
+    # with binary searches, so no grid is allocated and a query costs O(radius log(occupied cells)).
+    x, y, radius = (np.asarray(values, dtype=np.int64) for values in (x, y, radius))
+    if len(cells) == 0 or len(x) == 0:
+        return np.zeros(len(x), dtype=bool)
+    max_radius = int(radius.max())
+    # A neighbourhood wider than the torus covers every column (or row) once
+    all_columns = 2 * radius + 1 >= width
+    all_rows = 2 * radius + 1 >= height
+    y0 = np.where(all_rows, 0, y - radius)
+    y1 = np.where(all_rows, height - 1, y + radius)
+    found = np.zeros(len(x), dtype=np.int64)
+    for k in range(2 * max_radius + 1):
+        dx = k - max_radius
+        in_window = np.where(all_columns, k < width, np.abs(dx) <= radius)
+        base = np.where(all_columns, k, (x + dx) % width) * height
+        # Rows y0..y1 of the column, split where they wrap around the torus
+        lows = (base + np.maximum(y0, 0), base + np.where(y0 < 0, y0 + height, height), base)
+        highs = (base + np.minimum(y1, height - 1) + 1, base + height, base + np.maximum(y1 - height + 1, 0))
+        for low, high in zip(lows, highs):
+            found += in_window * (np.searchsorted(cells, high) - np.searchsorted(cells, low))
+    own = np.minimum(np.searchsorted(cells, x * height + y), len(cells) - 1)
+    return found - (cells[own] == x * height + y) > 0
+
+
+class ProspectIndex:
+    """
+    Prospect-only spatial index over the cells of a torus grid.
+
+    Each occupied cell maps to the prospects that have not joined yet (keyed by unique_id, so that
+    queries return them in a deterministic order). The index is updated incrementally as prospects
+    move or join, and radius queries never touch members or converted prospects.
+    """
+
+    def __init__(self, grid):
+        self.grid = grid
+        self.cells = {}
+
+    def __len__(self):
+        return sum(len(cell) for cell in self.cells.values())
+
+    def add(self, prospect, pos):
+        self.cells.setdefault(pos, {})[prospect.unique_id] = prospect
+
+    def remove(self, prospect):
+        cell = self.cells.get(prospect.pos)
+        if cell is not None and cell.pop(prospect.unique_id, None) is not None and not cell:
+            del self.cells[prospect.pos]
+
+    def move(self, prospect, old_pos, new_pos):
+        # Prospects that have already joined are not indexed
+        cell = self.cells.get(old_pos)
+        if cell is None or prospect.unique_id not in cell:
+            return
+        del cell[prospect.unique_id]
+        if not cell:
+            del self.cells[old_pos]
+        self.add(prospect, new_pos)
+
+    def cell_ids(self):
+        # Sorted ids (x * height + y) of the occupied cells
+        return np.sort(np.array([x * self.grid.height + y for x, y in self.cells], dtype=np.int64))
+
+    def torus_distance(self, pos, other):
+        # Chebyshev (Moore) distance on the torus
+        dx = abs(pos[0] - other[0])
+        dy = abs(pos[1] - other[1])
+        return max(min(dx, self.grid.width - dx), min(dy, self.grid.height - dy))
+
+    def get_prospects(self, pos, radius):
+        # Non-joined prospects within the Moore neighbourhood of pos (centre excluded)
+        if radius < 1:
+            return []
+        neighborhood_size = (2 * radius + 1) ** 2 - 1
+        if len(self.cells) < neighborhood_size:
+            # Sparse index: scanning the occupied cells is cheaper than scanning the neighbourhood
+            cells = [cell for cell_pos, cell in self.cells.items()
+                     if cell_pos != pos and self.torus_distance(pos, cell_pos) <= radius]
+        else:
+            neighborhood = self.grid.get_neighborhood(pos, moore=True, include_center=False, radius=radius)
+            cells = [self.cells[cell_pos] for cell_pos in neighborhood if cell_pos in self.cells]
+        return [prospect for cell in cells for prospect in cell.values()]
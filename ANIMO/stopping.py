@@ -0,0 +1,135 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import time
+
+
+# Step budget applied by run_model when no stopping policies are given
+DEFAULT_MAX_STEPS = 10000
+
+
+class StoppingPolicy:
+    """
+    Decides when EnergyCommunityModel.run_model stops.
+
+    start() is called once before the first step of a run and check() before every step;
+    check() returns a short stop reason, or None to keep running. finish() is called once after the
+    run stopped (with model.stop_reason set).
+    """
+
+    # Attributes that configure the policy, and so take part in the identity of a stored replicate
+    parameters = ()
+
+    def to_dict(self):
+        # Stable description of the policy; None for policies that never stop a run
+        return dict({"policy": type(self).__name__}, **{name: getattr(self, name) for name in self.parameters})
+
+    def start(self, model):
+        pass
+
+    def check(self, model):
+        return None
+
+    def finish(self, model):
+        pass
+
+
+class Saturation(StoppingPolicy):
+    # The original criterion: new_members_count has reached the number of prospects
+    def check(self, model):
+        if model.new_members_count >= model.num_prospects:
+            return "saturated"
+        return None
+
+
+class MaxSteps(StoppingPolicy):
+    parameters = ("max_steps",)
+
+    def __init__(self, max_steps):
+        self.max_steps = max_steps
+
+    def check(self, model):
+        if model.schedule.steps >= self.max_steps:
+            return "max_steps"
+        return None
+
+
+class WallClock(StoppingPolicy):
+    parameters = ("seconds",)
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.started = None
+
+    def start(self, model):
+        self.started = time.perf_counter()
+
+    def check(self, model):
+        if time.perf_counter() - self.started >= self.seconds:
+            return "wall_clock"
+        return None
+
+
+class TargetAdoption(StoppingPolicy):
+    # Stop once the given fraction of prospects has joined the community
+    parameters = ("fraction",)
+
+    def __init__(self, fraction):
+        self.fraction = fraction
+
+    def check(self, model):
+        if model.num_prospects and model.num_joined >= self.fraction * model.num_prospects:
+            return "target_adoption"
+        return None
+
+
+class Plateau(StoppingPolicy):
+    # Stop when adoption grew by at most `tolerance` (a fraction of the prospects) over the last `window` steps
+    parameters = ("window", "tolerance")
+
+    def __init__(self, window=10, tolerance=0.0):
+        self.window = window
+        self.tolerance = tolerance
+        self.history = []
+        self.last_step = None
+
+    def start(self, model):
+        self.history = []
+        self.last_step = None
+
+    def check(self, model):
+        # One sample of the adoption curve per step
+        if model.schedule.steps != self.last_step:
+            self.history.append(model.num_joined)
+            self.last_step = model.schedule.steps
+        if len(self.history) > self.window:
+            del self.history[:-self.window - 1]
+            if self.history[-1] - self.history[0] <= self.tolerance * model.num_prospects:
+                return "plateau"
+        return None
+
+
+def default_policies():
+    return [Saturation(), MaxSteps(DEFAULT_MAX_STEPS)]
+
+
+def describe_policies(policies):
+    # Stable description of the policies of a run (None: the defaults of run_model)
+    if policies is None:
+        policies = default_policies()
+    return [description for description in (policy.to_dict() for policy in policies) if description is not None]
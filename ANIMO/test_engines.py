@@ -0,0 +1,71 @@
+"""
+    Copyright (C) 2024 Technoeconomics of Energy Systems laboratory - University of Piraeus Research Center (TEESlab-UPRC)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import numpy as np
+from community import EnergyCommunityModel
+from parameters import load_parameters
+
+"""The array engine against the mesa path: same rules, so the same adoption in distribution (run with pytest)."""
+
+SEEDS = range(40)
+
+
+# Supporting Functions
+#######################
+def num_joined(engine, seed, parameters, steps=8):
+    model = EnergyCommunityModel(20, 300, 30, 30, scenario="Unified", engine=engine, seed=seed,
+                                 parameters=parameters, collect_data=False)
+    for _ in range(steps):
+        model.step()
+    model.close()
+    return model.num_joined
+
+
+# Tests
+#######################
+def test_join_in_order_matches_sequential_visits():
+    # The batched friend check gives the joins of visiting the candidates one by one
+    parameters = load_parameters()
+    for seed in range(5):
+        model = EnergyCommunityModel(20, 300, 30, 30, scenario="Unified", engine="array", seed=seed,
+                                     parameters=parameters, collect_data=False)
+        for _ in range(3):
+            model.step()
+        engine = model.array_engine
+        rng = np.random.default_rng(seed)
+        candidates = engine.unconverted[engine.degree[engine.unconverted] > 0]
+        num_required_neighbors = engine.degree[candidates] * rng.normal(0.2, 0.3, candidates.size)
+        willing = rng.random(candidates.size) < 0.7
+
+        num_friends_joined = engine.num_friends_joined.copy()
+        expected = []
+        for candidate, required, is_willing in zip(candidates, num_required_neighbors, willing):
+            if num_friends_joined[candidate] > required and is_willing:
+                expected.append(candidate)
+                start, end = engine.followers_indptr[candidate], engine.followers_indptr[candidate + 1]
+                num_friends_joined[engine.followers[start:end]] += 1
+        assert engine.join_in_order(candidates, num_required_neighbors, willing).tolist() == expected
+
+
+def test_engines_agree_in_mean_adoption():
+    # Paired seeds give both engines the same population; the mean difference must be within noise
+    parameters = load_parameters()
+    difference = np.array([num_joined("mesa", seed, parameters) - num_joined("array", seed, parameters)
+                           for seed in SEEDS])
+    standard_error = difference.std(ddof=1) / np.sqrt(len(difference))
+    assert abs(difference.mean()) < 4 * standard_error + 1